@@ -0,0 +1,80 @@
+"""Shared helpers of the benchmarks.
+
+The benchmarks run from the backend directory, next to src, with the same environment as
+the application (see backend/.env.example).
+
+Attributes:
+    SRC_DIR (str): The directory of the Django project.
+    setup_django (function): Configures Django, to use the models outside manage.py.
+    percentile (function): Returns a percentile of sorted samples.
+    summarize (function): Returns the latency statistics of samples.
+    write_report (function): Writes a JSON report to a file or standard output.
+"""
+
+import json
+import os
+import sys
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+)
+
+
+def setup_django():
+    """Configure Django, to use the models outside manage.py."""
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+    import django  # pylint: disable=import-outside-toplevel
+
+    django.setup()
+
+
+def percentile(samples, fraction):
+    """Return a percentile of sorted samples, by the nearest-rank method.
+
+    Args:
+        samples (list): Sorted samples.
+        fraction (float): The percentile, between 0 and 1.
+
+    Returns:
+        float: The sample at the percentile, or 0 without samples.
+    """
+    if not samples:
+        return 0.0
+    rank = max(int(round(fraction * len(samples) + 0.5)) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Return the latency statistics of samples.
+
+    Args:
+        latencies (list): Latencies in seconds.
+        elapsed (float): Duration of the measurement in seconds.
+        errors (int): Number of failed requests among the samples.
+
+    Returns:
+        dict: Request count, errors, requests per second and latency percentiles in milliseconds.
+    """
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+    }
+
+
+def write_report(report, path=None):
+    """Write a JSON report to a file, or to standard output without a path."""
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
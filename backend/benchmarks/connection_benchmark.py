@@ -0,0 +1,74 @@
+"""Benchmark of per-request database connections against persistent ones.
+
+Usage, from the backend directory with the application environment set:
+    python benchmarks/connection_benchmark.py --requests 500
+
+Runs the database work of a request, the request_started and request_finished signals
+around one query, the way Django handles requests, with:
+
+- new: CONN_MAX_AGE 0, a connection is opened and closed by every request.
+- persistent: CONN_MAX_AGE 60, the connection is reused.
+- persistent_checked: CONN_MAX_AGE 60 and CONN_HEALTH_CHECKS, the connection is reused
+  after a check that it still works.
+
+It reports the latency of each mode and the time persistent connections save per
+request, as JSON. The saving grows with the network distance to the database and with
+TLS, so measure against the database the application uses.
+"""
+
+import argparse
+import time
+
+from common import setup_django, summarize, write_report
+
+MODES = {
+    "new": {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False},
+    "persistent": {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": False},
+    "persistent_checked": {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True},
+}
+
+
+def measure(connection, signals, requests):
+    """Return the latency of requests simulated requests, and their duration."""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        signals.request_started.send(sender=None)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        signals.request_finished.send(sender=None)
+        latencies.append(time.perf_counter() - request_started)
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--output", help="Report file. Defaults to standard output.")
+    args = parser.parse_args()
+
+    setup_django()
+
+    # pylint: disable=import-outside-toplevel
+    from django.core import signals
+    from django.db import connection
+
+    report = {"requests": args.requests}
+    for mode, options in MODES.items():
+        connection.close()
+        connection.settings_dict.update(options)
+        measure(connection, signals, 10)
+        latencies, elapsed = measure(connection, signals, args.requests)
+        report[mode] = summarize(latencies, elapsed)
+    connection.close()
+
+    report["saved_ms_per_request"] = round(
+        report["new"]["mean_ms"] - report["persistent_checked"]["mean_ms"], 2
+    )
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
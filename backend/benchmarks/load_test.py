@@ -0,0 +1,438 @@
+"""Load test of the user API.
+
+Usage, from the backend directory with the application environment set:
+    python benchmarks/load_test.py seed --users 2000 --seed-file /tmp/bench-seed.json
+    python benchmarks/load_test.py run --seed-file /tmp/bench-seed.json --concurrency 1,8,32 \\
+        --output current.json
+    python benchmarks/load_test.py compare baseline.json current.json --tolerance 0.1
+
+seed creates users with UserFactory, each with a token, and writes their emails, tokens
+and password to the seed file. run starts a local gunicorn server, unless --url points to
+a running one, and sends a weighted mix of register/, login/, details/ and update/ requests
+from a pool of keep-alive connections, one concurrency level after the other. It reports
+the requests per second and the p50, p95 and p99 latencies of every endpoint as JSON.
+compare exits with status 1 when the current report is slower than the baseline by more
+than the tolerance. Everything runs offline, with the standard library only.
+
+Every client logs in from 127.0.0.1, so the login throttle would turn most logins into
+429 responses: the local server runs without it, unless --login-throttle is given. A
+server given with --url should disable it too, with LOGIN_THROTTLE_IP_BURST=0 and
+LOGIN_THROTTLE_EMAIL_BURST=0. 429 responses are reported as throttled, not as errors, and
+compare flags them.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from common import SRC_DIR, setup_django, summarize, write_report
+
+API_PREFIX = "/api/v1/user/"
+SEED_EMAIL_PREFIX = "bench-"
+DEFAULT_PASSWORD = "bench_secret_123"
+DEFAULT_MIX = "details=60,update=20,login=10,register=10"
+
+
+def seed(args):
+    """Replace the benchmark users with new ones and write the seed file."""
+    setup_django()
+
+    # pylint: disable=import-outside-toplevel
+    import factory.random
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from rest_framework.authtoken.models import Token
+
+    from users.factory import UserFactory
+    from users.models import User
+
+    factory.random.reseed_random(args.random_seed)
+    encoded = make_password(args.password)
+    users = []
+    for index in range(args.users):
+        # password=None skips hashing in the factory, every user shares one hash.
+        user = UserFactory.build(
+            email=f"{SEED_EMAIL_PREFIX}{index}@example.com",
+            phone=f"+1555{index:07d}",
+            password=None,
+        )
+        user.password = encoded
+        users.append(user)
+
+    with transaction.atomic():
+        deleted, _ = User.objects.filter(email__startswith=SEED_EMAIL_PREFIX).delete()
+        users = User.objects.bulk_create(users, batch_size=1000)
+        tokens = Token.objects.bulk_create(
+            [Token(key=Token.generate_key(), user=user) for user in users],
+            batch_size=1000,
+        )
+
+    write_report(
+        {
+            "password": args.password,
+            "users": [
+                {"email": user.email, "token": token.key}
+                for user, token in zip(users, tokens)
+            ],
+        },
+        args.seed_file,
+    )
+    print(
+        f"Deleted {deleted} old benchmark rows, seeded {len(users)} users "
+        f"into {args.seed_file}.",
+        file=sys.stderr,
+    )
+
+
+class Workload:
+    """A weighted mix of requests against the user API.
+
+    Every worker thread gets its own random generator and connection, so that workers do
+    not contend on anything but the server.
+    """
+
+    def __init__(self, url, seed_data, mix, run_id, host_header=None):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        # The Host header must be in ALLOWED_HOSTS, which a local server takes from HOST.
+        self.host_header = host_header or parsed.netloc
+        self.prefix = parsed.path.rstrip("/") + API_PREFIX
+        self.users = seed_data["users"]
+        self.password = seed_data["password"]
+        self.endpoints = list(mix)
+        self.weights = list(mix.values())
+        self.run_id = run_id
+        # Numbers registered users uniquely across workers and concurrency levels.
+        self.sequence = itertools.count(1)
+
+    def request(self, connection, endpoint, rng, number):
+        """Send one request, returning its status code."""
+        user = rng.choice(self.users)
+        headers = {"Content-Type": "application/json", "Host": self.host_header}
+        if endpoint == "details":
+            method, body = "GET", None
+            headers["Authorization"] = f"Token {user['token']}"
+        elif endpoint == "update":
+            method, body = "PATCH", {"first_name": f"Bench{number}"}
+            headers["Authorization"] = f"Token {user['token']}"
+        elif endpoint == "login":
+            method, body = "POST", {"email": user["email"], "password": self.password}
+        else:
+            method = "POST"
+            body = {
+                "email": f"{SEED_EMAIL_PREFIX}{self.run_id}-{number}@example.com",
+                "phone": f"+1666{self.run_id}{number:09d}",
+                "first_name": "Bench",
+                "last_name": "Register",
+                "password": self.password,
+            }
+
+        path = self.prefix + ("update/" if endpoint == "update" else f"{endpoint}/")
+        connection.request(
+            method, path, body=json.dumps(body) if body else None, headers=headers
+        )
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def worker(self, worker, stop, measure_from, random_seed):
+        """Send requests until stop is set, returning the samples after measure_from.
+
+        Returns:
+            dict: Endpoint name to a list of (latency, status code) tuples, the status
+            code being None when the request failed without a response.
+        """
+        rng = random.Random(random_seed + worker)
+        samples = {endpoint: [] for endpoint in self.endpoints}
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        while not stop.is_set():
+            endpoint = rng.choices(self.endpoints, self.weights)[0]
+            number = next(self.sequence)
+            started = time.perf_counter()
+            try:
+                code = self.request(connection, endpoint, rng, number)
+            except (OSError, http.client.HTTPException):
+                code = None
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=60
+                )
+            if started >= measure_from:
+                samples[endpoint].append((time.perf_counter() - started, code))
+        connection.close()
+        return samples
+
+    def run(self, concurrency, warmup, duration, random_seed):
+        """Run the workload at a concurrency level.
+
+        Returns:
+            dict: The statistics of every endpoint, and of all requests under "all".
+        """
+        stop = threading.Event()
+        measure_from = time.perf_counter() + warmup
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(self.worker, worker, stop, measure_from, random_seed)
+                for worker in range(concurrency)
+            ]
+            time.sleep(warmup + duration)
+            stop.set()
+            results = [future.result() for future in futures]
+
+        report = {}
+        every = []
+        for endpoint in self.endpoints:
+            samples = [sample for result in results for sample in result[endpoint]]
+            every.extend(samples)
+            report[endpoint] = self.summarize(samples, duration)
+        report["all"] = self.summarize(every, duration)
+        return report
+
+    @staticmethod
+    def summarize(samples, duration):
+        codes = [code for _, code in samples]
+        stats = summarize(
+            [latency for latency, _ in samples],
+            duration,
+            errors=sum(
+                1 for code in codes if code != 429 and not 200 <= (code or 0) < 300
+            ),
+        )
+        # Rejected by the login throttle, which the results then measure in part.
+        stats["throttled"] = codes.count(429)
+        return stats
+
+
+def free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def local_host_header():
+    """Return the Host header accepted by a local server, the HOST of its environment."""
+    return os.getenv("HOST") or "localhost"
+
+
+def start_server(args):
+    """Start gunicorn on a free local port and wait until it answers.
+
+    Returns:
+        tuple: The server process and its URL.
+    """
+    port = free_port()
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--bind",
+        f"127.0.0.1:{port}",
+        "--workers",
+        str(args.workers),
+        *args.server_args.split(),
+    ]
+    env = dict(os.environ)
+    if not args.login_throttle:
+        # Every client logs in from 127.0.0.1, logins would measure the throttle.
+        env.update(LOGIN_THROTTLE_IP_BURST="0", LOGIN_THROTTLE_EMAIL_BURST="0")
+    process = subprocess.Popen(command, cwd=SRC_DIR, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"The server exited with status {process.returncode}.")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request(
+                "GET", API_PREFIX + "details/", headers={"Host": local_host_header()}
+            )
+            connection.getresponse().read()
+            connection.close()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise SystemExit("The server did not start within 30 seconds.")
+
+
+def parse_mix(value):
+    """Return the endpoint weights of a mix like details=60,login=10."""
+    mix = {}
+    for part in value.split(","):
+        endpoint, _, weight = part.partition("=")
+        if endpoint not in ("register", "login", "details", "update"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint {endpoint!r}")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+def run(args):
+    """Run the workload at every concurrency level and write the report."""
+    with open(args.seed_file, encoding="utf-8") as file:
+        seed_data = json.load(file)
+
+    process = None
+    url = args.url
+    if not url:
+        process, url = start_server(args)
+
+    levels = {}
+    try:
+        workload = Workload(
+            url,
+            seed_data,
+            args.mix,
+            run_id=f"{os.getpid() % 1000:03d}",
+            host_header=None if args.url else local_host_header(),
+        )
+        for concurrency in args.concurrency:
+            print(f"Running {concurrency} concurrent clients...", file=sys.stderr)
+            levels[str(concurrency)] = workload.run(
+                concurrency, args.warmup, args.duration, args.random_seed
+            )
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "meta": {
+            "url": url if args.url else f"local gunicorn {args.server_args}",
+            "mix": args.mix,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed_users": len(seed_data["users"]),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "levels": levels,
+    }
+    write_report(report, args.output)
+    if args.baseline:
+        sys.exit(compare_reports(load(args.baseline), report, args.tolerance))
+
+
+def load(path):
+    """Return a saved report."""
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def compare_reports(baseline, current, tolerance):
+    """Print the changes between two reports.
+
+    A result regresses when its throughput drops, or its p95 or p99 latency grows, by more
+    than the tolerance. Results with 429 responses are flagged as throttled: their
+    throughput and latencies measure the login throttle in part.
+
+    Returns:
+        int: 1 if any result regressed, 0 otherwise.
+    """
+    regressed = False
+    print(
+        f"{'level':>6} {'endpoint':<9} {'metric':<7} {'baseline':>10} {'current':>10} {'change':>8}"
+    )
+    for level, endpoints in current["levels"].items():
+        for endpoint, stats in endpoints.items():
+            base = baseline["levels"].get(level, {}).get(endpoint)
+            if not base:
+                continue
+            before, after = base.get("throttled", 0), stats.get("throttled", 0)
+            if before or after:
+                print(
+                    f"{level:>6} {endpoint:<9} {'429s':<7} {before:>10} {after:>10} "
+                    f"{'':>8} THROTTLED"
+                )
+            for metric, higher_is_better in (
+                ("rps", True),
+                ("p95_ms", False),
+                ("p99_ms", False),
+            ):
+                before, after = base[metric], stats[metric]
+                change = (after - before) / before if before else 0.0
+                worse = -change if higher_is_better else change
+                flag = " REGRESSED" if worse > tolerance else ""
+                regressed = regressed or bool(flag)
+                print(
+                    f"{level:>6} {endpoint:<9} {metric:<7} {before:>10} {after:>10} "
+                    f"{change:>+8.1%}{flag}"
+                )
+    return 1 if regressed else 0
+
+
+def compare(args):
+    sys.exit(compare_reports(load(args.baseline), load(args.current), args.tolerance))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the user API.")
+    commands = parser.add_subparsers(required=True)
+
+    seed_parser = commands.add_parser("seed", help="Create the benchmark users.")
+    seed_parser.add_argument("--users", type=int, default=1000)
+    seed_parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    seed_parser.add_argument("--seed-file", default="bench-seed.json")
+    seed_parser.add_argument("--random-seed", type=int, default=0)
+    seed_parser.set_defaults(handler=seed)
+
+    run_parser = commands.add_parser("run", help="Run the workload and report.")
+    run_parser.add_argument("--seed-file", default="bench-seed.json")
+    run_parser.add_argument(
+        "--url", help="URL of a running server. By default a local gunicorn is started."
+    )
+    run_parser.add_argument("--workers", type=int, default=2)
+    run_parser.add_argument(
+        "--login-throttle",
+        action="store_true",
+        help="Keep the login throttle of the environment in the local server.",
+    )
+    run_parser.add_argument(
+        "--server-args",
+        default="--threads 8 core.wsgi:application",
+        help="Further gunicorn arguments, ending with the application.",
+    )
+    run_parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 8, 32],
+        help="Comma separated numbers of concurrent clients.",
+    )
+    run_parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    run_parser.add_argument(
+        "--duration", type=float, default=10, help="Seconds per level."
+    )
+    run_parser.add_argument(
+        "--warmup", type=float, default=2, help="Unmeasured seconds per level."
+    )
+    run_parser.add_argument("--random-seed", type=int, default=0)
+    run_parser.add_argument(
+        "--output", help="Report file. Defaults to standard output."
+    )
+    run_parser.add_argument("--baseline", help="Report to compare against.")
+    run_parser.add_argument("--tolerance", type=float, default=0.1)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two reports.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1)
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark of the middleware overhead of API requests.
+
+Usage, from the backend directory with the application environment set:
+    python benchmarks/middleware_benchmark.py --requests 5000
+
+Sends API requests through Django's request handler, without a server, with the
+middleware of the settings and with Django's own session, CSRF, authentication and
+message middleware in their place, and reports the time per request of each, as JSON.
+
+The requests are to the user details without a token, which DRF rejects before any
+database access, so that the middleware makes up most of the time measured. They carry
+a session cookie, as requests of browsers that also use the admin site do.
+"""
+
+import argparse
+import logging
+import time
+
+from common import setup_django, summarize, write_report
+
+DJANGO_MIDDLEWARE = {
+    "core.middleware.SessionMiddleware": (
+        "django.contrib.sessions.middleware.SessionMiddleware"
+    ),
+    "core.middleware.CsrfViewMiddleware": "django.middleware.csrf.CsrfViewMiddleware",
+    "core.middleware.AuthenticationMiddleware": (
+        "django.contrib.auth.middleware.AuthenticationMiddleware"
+    ),
+    "core.middleware.MessageMiddleware": (
+        "django.contrib.messages.middleware.MessageMiddleware"
+    ),
+}
+
+
+def measure(client, url, requests):
+    """Return the latency of requests GET requests to url, and their duration."""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        client.get(url)
+        latencies.append(time.perf_counter() - request_started)
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--output", help="Report file. Defaults to standard output.")
+    args = parser.parse_args()
+
+    setup_django()
+
+    # pylint: disable=import-outside-toplevel
+    from django.conf import settings
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+
+    setup_test_environment()
+    # Every rejected request would log a warning.
+    logging.getLogger("django.request").setLevel(logging.ERROR)
+    url = reverse("details")
+    full = [DJANGO_MIDDLEWARE.get(path, path) for path in settings.MIDDLEWARE]
+
+    report = {"requests": args.requests}
+    for name, middleware in (("full", full), ("sessionless", settings.MIDDLEWARE)):
+        with override_settings(MIDDLEWARE=middleware):
+            client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+            client.cookies["sessionid"] = "0" * 32
+            measure(client, url, 100)
+            latencies, elapsed = measure(client, url, args.requests)
+        report[name] = summarize(latencies, elapsed)
+        report[name]["mean_us"] = round(sum(latencies) / len(latencies) * 1e6, 1)
+
+    report["saved_us_per_request"] = round(
+        report["full"]["mean_us"] - report["sessionless"]["mean_us"], 1
+    )
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark of the password validation of UserSerializer.
+
+Usage, from the backend directory with the application environment set:
+    python benchmarks/password_validation_benchmark.py --processes 10 --validations 2000
+
+Compares Django's password validators with those of users.password_validation, preloaded
+when the application is loaded:
+
+- first request: starts --processes fresh processes per variant, each loading Django and
+  validating one registration with UserSerializer.validate, and reports the median time
+  to load the application and to validate that first registration;
+- steady state: validates --validations registrations in this process, and reports the
+  time per validation of UserSerializer.validate, which runs the password validators,
+  and of the whole UserSerializer.is_valid, which also checks the email and phone are
+  unused in the database.
+
+Prints the results as JSON.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import setup_django, write_report
+
+DJANGO_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"
+    },
+    {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator"},
+    {"NAME": "django.contrib.auth.password_validation.CommonPasswordValidator"},
+    {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator"},
+]
+
+VARIANTS = ("django", "warmed")
+
+
+def registrations(count):
+    """Return the data of count registrations, with passwords passing the validators."""
+    from users.factory import (  # pylint: disable=import-outside-toplevel
+        UserFactory,
+        build_dict,
+    )
+
+    return [
+        build_dict(UserFactory.build(password=None), password=f"Zq!{index:06d}-vXw#pL")
+        for index in range(count)
+    ]
+
+
+def use_variant(variant):
+    """Make validate_password use the validators of a variant."""
+    if variant == "django":
+        # pylint: disable=import-outside-toplevel
+        from django.test.utils import override_settings
+
+        override_settings(AUTH_PASSWORD_VALIDATORS=DJANGO_VALIDATORS).enable()
+
+
+def first_request(variant):
+    """Measure loading the application and a first validation, in this process."""
+    started = time.perf_counter()
+    setup_django()
+    use_variant(variant)
+    loaded = time.perf_counter()
+
+    from users.serializers import (  # pylint: disable=import-outside-toplevel
+        UserSerializer,
+    )
+
+    serializer = UserSerializer()
+    attrs = serializer.to_internal_value(registrations(1)[0])
+    validated = time.perf_counter()
+    serializer.validate(attrs)
+    finished = time.perf_counter()
+    print(json.dumps({"setup": loaded - started, "validation": finished - validated}))
+
+
+def measure_first_request(variant, processes):
+    """Return the median first-request timings of a variant over fresh processes."""
+    env = dict(os.environ, PASSWORD_HASHING_WORKERS="0")
+    env["PASSWORD_VALIDATORS_PRELOAD"] = "0" if variant == "django" else "1"
+    samples = []
+    for _ in range(processes):
+        output = subprocess.run(
+            [sys.executable, __file__, "--first-request", variant],
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return {
+        f"{key}_ms": round(statistics.median(s[key] for s in samples) * 1000, 2)
+        for key in ("setup", "validation")
+    }
+
+
+def measure_steady_state(variant, validations):
+    """Return the time per validation of a variant, its validators already built."""
+    # pylint: disable=import-outside-toplevel
+    from django.conf import settings
+    from django.contrib.auth import password_validation
+    from django.test.utils import override_settings
+
+    from users.serializers import UserSerializer
+
+    if variant == "django":
+        validators = DJANGO_VALIDATORS
+    else:
+        validators = settings.AUTH_PASSWORD_VALIDATORS
+    with override_settings(AUTH_PASSWORD_VALIDATORS=validators):
+        password_validation.get_default_password_validators()
+        data = registrations(validations)
+        attrs = [UserSerializer().to_internal_value(item) for item in data]
+
+        # Warms the database connection and caches up.
+        for item in data[:100]:
+            UserSerializer(data=item).is_valid()
+
+        serializer = UserSerializer()
+        started = time.perf_counter()
+        for item in attrs:
+            serializer.validate(item)
+        validate = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for item in data:
+            assert UserSerializer(data=item).is_valid(), "registration rejected"
+        is_valid = time.perf_counter() - started
+
+    return {
+        "validate_us": round(validate / validations * 1e6, 1),
+        "is_valid_us": round(is_valid / validations * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=10)
+    parser.add_argument("--validations", type=int, default=2000)
+    parser.add_argument("--output", help="Report file. Defaults to standard output.")
+    parser.add_argument("--first-request", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.first_request:
+        first_request(args.first_request)
+        return
+
+    report = {"processes": args.processes, "validations": args.validations}
+    for variant in VARIANTS:
+        report[variant] = {
+            "first_request": measure_first_request(variant, args.processes)
+        }
+
+    os.environ["PASSWORD_HASHING_WORKERS"] = "0"
+    setup_django()
+    for variant in VARIANTS:
+        report[variant]["steady_state"] = measure_steady_state(
+            variant, args.validations
+        )
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
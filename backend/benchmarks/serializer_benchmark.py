@@ -0,0 +1,87 @@
+"""Microbenchmark of the user read serializers.
+
+Usage, from the backend directory with the application environment set:
+    python benchmarks/serializer_benchmark.py --objects 1000 --repeat 5
+
+Serializes unsaved users built with UserFactory through the DRF serializers and their
+compiled versions from users.serializers, and reports the best time per object of each,
+one object at a time and as a list, with the speedup, as JSON. No database is needed.
+"""
+
+import argparse
+import time
+
+from common import setup_django, write_report
+
+
+def best_time(func, repeat):
+    """Return the best duration of func() in seconds, over repeat runs."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Report file. Defaults to standard output.")
+    args = parser.parse_args()
+
+    setup_django()
+
+    # pylint: disable=import-outside-toplevel
+    from django.utils import timezone
+    from rest_framework.renderers import JSONRenderer
+
+    from users import serializers
+    from users.factory import UserFactory
+
+    users = [
+        UserFactory.build(password=None, id=index, date_joined=timezone.now())
+        for index in range(args.objects)
+    ]
+    renderer = JSONRenderer()
+    report = {"objects": args.objects, "repeat": args.repeat}
+    for name, serializer_class, compiled in (
+        ("details", serializers.UserSerializer, serializers.user_read_serializer),
+        ("list", serializers.UserListSerializer, serializers.user_list_read_serializer),
+    ):
+        assert renderer.render(compiled.many(users)) == renderer.render(
+            serializer_class(users, many=True).data
+        ), f"{name}: the compiled serializer renders different bytes"
+
+        timings = {
+            "drf_single": best_time(
+                lambda cls=serializer_class: [cls(user).data for user in users],
+                args.repeat,
+            ),
+            "compiled_single": best_time(
+                lambda c=compiled: [c.to_representation(user) for user in users],
+                args.repeat,
+            ),
+            "drf_many": best_time(
+                lambda cls=serializer_class: cls(users, many=True).data, args.repeat
+            ),
+            "compiled_many": best_time(lambda c=compiled: c.many(users), args.repeat),
+        }
+        result = {
+            f"{key}_us_per_object": round(value / args.objects * 1e6, 3)
+            for key, value in timings.items()
+        }
+        result["single_speedup"] = round(
+            timings["drf_single"] / timings["compiled_single"], 1
+        )
+        result["many_speedup"] = round(
+            timings["drf_many"] / timings["compiled_many"], 1
+        )
+        report[name] = result
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
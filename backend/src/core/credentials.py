@@ -0,0 +1,31 @@
+"""Credentials of the internal services.
+
+Internal services, such as the API gateway or Prometheus, authenticate with one of the
+SERVICE_CREDENTIALS. The users app checks them with users.permissions.HasServiceCredential,
+and core.metrics before serving the metrics.
+
+Attributes:
+    is_service_credential (function): Returns whether a credential is one of the SERVICE_CREDENTIALS.
+"""
+
+import hmac
+
+from django.conf import settings
+
+
+def is_service_credential(credential):
+    """Return whether a credential is one of the SERVICE_CREDENTIALS.
+
+    Args:
+        credential (str): The credential sent by the client.
+
+    Returns:
+        bool: True if the credential is known.
+    """
+    credential = credential.encode()
+    # Every credential is compared, so that the time taken tells none of them.
+    matches = [
+        hmac.compare_digest(credential, known.encode())
+        for known in settings.SERVICE_CREDENTIALS
+    ]
+    return bool(credential) and any(matches)
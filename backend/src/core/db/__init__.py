@@ -0,0 +1 @@
+"""PostgreSQL database backend of the application, see core.db.base."""
@@ -0,0 +1,86 @@
+"""PostgreSQL database backend recording connection metrics.
+
+Django's PostgreSQL backend, with its connections measured for core.metrics. Selected
+with "ENGINE": "core.db" in the DATABASES setting.
+
+Connections are persistent: each thread keeps its connection for CONN_MAX_AGE seconds
+instead of opening one per request, and checks that it still works before the first
+query of a request when CONN_HEALTH_CHECKS is set. A gunicorn worker thus holds at most
+one connection per thread, its pool of connections, whose size the DB_CONNECTIONS_MAX
+gauge shows next to the number of connections open.
+
+Django 5.0 has no connection pool for psycopg2, the driver of requirements.txt, so no
+request ever queues for a connection held by another thread. What a request waits for
+is its own connection: opened when missing, or checked when reused. The first query of
+a request records that wait in DB_CONNECTION_WAIT_TIME.
+
+Attributes:
+    DatabaseWrapper (class): Subclass of Django's PostgreSQL DatabaseWrapper, recording connection metrics.
+"""
+
+import time
+
+from django.conf import settings
+from django.db.backends.postgresql import base
+
+from core import metrics
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL connection recording its metrics.
+
+    Methods:
+        record_max_connections(): Sets the connections the worker may hold in the metrics.
+        connect(): Opens the connection, timing it.
+        close_if_health_check_failed(): Closes an unusable connection, counting it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.record_max_connections()
+
+    def record_max_connections(self):
+        """Set the connections the worker may hold in the metrics.
+
+        Called again in workers forked with the connection already created, see
+        gunicorn.conf.py.
+        """
+        metrics.DB_CONNECTIONS_MAX.labels(self.alias).set(
+            settings.DB_CONNECTIONS_PER_WORKER
+        )
+
+    def connect(self):
+        """Open the connection, recording the time it took."""
+        started = time.perf_counter()
+        super().connect()
+        metrics.DB_CONNECT_TIME.labels(self.alias).observe(
+            time.perf_counter() - started
+        )
+        metrics.DB_CONNECTIONS_OPEN.labels(self.alias).inc()
+
+    def _close(self):
+        try:
+            super()._close()
+        finally:
+            metrics.DB_CONNECTIONS_OPEN.labels(self.alias).dec()
+
+    def _cursor(self, name=None):
+        # Health checks are done once per request, so this is the first query of a
+        # request, or of a thread without a connection.
+        if self.connection is None or (
+            self.health_check_enabled and not self.health_check_done
+        ):
+            started = time.perf_counter()
+            self.close_if_health_check_failed()
+            self.ensure_connection()
+            metrics.DB_CONNECTION_WAIT_TIME.labels(self.alias).observe(
+                time.perf_counter() - started
+            )
+        return super()._cursor(name)
+
+    def close_if_health_check_failed(self):
+        """Close the connection if it fails its health check, counting failures."""
+        checked = self.connection is not None and not self.health_check_done
+        super().close_if_health_check_failed()
+        if checked and self.health_check_enabled and self.connection is None:
+            metrics.DB_HEALTH_CHECK_FAILURES.labels(self.alias).inc()
@@ -0,0 +1,129 @@
+"""Import time and memory of every module loaded by a module, in a fresh process.
+
+Usage, from the directory of manage.py:
+    python -m core.importprofile core.wsgi
+    python -m core.importprofile core.wsgi --memory
+
+Imports the given module and prints a JSON report to standard output: the total time,
+the resident memory of the process, and for every module imported, like
+python -X importtime, its own import time and the cumulative one of the modules it
+imported, in seconds. With --memory, the memory its import allocated through Python's
+allocators is measured as well, with tracemalloc, which slows imports down: measure
+times without it. Run by the startup_profile management command, see there.
+
+Only modules loaded from source, bytecode or extension files are measured; built-in and
+frozen modules take a negligible time.
+
+Attributes:
+    profile (function): Returns the import report of a module.
+    resident_memory (function): Returns the resident memory of the process.
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import time
+import tracemalloc
+from importlib.machinery import (
+    ExtensionFileLoader,
+    SourceFileLoader,
+    SourcelessFileLoader,
+)
+
+LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+
+def resident_memory():
+    """Return the resident memory of the process in bytes, its peak on non-Linux systems."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource  # pylint: disable=import-outside-toplevel
+
+    # Kilobytes on Linux, bytes on macOS.
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def profile(module_name, memory=False):
+    """Import a module and return the import time and memory of every module loaded.
+
+    Args:
+        module_name (str): The module to import.
+        memory (bool): Whether to trace the memory allocated by every import.
+
+    Returns:
+        dict: The total seconds and resident memory, and by module its self and
+        cumulative seconds, and bytes with memory.
+    """
+    modules = {}
+    # Time and memory of the children of the modules being imported.
+    stack = []
+
+    def traced():
+        return tracemalloc.get_traced_memory()[0] if memory else 0
+
+    def measured(exec_module):
+        def wrapper(self, module):
+            stack.append([0.0, 0])
+            allocated = traced()
+            started = time.perf_counter()
+            try:
+                return exec_module(self, module)
+            finally:
+                elapsed = time.perf_counter() - started
+                allocated = traced() - allocated
+                children_time, children_memory = stack.pop()
+                stats = {"self": elapsed - children_time, "cumulative": elapsed}
+                if memory:
+                    stats["self_bytes"] = allocated - children_memory
+                    stats["cumulative_bytes"] = allocated
+                modules[module.__name__] = stats
+                if stack:
+                    stack[-1][0] += elapsed
+                    stack[-1][1] += allocated
+
+        return wrapper
+
+    originals = {loader: loader.exec_module for loader in LOADERS}
+    for loader, exec_module in originals.items():
+        loader.exec_module = measured(exec_module)
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        importlib.import_module(module_name)
+    finally:
+        elapsed = time.perf_counter() - started
+        for loader, exec_module in originals.items():
+            loader.exec_module = exec_module
+
+    report = {
+        "module": module_name,
+        "seconds": elapsed,
+        "rss_bytes": resident_memory(),
+        "modules": modules,
+    }
+    if memory:
+        report["python_bytes"] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("module", help="Module to import, such as core.wsgi.")
+    parser.add_argument(
+        "--memory", action="store_true", help="Trace the memory of every import."
+    )
+    args = parser.parse_args()
+    json.dump(profile(args.module, args.memory), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
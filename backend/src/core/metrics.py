@@ -0,0 +1,222 @@
+"""Prometheus metrics of the application.
+
+This module defines the request metrics recorded by core.middleware.MetricsMiddleware and
+the view exposing them in the Prometheus text format.
+
+Under gunicorn every worker is a separate process. When the PROMETHEUS_MULTIPROC_DIR
+environment variable is set, prometheus_client writes the samples of every process to
+memory-mapped files in that directory, and the metrics view aggregates them, so a scrape
+sees the totals of all workers whichever worker answers it. docker/entrypoint.sh sets the
+variable and gunicorn.conf.py drops the files of exited workers.
+
+The metrics tell the traffic and database timings of the service, so only internal
+services may scrape them: the metrics view requires one of the SERVICE_CREDENTIALS, in the
+X-Service-Credential header or as a bearer token, which a Prometheus scrape configuration
+sends with its authorization option.
+
+SQL is timed by an execute wrapper installed on every database connection. It adds one
+context variable lookup per query when no request is being measured. The database
+backend of core.db records the connection metrics: how long opening a connection takes,
+which persistent connections save to most requests, how long requests wait for a usable
+connection, and how many of the connections a worker may hold are open.
+
+users.hashing records the jobs of its password hashing pool: how long they wait for a
+worker, how long they compute, and how many are in flight or were rejected because the
+pool was saturated.
+
+Attributes:
+    REQUEST_LATENCY (Histogram): Request latency in seconds, by view, method and status.
+    REQUEST_QUERIES (Histogram): Database queries per request, by view and method.
+    REQUEST_SQL_TIME (Histogram): Time spent in SQL per request in seconds, by view and method.
+    RESPONSE_SIZE (Histogram): Response body size in bytes, by view and method.
+    DB_CONNECT_TIME (Histogram): Seconds spent opening database connections, by database alias.
+    DB_CONNECTION_WAIT_TIME (Histogram): Seconds requests waited for a usable connection, by database alias.
+    DB_CONNECTIONS_OPEN (Gauge): Open database connections, by database alias.
+    DB_CONNECTIONS_MAX (Gauge): Database connections the workers may hold, by database alias.
+    DB_HEALTH_CHECK_FAILURES (Counter): Persistent connections found unusable, by database alias.
+    PASSWORD_HASHING_WAIT_TIME (Histogram): Seconds password hashing jobs waited for a worker.
+    PASSWORD_HASHING_COMPUTE_TIME (Histogram): Seconds password hashing jobs computed.
+    PASSWORD_HASHING_JOBS (Counter): Finished password hashing jobs, by outcome.
+    PASSWORD_HASHING_IN_FLIGHT (Gauge): Password hashing jobs queued or running.
+    install_query_timer (function): Times the queries of already open connections.
+    start_request (function): Starts counting the queries of the current request.
+    finish_request (function): Stops counting and returns the query count and SQL time.
+    metrics_view (function): Returns the metrics in the Prometheus text format.
+"""
+
+import os
+import time
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import Counter, Gauge, Histogram, multiprocess
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.registry import REGISTRY, CollectorRegistry
+
+from .credentials import is_service_credential
+
+LABELS = ("view", "method")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency in seconds.",
+    (*LABELS, "status"),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries per request.",
+    LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_SQL_TIME = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in SQL per request in seconds.",
+    LABELS,
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "Response body size in bytes.",
+    LABELS,
+    buckets=(100, 1000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+
+DB_CONNECT_TIME = Histogram(
+    "db_connection_setup_seconds",
+    "Seconds spent opening database connections.",
+    ("alias",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+DB_CONNECTION_WAIT_TIME = Histogram(
+    "db_connection_wait_seconds",
+    "Seconds requests waited for a usable database connection, opened or checked.",
+    ("alias",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+DB_CONNECTIONS_OPEN = Gauge(
+    "db_connections_open",
+    "Open database connections.",
+    ("alias",),
+    multiprocess_mode="livesum",
+)
+DB_CONNECTIONS_MAX = Gauge(
+    "db_connections_max",
+    "Database connections the workers may hold, one per thread.",
+    ("alias",),
+    multiprocess_mode="livesum",
+)
+DB_HEALTH_CHECK_FAILURES = Counter(
+    "db_health_check_failures",
+    "Persistent database connections found unusable and closed.",
+    ("alias",),
+)
+
+HASHING_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+PASSWORD_HASHING_WAIT_TIME = Histogram(
+    "password_hashing_wait_seconds",
+    "Seconds password hashing jobs waited for a worker.",
+    buckets=HASHING_BUCKETS,
+)
+PASSWORD_HASHING_COMPUTE_TIME = Histogram(
+    "password_hashing_compute_seconds",
+    "Seconds password hashing jobs spent computing in a worker.",
+    buckets=HASHING_BUCKETS,
+)
+PASSWORD_HASHING_JOBS = Counter(
+    "password_hashing_jobs",
+    "Password hashing jobs completed, failed, or rejected by a saturated pool.",
+    ("outcome",),
+)
+PASSWORD_HASHING_IN_FLIGHT = Gauge(
+    "password_hashing_in_flight",
+    "Password hashing jobs queued or running.",
+    multiprocess_mode="livesum",
+)
+
+# Query count and SQL seconds of the request being handled. The list is shared, not
+# copied, with the threads sync_to_async runs the ORM in for async views.
+_request_queries = ContextVar("request_queries", default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - started
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    # connection_created fires on every reconnect of the same connection object.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_wrapper)
+
+
+def install_query_timer():
+    """Time the queries of the connections opened before this module was imported."""
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(None, connection)
+
+
+def start_request():
+    """Start counting the queries of the current request.
+
+    Returns:
+        Token: The token to pass to finish_request.
+    """
+    return _request_queries.set([0, 0.0])
+
+
+def finish_request(token):
+    """Stop counting the queries of the current request.
+
+    Args:
+        token (Token): The token returned by start_request.
+
+    Returns:
+        tuple: The number of queries and the seconds spent in SQL.
+    """
+    queries = _request_queries.get()
+    _request_queries.reset(token)
+    return queries[0], queries[1]
+
+
+def metrics_view(request):
+    """Return the metrics in the Prometheus text format.
+
+    Args:
+        request: The scrape request.
+
+    Returns:
+        HttpResponse: The metrics of every worker process, or of this process when
+                      PROMETHEUS_MULTIPROC_DIR is not set, or a 403 response without a
+                      valid service credential.
+    """
+    credential = request.headers.get("X-Service-Credential", "")
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if not credential and scheme.lower() == "bearer":
+        credential = token.strip()
+    if not is_service_credential(credential):
+        return HttpResponse(
+            "A valid service credential is required.\n",
+            content_type="text/plain",
+            status=403,
+        )
+
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
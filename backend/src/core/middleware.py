@@ -0,0 +1,212 @@
+"""Middleware of the application.
+
+Requests to the API authenticate with tokens: they use no session, no messages, no CSRF
+token and no session-based user. The session, CSRF, authentication and message
+middleware of this module therefore pass requests whose path starts with one of the
+SESSIONLESS_PATH_PREFIXES setting straight through, and only process the others, such as
+those of the admin site.
+
+Attributes:
+    MetricsMiddleware (class): Records the Prometheus metrics of every request.
+    ReplicaStickinessMiddleware (class): Pins the reads of recent writers to the primary database.
+    SessionlessPathsMixin (class): Makes a middleware skip the requests of sessionless paths.
+    SessionMiddleware (class): Django's SessionMiddleware, skipping sessionless paths.
+    CsrfViewMiddleware (class): Django's CsrfViewMiddleware, skipping sessionless paths.
+    AuthenticationMiddleware (class): Django's AuthenticationMiddleware, skipping sessionless paths.
+    MessageMiddleware (class): Django's MessageMiddleware, skipping sessionless paths.
+"""
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.middleware import csrf
+
+from . import metrics, routers
+
+
+class MetricsMiddleware:
+    """Record the latency, queries, SQL time and response size of every request.
+
+    Requests are labelled with the name of the URL pattern they matched, such as login or
+    details, and "unmatched" otherwise. Works with sync and async views alike.
+
+    The latency of a streaming response covers the time to its first byte, and its size
+    is only recorded when it sets Content-Length.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        metrics.install_query_timer()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            queries = metrics.finish_request(token)
+        self.record(request, response, started, queries)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            queries = metrics.finish_request(token)
+        self.record(request, response, started, queries)
+        return response
+
+    def record(self, request, response, started, queries):
+        """Observe the metrics of a finished request."""
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        labels = (view, request.method)
+        metrics.REQUEST_LATENCY.labels(*labels, response.status_code).observe(
+            time.perf_counter() - started
+        )
+        metrics.REQUEST_QUERIES.labels(*labels).observe(queries[0])
+        metrics.REQUEST_SQL_TIME.labels(*labels).observe(queries[1])
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.labels(*labels).observe(len(response.content))
+        elif response.has_header("Content-Length"):
+            metrics.RESPONSE_SIZE.labels(*labels).observe(
+                int(response["Content-Length"])
+            )
+
+
+class ReplicaStickinessMiddleware:
+    """Pin the reads of clients that just wrote to the primary database.
+
+    A request with an unsafe method, or which wrote to the primary, gets a cookie and an
+    X-Primary-Until header holding the time until which the client should read from the
+    primary, REPLICA_STICKY_SECONDS from now. Requests sending either back before that
+    time read from the primary, see core.routers. Clients without cookies echo the
+    header instead.
+
+    Works with sync and async views alike, and does nothing without replicas.
+    """
+
+    sync_capable = True
+    async_capable = True
+    cookie_name = "primary_until"
+    header_name = "X-Primary-Until"
+    unsafe_methods = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        token = routers.pin_request(self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+            wrote = routers.request_wrote()
+        finally:
+            routers.reset_request(token)
+        return self.process_response(request, response, wrote)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        token = routers.pin_request(self.is_pinned(request))
+        try:
+            response = await self.get_response(request)
+            wrote = routers.request_wrote()
+        finally:
+            routers.reset_request(token)
+        return self.process_response(request, response, wrote)
+
+    def is_pinned(self, request):
+        """Return whether the request must read from the primary."""
+        if request.method in self.unsafe_methods:
+            return True
+        until = request.COOKIES.get(self.cookie_name) or request.headers.get(
+            self.header_name
+        )
+        try:
+            return float(until) > time.time()
+        except (TypeError, ValueError):
+            return False
+
+    def process_response(self, request, response, wrote):
+        """Tell the client to read from the primary for a while after a write."""
+        if wrote or request.method in self.unsafe_methods:
+            until = int(time.time()) + settings.REPLICA_STICKY_SECONDS
+            response[self.header_name] = str(until)
+            response.set_cookie(
+                self.cookie_name,
+                str(until),
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class SessionlessPathsMixin:
+    """Mixin making a Django middleware skip the requests of sessionless paths.
+
+    Requests whose path starts with one of the SESSIONLESS_PATH_PREFIXES setting go
+    straight to the next middleware, in sync and async mode alike.
+
+    Methods:
+        is_sessionless(request): Returns whether the request is to a sessionless path.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sessionless_prefixes = tuple(settings.SESSIONLESS_PATH_PREFIXES)
+
+    def __call__(self, request):
+        if self.is_sessionless(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+    def is_sessionless(self, request):
+        """Return whether the request is to a sessionless path."""
+        return request.path_info.startswith(self.sessionless_prefixes)
+
+
+class SessionMiddleware(SessionlessPathsMixin, sessions_middleware.SessionMiddleware):
+    """Django's SessionMiddleware, skipping sessionless paths."""
+
+
+class CsrfViewMiddleware(SessionlessPathsMixin, csrf.CsrfViewMiddleware):
+    """Django's CsrfViewMiddleware, skipping sessionless paths."""
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        """Check the CSRF token of the request, outside sessionless paths."""
+        if self.is_sessionless(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(
+    SessionlessPathsMixin, auth_middleware.AuthenticationMiddleware
+):
+    """Django's AuthenticationMiddleware, skipping sessionless paths."""
+
+
+class MessageMiddleware(SessionlessPathsMixin, messages_middleware.MessageMiddleware):
+    """Django's MessageMiddleware, skipping sessionless paths."""
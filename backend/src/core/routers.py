@@ -0,0 +1,100 @@
+"""Database routing between the primary database and its read replicas.
+
+Writes go to the primary database, "default". Reads go to a replica of the
+DATABASE_REPLICAS setting, unless the current request is pinned to the primary:
+
+- inside a transaction on the primary, so that a transaction reads its own writes;
+- once the request wrote anything, or when its method is unsafe, such as POST or PATCH;
+- when the client wrote within the last REPLICA_STICKY_SECONDS seconds, which
+  core.middleware.ReplicaStickinessMiddleware tracks with a cookie and a header.
+
+The last rule gives clients read-your-writes consistency: details read right after an
+update come from the primary, not from a replica still replaying the update.
+
+Attributes:
+    PRIMARY (str): Alias of the primary database.
+    pin_request (function): Starts the routing state of a request, pinned or not.
+    reset_request (function): Ends the routing state of a request.
+    request_wrote (function): Returns whether the current request wrote to the primary.
+    PrimaryReplicaRouter (class): Database router sending reads to replicas and writes to the primary.
+"""
+
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = "default"
+
+# Whether the request being handled reads from the primary, and whether it wrote. The
+# list is shared, not copied, with the threads sync_to_async runs the ORM in.
+_request_state = ContextVar("request_state", default=None)
+
+
+def pin_request(pinned):
+    """Start the routing state of the current request.
+
+    Args:
+        pinned (bool): Whether the request reads from the primary from the start.
+
+    Returns:
+        Token: The token to pass to reset_request.
+    """
+    return _request_state.set([pinned, False])
+
+
+def reset_request(token):
+    """End the routing state of the current request.
+
+    Args:
+        token (Token): The token returned by pin_request.
+    """
+    _request_state.reset(token)
+
+
+def request_wrote():
+    """Return whether the current request wrote to the primary."""
+    state = _request_state.get()
+    return state is not None and state[1]
+
+
+class PrimaryReplicaRouter:
+    """Database router sending reads to replicas and writes to the primary.
+
+    Without replicas, every query goes to the primary. Migrations only run on the
+    primary, replicas receive them through replication.
+
+    Methods:
+        db_for_read(model, **hints): Returns a replica, or the primary when pinned.
+        db_for_write(model, **hints): Returns the primary, pinning the request to it.
+        allow_relation(obj1, obj2, **hints): Allows relations, every database holds the same data.
+        allow_migrate(db, app_label, model_name=None, **hints): Allows migrations on the primary only.
+    """
+
+    def db_for_read(self, model, **hints):
+        """Return a replica, or the primary when the read must see recent writes."""
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas:
+            return PRIMARY
+        state = _request_state.get()
+        if state is not None and state[0]:
+            return PRIMARY
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        """Return the primary, and read from it for the rest of the request."""
+        state = _request_state.get()
+        if state is not None:
+            state[0] = state[1] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations between objects of any database."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Allow migrations on the primary only."""
+        return db == PRIMARY
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,16 +52,22 @@ EXTERNAL_APPS = ["users"]
 INSTALLED_APPS += EXTERNAL_APPS
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ReplicaStickinessMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "core.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
+    "core.middleware.CsrfViewMiddleware",
+    "core.middleware.AuthenticationMiddleware",
+    "core.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Paths of token-authenticated requests, skipped by the session, CSRF, authentication
+# and message middleware.
+SESSIONLESS_PATH_PREFIXES = ["/api/"]
+
 CORS_ALLOWED_ORIGINS = [
     os.getenv("CORS_ORIGIN"),
 ]
@@ -89,49 +96,213 @@ WSGI_APPLICATION = "core.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Threads keep their connection between requests for DB_CONN_MAX_AGE seconds, so every
+# gunicorn worker holds up to THREADS connections and the server WORKERS x THREADS, which
+# must stay below max_connections of PostgreSQL. Under ASGI, requests run their queries
+# in threads of their own, whose connections could not be reused: they are closed.
+SERVER_MODE = os.getenv("SERVER_MODE") or "wsgi"
+DB_CONN_MAX_AGE = int(
+    os.getenv("DB_CONN_MAX_AGE") or (0 if SERVER_MODE == "asgi" else 60)
+)
+DB_CONN_HEALTH_CHECKS = bool(int(os.getenv("DB_CONN_HEALTH_CHECKS") or 1))
+DB_CONNECTIONS_PER_WORKER = int(os.getenv("THREADS") or 8)
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "core.db",
         "NAME": os.getenv("POSTGRES_DB"),
         "USER": os.getenv("POSTGRES_USER"),
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST"),
         "PORT": os.getenv("POSTGRES_PORT"),
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": DB_CONN_HEALTH_CHECKS,
     }
 }
 
+# Read replica of the primary database, see core.routers. Reads go to it, except those
+# of clients that wrote within the last REPLICA_STICKY_SECONDS seconds.
+if os.getenv("POSTGRES_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.getenv("POSTGRES_REPLICA_HOST"),
+        "PORT": os.getenv("POSTGRES_REPLICA_PORT") or DATABASES["default"]["PORT"],
+        # Tests read the replica through the connection of the primary.
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS") or 10)
+
+# User shards, see users.sharding: users are spread over the primary database and the
+# databases of USER_SHARD_DATABASES, comma separated names of databases on POSTGRES_HOST
+# or "host:port/name". Shards can only be appended, then run reshard_users.
+USER_SHARDS = ["default"]
+for database in filter(None, (os.getenv("USER_SHARD_DATABASES") or "").split(",")):
+    address, _, name = database.strip().rpartition("/")
+    host, _, port = address.partition(":")
+    USER_SHARDS.append(f"shard{len(USER_SHARDS)}")
+    DATABASES[USER_SHARDS[-1]] = {
+        **DATABASES["default"],
+        "NAME": name,
+        "HOST": host or DATABASES["default"]["HOST"],
+        "PORT": port or DATABASES["default"]["PORT"],
+    }
+
+DATABASE_ROUTERS = [
+    "users.sharding.UserShardRouter",
+    "core.routers.PrimaryReplicaRouter",
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
+# Registration and password changes run these validators. The users.password_validation
+# ones give the results of Django's, faster, and are built when the application loads.
 AUTH_PASSWORD_VALIDATORS = [
     {
-        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+        "NAME": "users.password_validation.UserAttributeSimilarityValidator",
     },
     {
         "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
     },
     {
-        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+        "NAME": "users.password_validation.CommonPasswordValidator",
     },
     {
         "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
     },
 ]
 
+# Build the password validators and their list of common passwords when the application
+# loads rather than on the first validation.
+PASSWORD_VALIDATORS_PRELOAD = bool(int(os.getenv("PASSWORD_VALIDATORS_PRELOAD") or 1))
+
 AUTHENTICATION_BACKENDS = ["users.backends.EmailBackend"]
 
+# Password hashing
+# Number of worker processes used to hash passwords, 0 hashes inline in the request thread.
+PASSWORD_HASHING_WORKERS = int(
+    os.getenv("PASSWORD_HASHING_WORKERS") or os.cpu_count() or 1
+)
+
+# Number of hashing jobs allowed to wait for a free worker before new ones are shed.
+PASSWORD_HASHING_MAX_PENDING = int(
+    os.getenv("PASSWORD_HASHING_MAX_PENDING") or PASSWORD_HASHING_WORKERS * 4
+)
+
+# Seconds a request waits for a hashing slot before it is answered with a 503.
+PASSWORD_HASHING_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASHING_QUEUE_TIMEOUT") or 1)
+
+# Hasher of new passwords, "pbkdf2" or "argon2". Passwords hashed otherwise are hashed
+# again with it when their user logs in. Measure the costs below with calibrate_hashers.
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER") or "pbkdf2"
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS") or 720000)
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST") or 2)
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST") or 102400)
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM") or 8)
+
+TUNED_PASSWORD_HASHERS = {
+    "pbkdf2": "users.hashers.TunedPBKDF2PasswordHasher",
+    "argon2": "users.hashers.TunedArgon2PasswordHasher",
+}
+if PASSWORD_HASHER not in TUNED_PASSWORD_HASHERS:
+    raise ImproperlyConfigured(
+        f"PASSWORD_HASHER must be one of {', '.join(TUNED_PASSWORD_HASHERS)}."
+    )
+
+# The first hasher hashes new passwords, the others only verify existing hashes.
+PASSWORD_HASHERS = [
+    TUNED_PASSWORD_HASHERS[PASSWORD_HASHER],
+    *(path for name, path in TUNED_PASSWORD_HASHERS.items() if name != PASSWORD_HASHER),
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "users.authentication.CachedTokenAuthentication",
+        "users.authentication.SignedTokenAuthentication",
     ],
+    # Proxies in front of the application, which append the client address to
+    # X-Forwarded-For. With 0, clients are identified by their remote address and the
+    # header, which any client may set, is ignored, see users.throttling.
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES") or 0),
 }
 
+# Signed tokens: login also returns a signed access token, sent as "Bearer <token>", and
+# a refresh token. Lifetimes are in seconds.
+SIGNED_TOKENS = bool(int(os.getenv("SIGNED_TOKENS") or 0))
+ACCESS_TOKEN_LIFETIME = int(os.getenv("ACCESS_TOKEN_LIFETIME") or 300)
+REFRESH_TOKEN_LIFETIME = int(os.getenv("REFRESH_TOKEN_LIFETIME") or 14 * 24 * 3600)
+
+# Token authentication cache, 0 entries disables it.
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES") or 10000)
+
+# Seconds a cached token stays valid. Bounds how long other workers may serve a
+# changed or deleted user or token from their cache.
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL") or 60)
+
+# Rendered user details, cached per user version, 0 entries disables the cache. A version
+# is never rendered differently, the time to live only bounds the memory of idle entries.
+USER_PAYLOAD_CACHE_MAX_ENTRIES = int(
+    os.getenv("USER_PAYLOAD_CACHE_MAX_ENTRIES") or 10000
+)
+
+USER_PAYLOAD_CACHE_TTL = float(os.getenv("USER_PAYLOAD_CACHE_TTL") or 3600)
+
+# Login throttling, token buckets per client IP and per email: a bucket holds up to BURST
+# attempts and refills by RATE attempts per second. A BURST of 0 disables the throttle.
+LOGIN_THROTTLE_IP_BURST = int(os.getenv("LOGIN_THROTTLE_IP_BURST") or 30)
+LOGIN_THROTTLE_IP_RATE = float(os.getenv("LOGIN_THROTTLE_IP_RATE") or 0.5)
+LOGIN_THROTTLE_EMAIL_BURST = int(os.getenv("LOGIN_THROTTLE_EMAIL_BURST") or 10)
+LOGIN_THROTTLE_EMAIL_RATE = float(os.getenv("LOGIN_THROTTLE_EMAIL_RATE") or 0.1)
+
+# Where buckets are kept: users.throttling.LocalBucketStore keeps them in each process,
+# users.throttling.CacheBucketStore in the LOGIN_THROTTLE_CACHE cache, shared by every
+# process using the same cache server.
+LOGIN_THROTTLE_STORE = (
+    os.getenv("LOGIN_THROTTLE_STORE") or "users.throttling.LocalBucketStore"
+)
+LOGIN_THROTTLE_CACHE = os.getenv("LOGIN_THROTTLE_CACHE") or "default"
+LOGIN_THROTTLE_MAX_ENTRIES = int(os.getenv("LOGIN_THROTTLE_MAX_ENTRIES") or 100000)
+
 # Default User
 AUTH_USER_MODEL = "users.User"
 
 APPEND_SLASH = False
 
+# Bulk registration
+BULK_REGISTRATION_MAX_USERS = int(os.getenv("BULK_REGISTRATION_MAX_USERS") or 10000)
+
+BULK_CREATE_BATCH_SIZE = int(os.getenv("BULK_CREATE_BATCH_SIZE") or 1000)
+
+# Bulk update
+BULK_UPDATE_MAX_USERS = int(os.getenv("BULK_UPDATE_MAX_USERS") or 10000)
+
+BULK_UPDATE_BATCH_SIZE = int(os.getenv("BULK_UPDATE_BATCH_SIZE") or 500)
+
+# Token introspection
+# Credentials of the internal services allowed to introspect tokens and to scrape /metrics,
+# comma separated, sent in the X-Service-Credential header. Both are refused to everyone
+# unless set.
+SERVICE_CREDENTIALS = [
+    credential.strip()
+    for credential in (os.getenv("SERVICE_CREDENTIALS") or "").split(",")
+    if credential.strip()
+]
+
+TOKEN_INTROSPECTION_MAX_KEYS = int(os.getenv("TOKEN_INTROSPECTION_MAX_KEYS") or 5000)
+
+# Users fetched from the server-side cursor, and encoded, per chunk of an export.
+USER_EXPORT_CHUNK_SIZE = int(os.getenv("USER_EXPORT_CHUNK_SIZE") or 2000)
+
+# Serve login/, update/ and details/ with the async views of users.async_views. Only useful
+# when the application runs under ASGI (SERVER_MODE=asgi in docker/entrypoint.sh).
+ASYNC_USER_VIEWS = bool(int(os.getenv("ASYNC_USER_VIEWS") or 0))
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -8,9 +8,15 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 """
 
 import os
+from importlib import import_module
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_wsgi_application()
+
+# Django imports the URLconf, with the views and rest_framework, on the first request.
+# Import it now, before gunicorn forks the workers when it preloads the application.
+import_module(settings.ROOT_URLCONF)
@@ -0,0 +1,49 @@
+"""Gunicorn configuration.
+
+Gunicorn reads this file from its working directory. Command line arguments, as in
+docker/entrypoint.sh, take precedence over it.
+
+With PRELOAD_APP=1 (default) the master loads the application, Django, the apps and the
+URLconf, once before forking the workers, which share its memory copy-on-write instead of
+each importing everything again. Code changes then need a restart of the master, not
+only of the workers.
+"""
+
+import gc
+import os
+
+from prometheus_client import multiprocess
+
+preload_app = bool(int(os.getenv("PRELOAD_APP") or 1))
+
+
+def pre_fork(server, worker):
+    """Prepare the preloaded master for forking a worker."""
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+
+    # A connection must not be shared by processes.
+    connections.close_all()
+    # Workers would count the gauges of the master as those of a live process.
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+    # Keeps the garbage collector of the workers from writing to the objects of the
+    # master, which would copy the pages holding them.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Record the database connections of a worker forked from a preloaded master."""
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+
+    for connection in connections.all(initialized_only=True):
+        connection.record_max_connections()
+
+
+def child_exit(server, worker):
+    """Drop the Prometheus live gauge samples of an exited worker."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
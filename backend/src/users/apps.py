@@ -7,3 +7,12 @@ class UsersConfig(AppConfig):
     """Config"""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        """Connect the signal receivers of the application, preload password validators."""
+        from django.conf import settings
+
+        from . import password_validation, signals  # noqa: F401
+
+        if settings.PASSWORD_VALIDATORS_PRELOAD:
+            password_validation.preload()
@@ -0,0 +1,361 @@
+"""Async views for users.
+
+This module defines async counterparts of UserLoginView, UserDetailsView and EditUserView
+for the ASGI deployment mode. Django Rest Framework views are synchronous, so under ASGI
+they would each hold a thread for the whole request. These views instead await the
+database through the async ORM and the password hashing pool through asyncio, so one
+worker can serve many concurrent requests.
+
+They accept and return the same JSON payloads as their synchronous counterparts.
+
+Attributes:
+    AsyncAPIView (class): Subclass of django.views.View, handling authentication, parsing and errors.
+    AsyncUserLoginView (class): Subclass of AsyncAPIView for user login.
+    AsyncUserDetailsView (class): Subclass of AsyncAPIView for user details.
+    AsyncEditUserView (class): Subclass of AsyncAPIView for editing user information.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from . import authentication, hashing, payloads, sharding, tokens
+from .backends import EmailBackend
+from .models import User
+from .serializers import UserSerializer, user_read_serializer
+from .throttling import LoginEmailThrottle, LoginIPThrottle
+
+
+class AsyncAPIView(View):
+    """Base class of the async user views.
+
+    Extends django.views.View with the parts of rest_framework.views.APIView the user
+    views rely on: token authentication, JSON request parsing, JSON rendering and turning
+    API exceptions into error responses.
+
+    Attributes:
+        authentication_classes (tuple): The async authentication classes, tried in order.
+        requires_authentication (bool): Whether anonymous requests are rejected.
+        throttle_classes (tuple): The throttles checked by check_throttles.
+
+    Methods:
+        dispatch(request, *args, **kwargs): Authenticates the request and runs its handler.
+
+        check_throttles(request, data): Raises Throttled if a throttle rejects the request.
+
+        parse(request): Returns the JSON or form data of the request body.
+
+        render(data, status_code=200): Returns a JSON response.
+    """
+
+    authentication_classes = (
+        authentication.AsyncTokenAuthentication,
+        authentication.AsyncSignedTokenAuthentication,
+    )
+    requires_authentication = True
+    throttle_classes = ()
+    renderer = JSONRenderer()
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        """Return the view function, exempt from CSRF checks like DRF views."""
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        """Authenticate the request and run its handler.
+
+        Args:
+            request: The incoming request.
+
+        Returns:
+            HttpResponse: The response of the handler, or an error response.
+        """
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return self.http_method_not_allowed(request, *args, **kwargs)
+
+        authenticators = [cls() for cls in self.authentication_classes]
+        try:
+            credentials = None
+            for authenticator in authenticators:
+                credentials = await authenticator.aauthenticate(request)
+                if credentials is not None:
+                    break
+            if credentials is None and self.requires_authentication:
+                raise exceptions.NotAuthenticated()
+            if credentials is not None:
+                request.user, request.auth = credentials
+            return await handler(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc, authenticators[0])
+
+    def handle_exception(self, exc, authenticator):
+        """Turn an API exception into an error response, like DRF's exception handler.
+
+        The WWW-Authenticate header of a 401 response names the scheme of authenticator,
+        the first authentication class, as DRF does.
+        """
+        data = (
+            exc.detail
+            if isinstance(exc.detail, (list, dict))
+            else {"detail": exc.detail}
+        )
+        response = self.render(data, exc.status_code)
+        if isinstance(
+            exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)
+        ):
+            response.status_code = status.HTTP_401_UNAUTHORIZED
+            response["WWW-Authenticate"] = authenticator.authenticate_header(None)
+        if getattr(exc, "wait", None):
+            response["Retry-After"] = str(int(exc.wait))
+        return response
+
+    def check_throttles(self, request, data):
+        """Check the throttles of the view, like DRF's APIView.check_throttles.
+
+        Throttles are checked from the event loop: the buckets of the local store are
+        updated in microseconds.
+
+        Args:
+            request: The incoming request.
+            data (dict): The parsed body of the request.
+
+        Raises:
+            Throttled: If a throttle rejects the request.
+        """
+        waits = [
+            throttle.wait()
+            for throttle in (
+                throttle_class() for throttle_class in self.throttle_classes
+            )
+            if not throttle.allow(request, data)
+        ]
+        if waits:
+            raise exceptions.Throttled(max(waits))
+
+    def parse(self, request):
+        """Return the data of the request body.
+
+        Args:
+            request: The incoming request, with a JSON or, for POST, a form body.
+
+        Returns:
+            dict: The parsed data.
+
+        Raises:
+            ParseError: If the JSON body is malformed.
+        """
+        if request.content_type != "application/json":
+            return request.POST.dict()
+
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError as exc:
+            raise exceptions.ParseError(f"JSON parse error - {exc}") from exc
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        """Return data as a JSON response, byte for byte like DRF's JSONRenderer."""
+        return HttpResponse(
+            self.renderer.render(data),
+            content_type="application/json",
+            status=status_code,
+        )
+
+
+class AsyncUserLoginView(AsyncAPIView):
+    """Async view for user login.
+
+    Counterpart of UserLoginView. The user and an existing token are fetched with a single
+    query and the password is verified in the hashing pool while the event loop serves
+    other requests. Attempts are throttled like those of UserLoginView.
+
+    Methods:
+        post(request): Handles the POST request for user login.
+
+        aget_token(user): Returns the token of the user, creating it if missing.
+    """
+
+    requires_authentication = False
+    throttle_classes = (LoginIPThrottle, LoginEmailThrottle)
+
+    async def post(self, request):
+        """Login user.
+
+        Args:
+            request: The incoming request containing user credentials.
+
+        Returns:
+            HttpResponse: A response containing a token upon successful login,
+                          or an error message for invalid credentials.
+        """
+        data = self.parse(request)
+        self.check_throttles(request, data)
+        user = await EmailBackend().aauthenticate(
+            request, email=data.get("email"), password=data.get("password")
+        )
+        if user:
+            token = await self.aget_token(user)
+            data = {"token": token.key}
+            if settings.SIGNED_TOKENS:
+                data.update(tokens.issue_tokens(user))
+            return self.render(data)
+
+        return self.render(
+            {"error": "Invalid credentials"}, status.HTTP_401_UNAUTHORIZED
+        )
+
+    async def aget_token(self, user):
+        """Get the token of the user, creating it if missing.
+
+        Args:
+            user (User): The authenticated user, with its token selected by EmailBackend.
+
+        Returns:
+            Token: The token of the user.
+        """
+        try:
+            return user.auth_token
+        except Token.DoesNotExist:
+            pass
+
+        using = sharding.db_for_user(user)
+        try:
+            return await Token.objects.db_manager(using).acreate(
+                user=user, key=sharding.new_token_key(user)
+            )
+        except IntegrityError:
+            # Another request of the same user created the token concurrently.
+            return await Token.objects.db_manager(using).aget(user=user)
+
+
+class AsyncUserDetailsView(AsyncAPIView):
+    """Async view for user details.
+
+    Counterpart of UserDetailsView, with the same conditional and cached responses. With a
+    cached token, the request needs no database access at all.
+
+    Methods:
+        get(request): Handles the GET request for user details.
+    """
+
+    async def get(self, request):
+        """Get user details.
+
+        Args:
+            request: The authenticated request.
+
+        Returns:
+            HttpResponse: The details of the authenticated user, or a 304 response.
+        """
+        user = request.user
+        not_modified = payloads.conditional_response(request, user)
+        if not_modified is not None:
+            return not_modified
+
+        _, payload = payloads.cached_payload(
+            user,
+            self.renderer.media_type,
+            lambda: user_read_serializer.to_representation(user),
+            self.renderer.render,
+        )
+        response = HttpResponse(payload, content_type=self.renderer.media_type)
+        payloads.set_validators(response, user)
+        return response
+
+
+class AsyncEditUserView(AsyncAPIView):
+    """Async view for editing user information.
+
+    Counterpart of EditUserView. The uniqueness validators of UserSerializer query the
+    database synchronously, so validation runs in a thread. A new password is hashed in
+    the hashing pool while the event loop serves other requests. Like EditUserView, the
+    changes are then saved to the user read again from the database and locked, in a
+    transaction, which also runs in a thread.
+
+    Methods:
+        put(request): Handles the PUT request, replacing the user information.
+
+        patch(request): Handles the PATCH request, updating part of the user information.
+
+        save(user_id, changes): Saves the changes to the user, returning it.
+    """
+
+    async def put(self, request):
+        """Replace the user information."""
+        return await self.update(request, partial=False)
+
+    async def patch(self, request):
+        """Update part of the user information."""
+        return await self.update(request, partial=True)
+
+    async def update(self, request, partial):
+        """Validate the request data and save it to the authenticated user.
+
+        Args:
+            request: The authenticated request containing the user information.
+            partial (bool): Whether fields may be left out.
+
+        Returns:
+            HttpResponse: The updated user details, or the validation errors.
+        """
+        user = request.user
+        serializer = UserSerializer(user, data=self.parse(request), partial=partial)
+        if not await sync_to_async(serializer.is_valid)():
+            return self.render(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        changes = dict(serializer.validated_data)
+        password = changes.pop("password", None)
+        if password:
+            changes["password"] = await hashing.amake_password(password)
+        try:
+            serializer.instance = await sync_to_async(self.save)(user.pk, changes)
+        except User.DoesNotExist:
+            return self.render({"detail": "Not found."}, status.HTTP_404_NOT_FOUND)
+        except IntegrityError:
+            return self.render(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        serializer.error_messages["conflict"]
+                    ]
+                },
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        return self.render(serializer.data)
+
+    def save(self, user_id, changes):
+        """Save validated changes to a user, read again from the database and locked.
+
+        Args:
+            user_id (int): The id of the user.
+            changes (dict): The new values by field, with the password already hashed.
+
+        Returns:
+            User: The updated user.
+
+        Raises:
+            User.DoesNotExist: If the user was deleted.
+            IntegrityError: If a user with the email or phone was saved concurrently, or
+                            the shard of the new email has a user with the phone.
+        """
+        with transaction.atomic(using=sharding.shard_for_id(user_id)):
+            user = User.objects.for_id(user_id).select_for_update().get(pk=user_id)
+            for attr, value in changes.items():
+                setattr(user, attr, value)
+            if "password" in changes:
+                # Revokes the signed tokens of the user, see users.tokens.
+                user.token_version = F("token_version") + 1
+            user.save()
+            # A new email may belong to another shard.
+            return sharding.relocate_user(user)
@@ -0,0 +1,342 @@
+"""Authentication classes for users.
+
+This module defines CachedTokenAuthentication, a Django Rest Framework token authentication
+which keeps recently used tokens in an in-process cache. A cache hit authenticates a request
+without any database query.
+
+It also defines SignedTokenAuthentication, which authenticates the signed access tokens of
+users.tokens with the "Bearer" keyword. Their signature is checked locally and their user
+is kept in the same cache, by user id, so that a cache hit needs no database query either.
+
+When users are sharded, tokens and users are only looked up on the shard their token key
+or user id tells, see users.sharding.
+
+Cached entries are dropped when their user or token is saved or deleted in this process
+(see users.signals). Other processes notice such changes once the entry expires, after
+TOKEN_CACHE_TTL seconds.
+
+Attributes:
+    token_cache (LRUCache): Cache of token key to token and user snapshot, and of user id to user snapshot.
+    CachedTokenAuthentication (class): Subclass of rest_framework.authentication.TokenAuthentication.
+    AsyncTokenAuthentication (class): Subclass of CachedTokenAuthentication for the async views.
+    SignedTokenAuthentication (class): Subclass of CachedTokenAuthentication for signed access tokens.
+    AsyncSignedTokenAuthentication (class): Subclass of SignedTokenAuthentication for the async views.
+    invalidate_token (function): Drops a token from the cache.
+    invalidate_user (function): Drops every token of a user from the cache.
+    introspect_tokens (function): Returns the user id and active status of many token keys at once.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+
+from . import sharding, tokens
+from .cache import LRUCache
+
+token_cache = LRUCache(
+    max_entries=settings.TOKEN_CACHE_MAX_ENTRIES, ttl=settings.TOKEN_CACHE_TTL
+)
+
+
+def _user_snapshot(user):
+    """Return the plain values needed to rebuild a user without a query."""
+    fields = user._meta.concrete_fields
+    return (
+        user._state.db,
+        tuple(field.attname for field in fields),
+        tuple(getattr(user, field.attname) for field in fields),
+    )
+
+
+def _snapshot(user, token):
+    """Return the plain values needed to rebuild user and token without a query."""
+    return (*_user_snapshot(user), token.created)
+
+
+def _restore(model, key, snapshot):
+    """Rebuild fresh user and token instances from a snapshot.
+
+    Every hit gets its own instances, so that a view changing request.user does not
+    change the cached values.
+    """
+    db, field_names, values, created = snapshot
+    user_model = model._meta.get_field("user").related_model
+    user = user_model.from_db(db, field_names, values)
+
+    token = model(key=key, user=user, created=created)
+    token._state.adding = False
+    token._state.db = db
+    return user, token
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """Token authentication backed by an in-process cache.
+
+    Extends rest_framework.authentication.TokenAuthentication. Tokens are looked up in
+    token_cache first and only queried from the database on a miss. Invalid tokens and
+    tokens of inactive users are never cached.
+
+    Methods:
+        authenticate_credentials(key): Authenticates the token key.
+
+        get_tokens(key): Returns the tokens of the shard of a key, with their user.
+
+        check_token(key, token): Returns the credentials of a token, caching them.
+    """
+
+    def authenticate_credentials(self, key):
+        """Authenticate the token key.
+
+        Args:
+            key (str): The token key sent by the client.
+
+        Returns:
+            tuple: The user and token of the key.
+
+        Raises:
+            AuthenticationFailed: If the token is invalid or the user is inactive.
+        """
+        model = self.get_model()
+        snapshot = token_cache.get(key)
+        if snapshot is not None:
+            return _restore(model, key, snapshot)
+
+        try:
+            token = self.get_tokens(key).get(key=key)
+        except model.DoesNotExist as exc:
+            raise exceptions.AuthenticationFailed(_("Invalid token.")) from exc
+
+        return self.check_token(key, token)
+
+    def get_tokens(self, key):
+        """Return the tokens of the shard of a key, with their user."""
+        manager = self.get_model().objects.db_manager(sharding.shard_for_token_key(key))
+        return manager.select_related("user")
+
+    def check_token(self, key, token):
+        """Return the credentials of a token found in the database, caching them.
+
+        Raises:
+            AuthenticationFailed: If the user is inactive.
+        """
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+
+        token_cache.set(key, _snapshot(token.user, token), group=token.user.pk)
+        return token.user, token
+
+
+class AsyncTokenAuthentication(CachedTokenAuthentication):
+    """Token authentication for the async views.
+
+    Extends CachedTokenAuthentication with coroutines that read the token through the
+    async ORM on a cache miss. It shares the cache of CachedTokenAuthentication.
+
+    Methods:
+        aauthenticate(request): Authenticates a Django request.
+
+        aauthenticate_credentials(key): Authenticates the token key.
+    """
+
+    async def aauthenticate(self, request):
+        """Authenticate a Django request.
+
+        Args:
+            request: The incoming Django request.
+
+        Returns:
+            tuple: The user and token of the request, or None if it carries no token.
+
+        Raises:
+            AuthenticationFailed: If the token header is malformed or the token is invalid.
+        """
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) == 1:
+            msg = _("Invalid token header. No credentials provided.")
+            raise exceptions.AuthenticationFailed(msg)
+        if len(auth) > 2:
+            msg = _("Invalid token header. Token string should not contain spaces.")
+            raise exceptions.AuthenticationFailed(msg)
+
+        try:
+            key = auth[1].decode()
+        except UnicodeError as exc:
+            msg = _(
+                "Invalid token header. Token string should not contain invalid characters."
+            )
+            raise exceptions.AuthenticationFailed(msg) from exc
+
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        """Authenticate the token key.
+
+        Args:
+            key (str): The token key sent by the client.
+
+        Returns:
+            tuple: The user and token of the key.
+
+        Raises:
+            AuthenticationFailed: If the token is invalid or the user is inactive.
+        """
+        model = self.get_model()
+        snapshot = token_cache.get(key)
+        if snapshot is not None:
+            return _restore(model, key, snapshot)
+
+        try:
+            token = await self.get_tokens(key).aget(key=key)
+        except model.DoesNotExist as exc:
+            raise exceptions.AuthenticationFailed(_("Invalid token.")) from exc
+
+        return self.check_token(key, token)
+
+
+class SignedTokenAuthentication(CachedTokenAuthentication):
+    """Authentication of the signed access tokens of users.tokens.
+
+    Extends CachedTokenAuthentication, from which it takes the parsing of the
+    Authorization header, with the "Bearer" keyword. The token signature and age are
+    checked locally. The user is looked up in token_cache by id, and only queried from
+    the database on a miss, then its token version must match the one of the token.
+
+    Methods:
+        authenticate_credentials(key): Authenticates the access token.
+    """
+
+    keyword = "Bearer"
+
+    def read(self, key):
+        """Return the user id and token version of an access token.
+
+        Raises:
+            AuthenticationFailed: If the token is malformed, altered or expired.
+        """
+        try:
+            return tokens.read_access_token(key)
+        except signing.BadSignature as exc:
+            raise exceptions.AuthenticationFailed(_("Invalid token.")) from exc
+
+    def check(self, user, token_version, key):
+        """Return the credentials of a token whose user was found.
+
+        Raises:
+            AuthenticationFailed: If the token was revoked or the user is inactive.
+        """
+        if user.token_version != token_version:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return user, key
+
+    def authenticate_credentials(self, key):
+        """Authenticate the access token.
+
+        Args:
+            key (str): The access token sent by the client.
+
+        Returns:
+            tuple: The user of the token, and the token.
+
+        Raises:
+            AuthenticationFailed: If the token is invalid or revoked, or the user is inactive.
+        """
+        user_id, token_version = self.read(key)
+        user_model = get_user_model()
+        snapshot = token_cache.get(("user", user_id))
+        if snapshot is not None:
+            return self.check(user_model.from_db(*snapshot), token_version, key)
+
+        try:
+            user = user_model.objects.for_id(user_id).get(pk=user_id)
+        except user_model.DoesNotExist as exc:
+            raise exceptions.AuthenticationFailed(_("Invalid token.")) from exc
+
+        token_cache.set(("user", user_id), _user_snapshot(user), group=user.pk)
+        return self.check(user, token_version, key)
+
+
+class AsyncSignedTokenAuthentication(
+    SignedTokenAuthentication, AsyncTokenAuthentication
+):
+    """Authentication of signed access tokens for the async views.
+
+    Extends SignedTokenAuthentication with the coroutines of AsyncTokenAuthentication,
+    reading the user through the async ORM on a cache miss.
+
+    Methods:
+        aauthenticate_credentials(key): Authenticates the access token.
+    """
+
+    async def aauthenticate_credentials(self, key):
+        """Asynchronous version of authenticate_credentials."""
+        user_id, token_version = self.read(key)
+        user_model = get_user_model()
+        snapshot = token_cache.get(("user", user_id))
+        if snapshot is not None:
+            return self.check(user_model.from_db(*snapshot), token_version, key)
+
+        try:
+            user = await user_model.objects.for_id(user_id).aget(pk=user_id)
+        except user_model.DoesNotExist as exc:
+            raise exceptions.AuthenticationFailed(_("Invalid token.")) from exc
+
+        token_cache.set(("user", user_id), _user_snapshot(user), group=user.pk)
+        return self.check(user, token_version, key)
+
+
+def invalidate_token(key):
+    """Drop a token from the cache.
+
+    Args:
+        key (str): The token key.
+    """
+    token_cache.delete(key)
+
+
+def invalidate_user(user_id):
+    """Drop every token of a user from the cache.
+
+    Args:
+        user_id: The primary key of the user.
+    """
+    token_cache.delete_group(user_id)
+
+
+def introspect_tokens(keys):
+    """Return the user id and active status of the users of many token keys at once.
+
+    The tokens are read with one query per shard holding some of them, joined to their
+    users, without the cache: revoked tokens and deactivated users are seen at once.
+
+    Args:
+        keys (iterable): The token keys.
+
+    Returns:
+        dict: The user id and whether the user is active, by key of an existing token.
+    """
+    shards = defaultdict(set)
+    for key in keys:
+        shards[sharding.shard_for_token_key(key)].add(key)
+    if sharding.is_enabled():
+        # Keys telling no shard belong to no token.
+        shards.pop(None, None)
+
+    found = {}
+    for db, shard_keys in shards.items():
+        rows = (
+            Token.objects.db_manager(db)
+            .filter(key__in=shard_keys)
+            .values_list("key", "user_id", "user__is_active")
+        )
+        found.update((key, (user_id, is_active)) for key, user_id, is_active in rows)
+    return found
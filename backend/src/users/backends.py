@@ -2,6 +2,12 @@
 
 This module defines the EmailBackend class, a custom authentication backend for the User model.
 It extends Django's ModelBackend and provides methods for authenticating users based on email.
+Emails are matched in their normalized, lowercase form, which the unique index on email serves.
+Passwords are verified in the hashing pool so that request threads do not hold the GIL meanwhile.
+A password stored with another hasher or cost than the preferred one is hashed again on login,
+writing only the password column. Unknown emails cost a password check too, so that their
+response time does not tell them apart. When users are sharded, users are looked up on the shard
+of their email or id only, see users.sharding.
 
 Attributes:
     EmailBackend (class): Subclass of Django's ModelBackend, representing the email
@@ -10,7 +16,8 @@ Attributes:
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
+
+from . import hashing
 
 
 class EmailBackend(ModelBackend):
@@ -21,6 +28,8 @@ class EmailBackend(ModelBackend):
     Methods:
         authenticate(request, email=None, password=None, **kwargs): Authenticates user by email.
 
+        aauthenticate(request, email=None, password=None, **kwargs): Asynchronous version of authenticate.
+
         get_user(user_id): Retrieves a user by ID.
 
     Example:
@@ -43,12 +52,46 @@ class EmailBackend(ModelBackend):
         """
         user_model = get_user_model()
         try:
-            user = user_model.objects.get(Q(email__iexact=email))
+            # The token is joined in so that logging in needs no further query for it.
+            user = (
+                user_model.objects.for_email(email)
+                .select_related("auth_token")
+                .get(email=user_model.objects.normalize_email(email))
+            )
+        except user_model.DoesNotExist:
+            hashing.verify_dummy_password(password)
+            return None
+
+        if not hashing.check_password(user, password):
+            return None
+        return user
+
+    async def aauthenticate(self, request, email=None, password=None, **kwargs):
+        """Authenticate user by email, using the async ORM.
+
+        Args:
+            request: The current request.
+            email (str): Email address of the user.
+            password (str): Password for the user.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            User: The authenticated user object or None if authentication fails.
+        """
+        user_model = get_user_model()
+        try:
+            user = (
+                await user_model.objects.for_email(email)
+                .select_related("auth_token")
+                .aget(email=user_model.objects.normalize_email(email))
+            )
         except user_model.DoesNotExist:
+            await hashing.averify_dummy_password(password)
             return None
 
-        if user.check_password(password):
-            return user
+        if not await hashing.acheck_password(user, password):
+            return None
+        return user
 
     def get_user(self, user_id):
         """Get user by ID.
@@ -61,6 +104,6 @@ class EmailBackend(ModelBackend):
         """
         user_model = get_user_model()
         try:
-            return user_model.objects.get(pk=user_id)
+            return user_model.objects.for_id(user_id).get(pk=user_id)
         except user_model.DoesNotExist:
             return None
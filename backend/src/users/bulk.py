@@ -0,0 +1,334 @@
+"""Bulk operations for users.
+
+This module implements the batch registration and the batch update of users. A batch is
+validated row by row, checked for email and phone conflicts with a single query and
+written with bulk inserts or bulk updates.
+
+Attributes:
+    BulkUserRegistration (class): Registers a batch of users and reports the outcome per row.
+    BulkUserUpdate (class): Updates a batch of users and reports the outcome per row.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import authentication
+from .hashing import make_passwords
+from .models import User
+from .serializers import BulkUserRowSerializer, BulkUserUpdateRowSerializer
+
+
+class BulkUserRegistration:
+    """Register a batch of users.
+
+    Every row is validated with BulkUserRowSerializer. Rows which are invalid, which
+    repeat an email or phone of an earlier row, or which collide with an existing user
+    are reported as errors; all other rows are created.
+
+    Attributes:
+        rows (list): The raw user dictionaries of the batch.
+        results (list): The per-row report, filled in by run().
+
+    Methods:
+        run(): Validates and creates the batch, returning the per-row report.
+
+    Example:
+        registration = BulkUserRegistration([{"email": "user@example.com", ...}])
+        results = registration.run()
+    """
+
+    duplicate_messages = {
+        "email": "This email address is repeated in the batch.",
+        "phone": "This phone number is repeated in the batch.",
+    }
+    existing_messages = {
+        "email": "user with this email already exists.",
+        "phone": "user with this phone already exists.",
+    }
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.results = [None] * len(rows)
+
+    def run(self):
+        """Validate and create the batch.
+
+        Returns:
+            list: One dictionary per row, holding its index, status and either the id of
+                  the created user or the validation errors.
+
+        Raises:
+            IntegrityError: If a conflicting user was created concurrently. No user of the
+                            batch is created in that case.
+        """
+        valid = self._validate_rows()
+        valid = self._drop_duplicates(valid)
+        valid = self._drop_existing(valid)
+
+        if valid:
+            self._create(valid)
+
+        return self.results
+
+    def _fail(self, index, errors):
+        self.results[index] = {"index": index, "status": "error", "errors": errors}
+
+    def _validate_rows(self):
+        valid = {}
+        for index, row in enumerate(self.rows):
+            serializer = BulkUserRowSerializer(data=row)
+            if not serializer.is_valid():
+                self._fail(index, serializer.errors)
+                continue
+
+            valid[index] = serializer.validated_data
+        return valid
+
+    def _drop_duplicates(self, valid):
+        seen = {field: set() for field in self.duplicate_messages}
+        unique = {}
+        for index, data in valid.items():
+            errors = {
+                field: [message]
+                for field, message in self.duplicate_messages.items()
+                if data[field] in seen[field]
+            }
+            for field in seen:
+                seen[field].add(data[field])
+
+            if errors:
+                self._fail(index, errors)
+            else:
+                unique[index] = data
+        return unique
+
+    def _drop_existing(self, valid):
+        if not valid:
+            return valid
+
+        emails = [data["email"] for data in valid.values()]
+        phones = [data["phone"] for data in valid.values()]
+        existing = {"email": set(), "phone": set()}
+        for email, phone in User.objects.filter(
+            Q(email__in=emails) | Q(phone__in=phones)
+        ).values_list("email", "phone"):
+            existing["email"].add(email)
+            existing["phone"].add(phone)
+
+        available = {}
+        for index, data in valid.items():
+            errors = {
+                field: [message]
+                for field, message in self.existing_messages.items()
+                if data[field] in existing[field]
+            }
+            if errors:
+                self._fail(index, errors)
+            else:
+                available[index] = data
+        return available
+
+    def _create(self, valid):
+        passwords = make_passwords([data.pop("password") for data in valid.values()])
+        users = [
+            User(password=password, **data)
+            for password, data in zip(passwords, valid.values())
+        ]
+
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=settings.BULK_CREATE_BATCH_SIZE)
+
+        for index, user in zip(valid, users):
+            self.results[index] = {"index": index, "status": "created", "id": user.pk}
+
+
+class BulkUserUpdate:
+    """Update a batch of users.
+
+    Every row holds the id of a user and the fields to change, validated with
+    BulkUserUpdateRowSerializer. The users of the batch are locked and read with one
+    query, the new emails and phones are checked against the batch and the table with
+    one more, and the changes are written with bulk_update in chunks of
+    BULK_UPDATE_BATCH_SIZE, all in one transaction. Rows which are invalid, which name a
+    missing or repeated user, or whose email or phone is taken are reported as errors;
+    all other rows are applied.
+
+    An email or phone is taken while any other user holds it, even one which gives it up
+    in the same batch.
+
+    Attributes:
+        rows (list): The raw update dictionaries of the batch.
+        results (list): The per-row report, filled in by run().
+
+    Methods:
+        run(): Validates and applies the batch, returning the per-row report.
+
+    Example:
+        update = BulkUserUpdate([{"id": 42, "phone": "+15550100"}])
+        results = update.run()
+    """
+
+    unique_fields = ("email", "phone")
+    duplicate_messages = BulkUserRegistration.duplicate_messages
+    existing_messages = BulkUserRegistration.existing_messages
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.results = [None] * len(rows)
+
+    def run(self):
+        """Validate and apply the batch.
+
+        Returns:
+            list: One dictionary per row, holding its index, status, the id of the user
+                  and, for rejected rows, the validation errors.
+
+        Raises:
+            IntegrityError: If a conflicting email or phone was written concurrently. No
+                            user of the batch is updated in that case.
+        """
+        valid = self._validate_rows()
+        with transaction.atomic():
+            users = self._lock_users(valid)
+            valid = self._drop_duplicates(valid)
+            valid = self._drop_existing(valid)
+            if valid:
+                self._update(valid, users)
+
+        return self.results
+
+    def _fail(self, index, errors):
+        self.results[index] = {
+            "index": index,
+            "status": "error",
+            "id": (
+                self.rows[index].get("id")
+                if isinstance(self.rows[index], dict)
+                else None
+            ),
+            "errors": errors,
+        }
+
+    def _validate_rows(self):
+        allowed = set(BulkUserUpdateRowSerializer.Meta.fields)
+        valid = {}
+        seen = set()
+        for index, row in enumerate(self.rows):
+            if not isinstance(row, dict):
+                self._fail(index, {"non_field_errors": ["Expected an object."]})
+                continue
+
+            errors = {
+                field: ["This field cannot be updated in bulk."]
+                for field in row.keys() - allowed
+            }
+            serializer = BulkUserUpdateRowSerializer(data=row, partial=True)
+            if not serializer.is_valid():
+                errors.update(serializer.errors)
+            elif "id" not in serializer.validated_data:
+                errors["id"] = ["This field is required."]
+            elif serializer.validated_data["id"] in seen:
+                errors["id"] = ["This user is repeated in the batch."]
+            if errors:
+                self._fail(index, errors)
+                continue
+
+            seen.add(serializer.validated_data["id"])
+            valid[index] = serializer.validated_data
+        return valid
+
+    def _lock_users(self, valid):
+        ids = [data["id"] for data in valid.values()]
+        users = User.objects.select_for_update().in_bulk(ids)
+        for index, data in list(valid.items()):
+            if data["id"] not in users:
+                self._fail(index, {"id": ["User not found."]})
+                del valid[index]
+        return users
+
+    def _drop_duplicates(self, valid):
+        seen = {field: set() for field in self.unique_fields}
+        unique = {}
+        for index, data in valid.items():
+            errors = {
+                field: [self.duplicate_messages[field]]
+                for field in self.unique_fields
+                if field in data and data[field] in seen[field]
+            }
+            for field in self.unique_fields:
+                if field in data:
+                    seen[field].add(data[field])
+
+            if errors:
+                self._fail(index, errors)
+            else:
+                unique[index] = data
+        return unique
+
+    def _drop_existing(self, valid):
+        values = {
+            field: [data[field] for data in valid.values() if field in data]
+            for field in self.unique_fields
+        }
+        if not any(values.values()):
+            return valid
+
+        holders = {field: {} for field in self.unique_fields}
+        conflicts = User.objects.filter(
+            Q(email__in=values["email"]) | Q(phone__in=values["phone"])
+        ).values_list("pk", *self.unique_fields)
+        for pk, *held in conflicts:
+            for field, value in zip(self.unique_fields, held):
+                holders[field][value] = pk
+
+        available = {}
+        for index, data in valid.items():
+            errors = {
+                field: [self.existing_messages[field]]
+                for field in self.unique_fields
+                if field in data
+                and holders[field].get(data[field], data["id"]) != data["id"]
+            }
+            if errors:
+                self._fail(index, errors)
+            else:
+                available[index] = data
+        return available
+
+    def _update(self, valid, users):
+        now = timezone.now()
+        changed = {"updated_at", "version"}
+        updated = []
+        for data in valid.values():
+            user = users[data["id"]]
+            for field, value in data.items():
+                if field != "id":
+                    setattr(user, field, value)
+                    changed.add(field)
+            # bulk_update bypasses save(), which maintains these two.
+            user.updated_at = now
+            user.version += 1
+            updated.append(user)
+
+        User.objects.bulk_update(
+            updated, sorted(changed), batch_size=settings.BULK_UPDATE_BATCH_SIZE
+        )
+        # bulk_update sends no post_save either, drop the cached tokens like
+        # users.signals does.
+        user_ids = [user.pk for user in updated]
+        self._invalidate(user_ids)
+        transaction.on_commit(lambda: self._invalidate(user_ids))
+
+        for index, data in valid.items():
+            self.results[index] = {
+                "index": index,
+                "status": "updated",
+                "id": data["id"],
+            }
+
+    @staticmethod
+    def _invalidate(user_ids):
+        for user_id in user_ids:
+            authentication.invalidate_user(user_id)
@@ -0,0 +1,135 @@
+"""In-process caches for users.
+
+This module defines LRUCache, a small thread-safe cache bounded both in size and in the
+age of its entries. Entries can be tagged with a group so that every entry belonging to
+one user can be dropped at once.
+
+Attributes:
+    LRUCache (class): Bounded least-recently-used cache with a time to live per entry.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded least-recently-used cache with a time to live per entry.
+
+    When the cache is full, the least recently used entry is evicted. Entries older than
+    the time to live are treated as missing. A cache with max_entries set to 0 stores
+    nothing.
+
+    Attributes:
+        max_entries (int): Maximum number of entries kept.
+        ttl (float): Seconds an entry stays valid after it was stored.
+
+    Methods:
+        get(key): Returns the value stored for key, or None.
+        set(key, value, group=None): Stores value for key, optionally tagged with a group.
+        delete(key): Drops the entry for key.
+        delete_group(group): Drops every entry tagged with group.
+        clear(): Drops every entry.
+        stats(): Returns the hit and miss counters and the current size.
+
+    Example:
+        cache = LRUCache(max_entries=1000, ttl=60)
+        cache.set("key", "value", group=1)
+        cache.get("key")
+        cache.delete_group(1)
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """Return the value stored for key.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            The stored value, or None if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, group, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value, group=None):
+        """Store value for key.
+
+        Args:
+            key: The key to store the value under.
+            value: The value to store. None cannot be told apart from a miss.
+            group: Optional tag for delete_group().
+        """
+        if self.max_entries < 1:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, group, time.monotonic() + self.ttl)
+            if group is not None:
+                self._groups.setdefault(group, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Drop the entry for key, if any."""
+        with self._lock:
+            self._remove(key)
+
+    def delete_group(self, group):
+        """Drop every entry tagged with group."""
+        with self._lock:
+            for key in self._groups.pop(group, ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns:
+            dict: The number of hits and misses so far and the number of stored entries.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "size": len(self._entries),
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[1] is None:
+            return
+
+        keys = self._groups.get(entry[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[entry[1]]
@@ -0,0 +1,157 @@
+"""Streaming export of users.
+
+This module encodes users as NDJSON or CSV while they are read from the database. Rows are
+fetched through a server-side cursor, chunk by chunk, and encoded as plain tuples, so the
+memory used by an export does not depend on the number of users. When users are sharded,
+the shards are read one after the other.
+
+Under ASGI, a response streaming a synchronous iterator is first read to the end in a
+thread, which would hold the whole export in memory. The asynchronous versions of
+export_rows and encode_rows read and encode the rows a chunk at a time through the async
+ORM instead.
+
+Attributes:
+    EXPORT_FORMATS (dict): Content type of every supported export format.
+    export_fields (function): Returns the names of the exported fields.
+    export_rows (function): Returns the exported values of every user of a queryset.
+    aexport_rows (function): Asynchronous version of export_rows.
+    encode_rows (function): Encodes rows in an export format, a chunk at a time.
+    aencode_rows (function): Asynchronous version of encode_rows.
+"""
+
+import csv
+import io
+import json
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import sharding
+from .serializers import user_read_serializer
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def export_fields():
+    """Return the names of the exported fields.
+
+    The export carries the readable fields of UserSerializer, in the same order. Every
+    one of them is a plain model field, whose values the database returns as the
+    serializer would represent them, so rows are read with values_list and need no
+    serialization at all.
+
+    Returns:
+        list: Field names.
+    """
+    return [name for name, _, _ in user_read_serializer.plan]
+
+
+def export_rows(queryset, fields):
+    """Return the exported values of every user of a queryset.
+
+    When users are sharded, the queryset is run on every shard in turn. Shard N
+    allocates ids above those of the shards before it, so the rows stay in id order.
+
+    Args:
+        queryset (QuerySet): The users to export.
+        fields (list): Names of the exported fields.
+
+    Returns:
+        Iterator: One tuple of values per user, read through a server-side cursor.
+    """
+    rows = queryset.order_by("pk").values_list(*fields)
+    if not sharding.is_enabled():
+        return rows.iterator(chunk_size=settings.USER_EXPORT_CHUNK_SIZE)
+    return chain.from_iterable(
+        rows.using(alias).iterator(chunk_size=settings.USER_EXPORT_CHUNK_SIZE)
+        for alias in settings.USER_SHARDS
+    )
+
+
+async def aexport_rows(queryset, fields):
+    """Asynchronous version of export_rows.
+
+    The rows of the server-side cursor are read in a thread, a chunk at a time. Unlike
+    this, QuerySet.aiterator runs the query of a values_list in the event loop.
+
+    Returns:
+        AsyncIterator: One tuple of values per user.
+    """
+    rows = export_rows(queryset, fields)
+    size = settings.USER_EXPORT_CHUNK_SIZE
+    while True:
+        chunk = await sync_to_async(lambda: list(islice(rows, size)))()
+        for row in chunk:
+            yield row
+        if len(chunk) < size:
+            break
+
+
+def _line_encoder(fields, export_format):
+    """Return the header line of an export format and a function encoding a row."""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def encode(row):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            return buffer.getvalue()
+
+        return encode(fields), encode
+
+    # Same compact encoding as the JSON renderer of Django Rest Framework.
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    return "", lambda row: encoder.encode(dict(zip(fields, row))) + "\n"
+
+
+def encode_rows(rows, fields, export_format):
+    """Encode rows in an export format.
+
+    Lines are joined into chunks of USER_EXPORT_CHUNK_SIZE rows, so that the response is
+    written in a few large pieces rather than one piece per user.
+
+    Args:
+        rows (Iterator): Tuples of values, as returned by export_rows().
+        fields (list): Names of the exported fields.
+        export_format (str): One of the keys of EXPORT_FORMATS.
+
+    Returns:
+        Iterator: UTF-8 encoded chunks of the export.
+    """
+    header, encode = _line_encoder(fields, export_format)
+    chunk = [header] if header else []
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= settings.USER_EXPORT_CHUNK_SIZE:
+            yield "".join(chunk).encode()
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+async def aencode_rows(rows, fields, export_format):
+    """Asynchronous version of encode_rows.
+
+    Args:
+        rows (AsyncIterator): Tuples of values, as returned by aexport_rows().
+
+    Returns:
+        AsyncIterator: UTF-8 encoded chunks of the export.
+    """
+    header, encode = _line_encoder(fields, export_format)
+    chunk = [header] if header else []
+    async for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= settings.USER_EXPORT_CHUNK_SIZE:
+            yield "".join(chunk).encode()
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk).encode()
@@ -0,0 +1,46 @@
+"""Password hashers with costs tuned from the settings.
+
+Django's hashers fix their cost in class attributes. The hashers of this module read it
+from the settings instead, so that the cost of hashing can be adjusted to the machine
+running the application, as measured by the calibrate_hashers management command.
+
+They keep the algorithm names of the Django hashers they extend, so hashes created by
+either remain valid. When the stored hash of a user was made with another algorithm or
+another cost than the preferred hasher, it is hashed again the next time the user logs
+in, see EmailBackend.authenticate.
+
+Attributes:
+    TunedPBKDF2PasswordHasher (class): PBKDF2 hasher with its iterations taken from PBKDF2_ITERATIONS.
+    TunedArgon2PasswordHasher (class): Argon2 hasher with its costs taken from the ARGON2_* settings.
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class TunedPBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2 SHA256 hasher with a configurable number of iterations.
+
+    Attributes:
+        iterations (int): The iterations of new hashes, PBKDF2_ITERATIONS by default.
+    """
+
+    def __init__(self, iterations=None):
+        self.iterations = iterations or settings.PBKDF2_ITERATIONS
+
+
+class TunedArgon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2id hasher with configurable time and memory costs.
+
+    Requires the argon2-cffi package.
+
+    Attributes:
+        time_cost (int): Number of passes over the memory, ARGON2_TIME_COST by default.
+        memory_cost (int): Memory used in KiB, ARGON2_MEMORY_COST by default.
+        parallelism (int): Number of lanes, ARGON2_PARALLELISM by default.
+    """
+
+    def __init__(self, time_cost=None, memory_cost=None, parallelism=None):
+        self.time_cost = time_cost or settings.ARGON2_TIME_COST
+        self.memory_cost = memory_cost or settings.ARGON2_MEMORY_COST
+        self.parallelism = parallelism or settings.ARGON2_PARALLELISM
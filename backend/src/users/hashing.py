@@ -0,0 +1,489 @@
+"""Password hashing for users.
+
+This module runs password hashing and verification in a pool of worker processes.
+PBKDF2 holds the GIL for hundreds of milliseconds per password, so doing it in the
+request thread stalls every other thread of the same gunicorn worker. Waiting on the
+pool releases the GIL instead.
+
+The pool is bounded: at most PASSWORD_HASHING_WORKERS jobs run at once and at most
+PASSWORD_HASHING_MAX_PENDING more may wait for a worker. Callers that cannot get a slot
+within PASSWORD_HASHING_QUEUE_TIMEOUT seconds are rejected with a 503 response.
+
+Attributes:
+    HashingUnavailable (class): Subclass of rest_framework.exceptions.APIException, raised when the pool is saturated.
+    PasswordHashingExecutor (class): Bounded process pool for hashing jobs, with wait and compute time metrics.
+    get_executor (function): Returns the executor of the current process.
+    make_password (function): Hashes a raw password.
+    make_passwords (function): Hashes a list of raw passwords in parallel.
+    verify_password (function): Checks a raw password against an encoded one.
+    verify_dummy_password (function): Spends the time of a password check for an unknown user.
+    upgrade_password (function): Hashes a password again with the preferred hasher, saving only the password.
+    check_password (function): Checks the password of a user, upgrading the stored hash if needed.
+    set_password (function): Sets the password of a user.
+    amake_password (function): Asynchronous version of make_password.
+    averify_password (function): Asynchronous version of verify_password.
+    averify_dummy_password (function): Asynchronous version of verify_dummy_password.
+    aupgrade_password (function): Asynchronous version of upgrade_password.
+    acheck_password (function): Asynchronous version of check_password.
+    aset_password (function): Asynchronous version of set_password.
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db import transaction
+from django.utils.crypto import get_random_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core import metrics
+
+from . import sharding
+
+
+class HashingUnavailable(APIException):
+    """Raised when no hashing slot becomes free within the queue timeout."""
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The service is busy, please retry shortly."
+    default_code = "hashing_unavailable"
+    wait = 1
+
+
+def _setup_worker():
+    """Configure Django inside a freshly started hashing worker process."""
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    # Workers only hash passwords, they never validate them.
+    os.environ["PASSWORD_VALIDATORS_PRELOAD"] = "0"
+    # Nor serve requests: metrics they recorded, such as the connections their Django
+    # setup creates, would add to those of the gunicorn workers.
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    django.setup()
+
+
+def _timed(func, args):
+    """Run func(*args) and return its result along with the time it took.
+
+    Runs inside the worker process, so the duration is pure compute time.
+    """
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def _timed_batch(func, items):
+    """Run func over items and return the results along with the time it took."""
+    started = time.perf_counter()
+    results = [func(item) for item in items]
+    return results, time.perf_counter() - started
+
+
+class PasswordHashingExecutor:
+    """Bounded process pool for hashing jobs.
+
+    Every job takes a slot for as long as it is queued or running. When all slots are
+    taken, new jobs wait up to queue_timeout seconds for one and are then rejected
+    with HashingUnavailable.
+
+    With zero workers, jobs run inline in the calling thread. They are still timed,
+    but never rejected.
+
+    Attributes:
+        workers (int): Number of worker processes.
+        max_pending (int): Number of jobs allowed to wait for a free worker.
+        queue_timeout (float): Seconds to wait for a free slot before rejecting a job.
+
+    Methods:
+        submit(func, *args): Schedules func(*args) and returns a Future of its result.
+        run(func, *args): Runs func(*args) in the pool and returns its result.
+        map(func, items): Runs func over items in parallel and returns the results.
+        stats(): Returns a snapshot of the executor metrics.
+        shutdown(): Stops the worker processes.
+
+    Example:
+        executor = PasswordHashingExecutor(workers=2, max_pending=8, queue_timeout=1)
+        encoded = executor.run(make_password, "securepassword")
+    """
+
+    def __init__(self, workers, max_pending, queue_timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "in_flight": 0,
+            "wait_seconds": 0.0,
+            "compute_seconds": 0.0,
+        }
+
+    def _get_pool(self):
+        """Return the process pool, creating it on first use and again after a fork."""
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_setup_worker,
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _record(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._metrics[name] += value
+
+        # Exported to Prometheus as well, see core.metrics.
+        for outcome in ("completed", "failed", "rejected"):
+            if outcome in values:
+                metrics.PASSWORD_HASHING_JOBS.labels(outcome).inc(values[outcome])
+        if "in_flight" in values:
+            metrics.PASSWORD_HASHING_IN_FLIGHT.inc(values["in_flight"])
+        if "wait_seconds" in values:
+            metrics.PASSWORD_HASHING_WAIT_TIME.observe(values["wait_seconds"])
+            metrics.PASSWORD_HASHING_COMPUTE_TIME.observe(values["compute_seconds"])
+
+    def _acquire(self):
+        if self.workers < 1:
+            self._record(submitted=1, in_flight=1)
+            return
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._record(rejected=1)
+            raise HashingUnavailable()
+        self._record(submitted=1, in_flight=1)
+
+    def _release(self):
+        if self.workers >= 1:
+            self._slots.release()
+
+    def _schedule(self, runner, func, payload):
+        """Run runner(func, payload) in the pool and unwrap its timing."""
+        self._acquire()
+        result = Future()
+        scheduled = time.perf_counter()
+
+        def done(job):
+            self._release()
+            try:
+                value, compute = job.result()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self._record(failed=1, in_flight=-1)
+                result.set_exception(exc)
+                return
+
+            total = time.perf_counter() - scheduled
+            self._record(
+                completed=1,
+                in_flight=-1,
+                wait_seconds=max(total - compute, 0.0),
+                compute_seconds=compute,
+            )
+            result.set_result(value)
+
+        if self.workers < 1:
+            job = Future()
+            try:
+                job.set_result(runner(func, payload))
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                job.set_exception(exc)
+            done(job)
+            return result
+
+        try:
+            job = self._get_pool().submit(runner, func, payload)
+        except Exception:
+            self._release()
+            self._record(failed=1, in_flight=-1)
+            raise
+        job.add_done_callback(done)
+        return result
+
+    def submit(self, func, *args):
+        """Schedule func(*args) in the pool.
+
+        Args:
+            func: A picklable, module level function.
+            *args: Picklable arguments for func.
+
+        Returns:
+            Future: A future holding the result of func(*args).
+
+        Raises:
+            HashingUnavailable: If no slot became free within the queue timeout.
+        """
+        return self._schedule(_timed, func, args)
+
+    def run(self, func, *args):
+        """Run func(*args) in the pool and wait for its result.
+
+        Args:
+            func: A picklable, module level function.
+            *args: Picklable arguments for func.
+
+        Returns:
+            The result of func(*args).
+
+        Raises:
+            HashingUnavailable: If no slot became free within the queue timeout.
+        """
+        return self.submit(func, *args).result()
+
+    async def arun(self, func, *args):
+        """Run func(*args) in the pool without blocking the event loop.
+
+        Waiting for a free slot happens in a thread, waiting for the result is awaited.
+
+        Args:
+            func: A picklable, module level function.
+            *args: Picklable arguments for func.
+
+        Returns:
+            The result of func(*args).
+
+        Raises:
+            HashingUnavailable: If no slot became free within the queue timeout.
+        """
+        future = await asyncio.to_thread(self.submit, func, *args)
+        return await asyncio.wrap_future(future)
+
+    def map(self, func, items):
+        """Run func over items in parallel.
+
+        Items are split into a few chunks per worker; every chunk is one job and takes
+        one slot.
+
+        Args:
+            func: A picklable, module level function of one argument.
+            items (list): Picklable arguments for func.
+
+        Returns:
+            list: The results, in the same order as items.
+
+        Raises:
+            HashingUnavailable: If no slot became free within the queue timeout.
+        """
+        size = max(1, len(items) // (max(self.workers, 1) * 4))
+        futures = [
+            self._schedule(_timed_batch, func, chunk)
+            for chunk in itertools.batched(items, size)
+        ]
+        return [result for future in futures for result in future.result()]
+
+    def stats(self):
+        """Return a snapshot of the executor metrics.
+
+        Returns:
+            dict: Counters of submitted, completed, failed and rejected jobs, the number
+                  of jobs in flight, and the total seconds jobs spent waiting for a
+                  worker and computing.
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+    def shutdown(self):
+        """Stop the worker processes of the pool, once their jobs are done."""
+        with self._lock:
+            pool, self._pool, self._pool_pid = self._pool, None, None
+        # The lock is released first: the callbacks of the remaining jobs record their
+        # metrics under it while the pool shuts down.
+        if pool is not None:
+            pool.shutdown()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the hashing executor of the current process, creating it on first use.
+
+    Returns:
+        PasswordHashingExecutor: The executor configured from the settings.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = PasswordHashingExecutor(
+                workers=settings.PASSWORD_HASHING_WORKERS,
+                max_pending=settings.PASSWORD_HASHING_MAX_PENDING,
+                queue_timeout=settings.PASSWORD_HASHING_QUEUE_TIMEOUT,
+            )
+        return _executor
+
+
+def make_password(raw_password):
+    """Hash a raw password in the pool.
+
+    Args:
+        raw_password (str): The password to hash. None gives an unusable password.
+
+    Returns:
+        str: The encoded password.
+    """
+    return get_executor().run(hashers.make_password, raw_password)
+
+
+def make_passwords(raw_passwords):
+    """Hash a list of raw passwords in parallel.
+
+    Args:
+        raw_passwords (list): Raw passwords to hash.
+
+    Returns:
+        list: Encoded passwords, in the same order as raw_passwords.
+    """
+    return get_executor().map(hashers.make_password, raw_passwords)
+
+
+def verify_password(raw_password, encoded):
+    """Check a raw password against an encoded one in the pool.
+
+    Args:
+        raw_password (str): The password to check.
+        encoded (str): The stored, encoded password.
+
+    Returns:
+        tuple: Whether the password is correct, and whether the encoded password
+               should be regenerated with the preferred hasher.
+    """
+    return get_executor().run(hashers.verify_password, raw_password, encoded)
+
+
+_dummy_password = None
+
+
+def _get_dummy_password():
+    global _dummy_password
+
+    if _dummy_password is None:
+        _dummy_password = make_password(get_random_string(32))
+    return _dummy_password
+
+
+def verify_dummy_password(raw_password):
+    """Check a raw password against the hash of a random one, which always fails.
+
+    Logins for unknown emails call it, so that they take as long as logins with a wrong
+    password and do not reveal which emails have an account.
+
+    Args:
+        raw_password (str): The password to check.
+    """
+    verify_password(raw_password, _get_dummy_password())
+
+
+def upgrade_password(user, raw_password):
+    """Hash the password of a user again with the preferred hasher and save it.
+
+    Only the password column is written, with an update query: the user is otherwise
+    unchanged, so its version, updated_at and cached payloads stay valid, and no save
+    signal fires. The cached tokens of the user, whose snapshots hold the previous hash,
+    are dropped instead, like users.signals does.
+
+    Args:
+        user (User): The user whose password to upgrade.
+        raw_password (str): The verified password of the user.
+    """
+    user.password = make_password(raw_password)
+    using = sharding.db_for_user(user)
+    type(user)._default_manager.db_manager(using).filter(pk=user.pk).update(
+        password=user.password
+    )
+    # Imported here: hashing workers import this module before Django is set up.
+    from . import authentication  # pylint: disable=import-outside-toplevel
+
+    authentication.invalidate_user(user.pk)
+    transaction.on_commit(lambda: authentication.invalidate_user(user.pk), using=using)
+
+
+def check_password(user, raw_password):
+    """Check the password of a user.
+
+    Mirrors AbstractBaseUser.check_password: a correct password stored with outdated
+    hasher settings is hashed again and saved, see upgrade_password.
+
+    Args:
+        user (User): The user whose password to check.
+        raw_password (str): The password to check.
+
+    Returns:
+        bool: True if the password is correct, False otherwise.
+    """
+    is_correct, must_update = verify_password(raw_password, user.password)
+    if is_correct and must_update:
+        upgrade_password(user, raw_password)
+    return is_correct
+
+
+def set_password(user, raw_password):
+    """Set the password of a user without saving it.
+
+    Args:
+        user (User): The user whose password to set.
+        raw_password (str): The new password.
+    """
+    user.password = make_password(raw_password)
+    # Like AbstractBaseUser.set_password, so that save() notifies the password validators.
+    user._password = raw_password  # pylint: disable=protected-access
+
+
+async def amake_password(raw_password):
+    """Asynchronous version of make_password."""
+    return await get_executor().arun(hashers.make_password, raw_password)
+
+
+async def averify_password(raw_password, encoded):
+    """Asynchronous version of verify_password."""
+    return await get_executor().arun(hashers.verify_password, raw_password, encoded)
+
+
+async def aupgrade_password(user, raw_password):
+    """Asynchronous version of upgrade_password."""
+    user.password = await amake_password(raw_password)
+    users = type(user)._default_manager.db_manager(sharding.db_for_user(user))
+    await users.filter(pk=user.pk).aupdate(password=user.password)
+    from . import authentication  # pylint: disable=import-outside-toplevel
+
+    authentication.invalidate_user(user.pk)
+    await sync_to_async(transaction.on_commit)(
+        lambda: authentication.invalidate_user(user.pk), using=users.db
+    )
+
+
+async def averify_dummy_password(raw_password):
+    """Asynchronous version of verify_dummy_password."""
+    if _dummy_password is None:
+        await asyncio.to_thread(_get_dummy_password)
+    await averify_password(raw_password, _dummy_password)
+
+
+async def acheck_password(user, raw_password):
+    """Asynchronous version of check_password."""
+    is_correct, must_update = await averify_password(raw_password, user.password)
+    if is_correct and must_update:
+        await aupgrade_password(user, raw_password)
+    return is_correct
+
+
+async def aset_password(user, raw_password):
+    """Asynchronous version of set_password."""
+    user.password = await amake_password(raw_password)
+    user._password = raw_password  # pylint: disable=protected-access
@@ -0,0 +1,130 @@
+"""Management command measuring the cost of password hashing on this machine.
+
+Usage:
+    python manage.py calibrate_hashers
+    python manage.py calibrate_hashers --target-ms 100 --hasher argon2 --argon2-memory-cost 65536
+
+Hashes a password with the configured costs of every tuned hasher, then derives the costs
+that make one hash take about --target-ms milliseconds on one core, and measures them
+too. Hashing time grows linearly with PBKDF2 iterations and with the Argon2 time cost,
+the Argon2 memory cost is kept as given since it bounds the memory used per login.
+
+The report shows the logins per second the hashing pool sustains with each cost, and the
+environment variables applying the suggested costs. Run it on the machine, or the kind
+of machine, serving the application, while it is otherwise idle.
+"""
+
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.hashers import TunedArgon2PasswordHasher, TunedPBKDF2PasswordHasher
+
+PASSWORD = "calibration-password"
+PBKDF2_STEP = 10000
+
+
+class Command(BaseCommand):
+    """Measure hashing costs and suggest the hasher settings."""
+
+    help = "Measure the cost of password hashing and suggest the hasher settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=250,
+            help="Wanted duration of one hash in milliseconds.",
+        )
+        parser.add_argument(
+            "--hasher",
+            choices=["all", "pbkdf2", "argon2"],
+            default="all",
+            help="Hasher to calibrate.",
+        )
+        parser.add_argument(
+            "--rounds", type=int, default=5, help="Hashes timed per measurement."
+        )
+        parser.add_argument(
+            "--argon2-memory-cost",
+            type=int,
+            default=None,
+            help="Argon2 memory cost in KiB, ARGON2_MEMORY_COST by default.",
+        )
+
+    def handle(self, *args, **options):
+        if options["target_ms"] <= 0 or options["rounds"] < 1:
+            raise CommandError("--target-ms and --rounds must be positive.")
+
+        self.rounds = options["rounds"]
+        target = options["target_ms"]
+        workers = max(settings.PASSWORD_HASHING_WORKERS, 1)
+        self.stdout.write(
+            f"Target {target:g} ms per hash, {workers} hashing workers, "
+            f"preferred hasher {settings.PASSWORD_HASHER}."
+        )
+
+        if options["hasher"] in ("all", "pbkdf2"):
+            self.calibrate_pbkdf2(target, workers)
+        if options["hasher"] in ("all", "argon2"):
+            self.calibrate_argon2(target, workers, options["argon2_memory_cost"])
+
+    def measure(self, hasher):
+        """Return the median duration of one hash by hasher, in milliseconds."""
+        salt = hasher.salt()
+        durations = []
+        for _ in range(self.rounds):
+            started = time.perf_counter()
+            hasher.encode(PASSWORD, salt)
+            durations.append((time.perf_counter() - started) * 1000)
+        return statistics.median(durations)
+
+    def report(self, label, milliseconds, workers):
+        """Write the cost of one hash and the logins per second it allows."""
+        self.stdout.write(
+            f"  {label}: {milliseconds:.1f} ms per hash, "
+            f"{1000 / milliseconds * workers:.0f} logins/s"
+        )
+
+    def calibrate_pbkdf2(self, target, workers):
+        """Measure PBKDF2 with the configured and the suggested iterations."""
+        self.stdout.write("pbkdf2_sha256")
+        current = TunedPBKDF2PasswordHasher()
+        elapsed = self.measure(current)
+        self.report(f"iterations={current.iterations}", elapsed, workers)
+
+        iterations = round(current.iterations * target / elapsed / PBKDF2_STEP)
+        iterations = max(iterations, 1) * PBKDF2_STEP
+        suggested = TunedPBKDF2PasswordHasher(iterations=iterations)
+        self.report(f"iterations={iterations}", self.measure(suggested), workers)
+        self.stdout.write(self.style.SUCCESS(f"  PBKDF2_ITERATIONS={iterations}"))
+
+    def calibrate_argon2(self, target, workers, memory_cost):
+        """Measure Argon2 with the configured and the suggested time cost."""
+        self.stdout.write("argon2")
+        current = TunedArgon2PasswordHasher(memory_cost=memory_cost)
+        try:
+            elapsed = self.measure(current)
+        except ValueError as exc:
+            # Raised by the hasher when argon2-cffi is not installed.
+            self.stdout.write(self.style.WARNING(f"  Skipped: {exc}"))
+            return
+        self.report(
+            f"time_cost={current.time_cost} memory_cost={current.memory_cost} "
+            f"parallelism={current.parallelism}",
+            elapsed,
+            workers,
+        )
+
+        time_cost = max(round(current.time_cost * target / elapsed), 1)
+        suggested = TunedArgon2PasswordHasher(
+            time_cost=time_cost, memory_cost=current.memory_cost
+        )
+        self.report(f"time_cost={time_cost}", self.measure(suggested), workers)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"  ARGON2_TIME_COST={time_cost} ARGON2_MEMORY_COST={current.memory_cost}"
+            )
+        )
@@ -0,0 +1,277 @@
+"""Management command importing users in bulk.
+
+Usage:
+    python manage.py import_users users.csv
+    python manage.py import_users users.ndjson --prehashed --conflicts conflicts.csv
+    cat users.csv | python manage.py import_users - --format csv
+
+The input holds one user per row or line, with the fields email, phone, first_name,
+last_name and password. It is read as a stream and processed in chunks: every chunk is
+validated, its passwords are hashed in parallel, it is loaded with COPY into a temporary
+staging table and then merged into the users table. Rows whose email or phone is already
+taken, by an existing user or an earlier row, are skipped and reported.
+
+Users are written to the primary database, so the command is refused when users are
+sharded: import them before enabling sharding, reshard_users then moves them to their
+shards. See users.sharding.
+"""
+
+import csv
+import itertools
+import json
+import sys
+import time
+
+from django.contrib.auth.hashers import identify_hasher
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from users import hashing, sharding
+from users.models import User
+from users.pgcopy import copy_rows, default_values
+
+STAGING_TABLE = "users_import_staging"
+FIELDS = ("email", "phone", "first_name", "last_name", "password")
+
+
+class Command(BaseCommand):
+    """Import users from a CSV or NDJSON file."""
+
+    help = "Import users from a CSV or NDJSON file through PostgreSQL COPY."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - to read standard input.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "ndjson"),
+            help="Input format. Defaults to ndjson for .ndjson and .jsonl files, csv otherwise.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Number of rows validated and loaded at a time.",
+        )
+        parser.add_argument(
+            "--prehashed",
+            action="store_true",
+            help="Passwords are already encoded by a configured password hasher.",
+        )
+        parser.add_argument(
+            "--conflicts",
+            help="Write the rejected rows and the reason for each to this CSV file.",
+        )
+
+    def handle(self, *args, **options):
+        if sharding.is_enabled():
+            raise CommandError(
+                "Users are sharded, import_users only writes to the primary database."
+            )
+        path = options["path"]
+        input_format = options["format"] or (
+            "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+        )
+        self.prehashed = options["prehashed"]
+        self.columns = [User._meta.get_field(name).column for name in FIELDS]
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        report = (
+            open(options["conflicts"], "w", newline="")
+            if options["conflicts"]
+            else None
+        )
+        writer = csv.writer(report) if report else None
+        if writer:
+            writer.writerow(["line", "email", "phone", "reason"])
+
+        totals = {"read": 0, "imported": 0, "rejected": 0}
+        started = time.perf_counter()
+        try:
+            rows = self.read(stream, input_format)
+            while chunk := list(itertools.islice(rows, options["chunk_size"])):
+                imported, rejected = self.import_chunk(chunk)
+                totals["read"] += len(chunk)
+                totals["imported"] += imported
+                totals["rejected"] += len(chunk) - imported
+                if writer:
+                    writer.writerows(rejected)
+                self.progress(totals, started)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if report:
+                report.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {totals['imported']} of {totals['read']} users, "
+                f"rejected {totals['rejected']}."
+            )
+        )
+
+    def read(self, stream, input_format):
+        """Yield (line number, row) pairs, row being a dict or an error message."""
+        if input_format == "csv":
+            reader = csv.DictReader(stream)
+            missing = set(FIELDS) - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Missing columns: {', '.join(sorted(missing))}.")
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = "not valid JSON"
+            yield line_number, row if isinstance(row, (dict, str)) else "not an object"
+
+    def validate(self, row):
+        """Return the cleaned values of a row, or raise ValidationError."""
+        if isinstance(row, str):
+            raise ValidationError(row)
+
+        values = {field: str(row.get(field) or "").strip() for field in FIELDS}
+        values["email"] = User.objects.normalize_email(values["email"])
+        validate_email(values["email"])
+        for field in ("phone", "password"):
+            if not values[field]:
+                raise ValidationError(f"{field} is required")
+        for field in ("phone", "first_name", "last_name"):
+            max_length = User._meta.get_field(field).max_length
+            if len(values[field]) > max_length:
+                raise ValidationError(f"{field} is longer than {max_length} characters")
+        if self.prehashed:
+            try:
+                identify_hasher(values["password"])
+            except ValueError as exc:
+                raise ValidationError("password is not a known hash") from exc
+        return values
+
+    def import_chunk(self, chunk):
+        """Validate, hash, load and merge a chunk of rows.
+
+        Returns:
+            tuple: The number of imported users and the rejected rows, as
+                   (line, email, phone, reason) tuples.
+        """
+        rejected = []
+        valid = []
+        for line, row in chunk:
+            try:
+                valid.append((line, self.validate(row)))
+            except ValidationError as exc:
+                email = row.get("email") if isinstance(row, dict) else None
+                phone = row.get("phone") if isinstance(row, dict) else None
+                rejected.append(
+                    (line, email, phone, f"invalid: {'; '.join(exc.messages)}")
+                )
+
+        if not valid:
+            return 0, rejected
+
+        passwords = [values["password"] for _, values in valid]
+        if not self.prehashed:
+            passwords = hashing.make_passwords(passwords)
+        staged = [
+            (line, *(values[field] for field in FIELDS[:-1]), password)
+            for (line, values), password in zip(valid, passwords)
+        ]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.create_staging_table(cursor)
+            copy_rows(cursor, STAGING_TABLE, ["line", *self.columns], staged)
+            conflicts = self.find_conflicts(cursor)
+            if conflicts:
+                cursor.execute(
+                    f"DELETE FROM {STAGING_TABLE} WHERE line = ANY(%s)",
+                    [[conflict[0] for conflict in conflicts]],
+                )
+            imported = self.merge(cursor)
+
+        rejected.extend(conflicts)
+        skipped = len(staged) - len(conflicts) - imported
+        if skipped:
+            rejected.append(
+                (None, None, None, f"{skipped} rows conflicted with concurrent changes")
+            )
+        return imported, sorted(rejected, key=lambda item: item[0] or 0)
+
+    def create_staging_table(self, cursor):
+        """Create the staging table of this session if needed, and empty it."""
+        columns = ", ".join(
+            f"{connection.ops.quote_name(field.column)} {field.db_type(connection)}"
+            for field in (User._meta.get_field(name) for name in FIELDS)
+        )
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (line bigint, {columns})"
+        )
+        cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+
+    def find_conflicts(self, cursor):
+        """Return the staged rows whose email or phone is taken.
+
+        A value is taken when an existing user holds it or an earlier staged row repeats it.
+        """
+        quote = connection.ops.quote_name
+        user_table = quote(User._meta.db_table)
+        email = quote(User._meta.get_field("email").column)
+        phone = quote(User._meta.get_field("phone").column)
+        cursor.execute(
+            f"""
+            WITH ranked AS (
+                SELECT line, {email} AS email, {phone} AS phone,
+                    row_number() OVER (PARTITION BY {email} ORDER BY line) AS email_rank,
+                    row_number() OVER (PARTITION BY {phone} ORDER BY line) AS phone_rank
+                FROM {STAGING_TABLE}
+            ), taken AS (
+                SELECT line, email, phone,
+                    email_rank > 1 OR EXISTS (
+                        SELECT 1 FROM {user_table} u WHERE u.{email} = ranked.email
+                    ) AS email_taken,
+                    phone_rank > 1 OR EXISTS (
+                        SELECT 1 FROM {user_table} u WHERE u.{phone} = ranked.phone
+                    ) AS phone_taken
+                FROM ranked
+            )
+            SELECT line, email, phone,
+                CASE WHEN email_taken THEN 'email taken' ELSE 'phone taken' END
+            FROM taken
+            WHERE email_taken OR phone_taken
+            ORDER BY line
+            """
+        )
+        return cursor.fetchall()
+
+    def merge(self, cursor):
+        """Insert the staged rows into the users table.
+
+        Returns:
+            int: The number of inserted users.
+        """
+        quote = connection.ops.quote_name
+        defaults = default_values(User, connection, exclude=self.columns)
+        columns = [*self.columns, *defaults]
+        cursor.execute(
+            f"INSERT INTO {quote(User._meta.db_table)} "
+            f"({', '.join(quote(column) for column in columns)}) "
+            f"SELECT {', '.join(quote(column) for column in self.columns)}"
+            f"{''.join(', %s' for _ in defaults)} "
+            f"FROM {STAGING_TABLE} ORDER BY line ON CONFLICT DO NOTHING",
+            list(defaults.values()),
+        )
+        return cursor.rowcount
+
+    def progress(self, totals, started):
+        """Write the running totals and the import rate."""
+        elapsed = time.perf_counter() - started
+        rate = totals["read"] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{totals['read']} rows read, {totals['imported']} imported, "
+            f"{totals['rejected']} rejected, {rate:.0f} rows/s"
+        )
@@ -0,0 +1,114 @@
+"""Management command applying migrations and collecting static files when needed.
+
+Usage:
+    python manage.py prepare_startup
+    python manage.py prepare_startup --force
+    python manage.py prepare_startup --database default --database shard1
+
+docker/entrypoint.sh runs it before starting gunicorn, in place of migrate and
+collectstatic, which take seconds on every boot even when there is nothing to do: migrate
+checks the project and fills content types and permissions again, collectstatic compares
+every file with its copy.
+
+Migrations are applied to every database but the read replicas, which is the primary
+database and the user shards, see users.sharding. Each database is migrated only when it
+misses some of the migrations on disk, as recorded in its django_migrations table.
+Static files are collected only when the fingerprint of the files found by the static
+finders, their paths, sizes and modification times, differs from the one saved in
+STATIC_ROOT by the last collection.
+Both run in this process, which loads Django once instead of twice.
+"""
+
+import hashlib
+import os
+from operator import itemgetter
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+FINGERPRINT_FILE = ".static-fingerprint"
+
+
+def unapplied_migrations(database):
+    """Return the migrations on disk which the database misses.
+
+    Args:
+        database (str): The database alias.
+
+    Returns:
+        list: The (migration, backwards) steps migrate would run.
+    """
+    executor = MigrationExecutor(connections[database])
+    return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+def static_fingerprint():
+    """Return the fingerprint of the static files collectstatic would collect.
+
+    Returns:
+        str: A SHA-256 digest of the paths, sizes and modification times of the files.
+    """
+    ignore_patterns = apps.get_app_config("staticfiles").ignore_patterns
+    digest = hashlib.sha256()
+    for finder in get_finders():
+        files = sorted(finder.list(ignore_patterns), key=itemgetter(0))
+        for path, storage in files:
+            stat = os.stat(storage.path(path))
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    """Apply migrations and collect static files, skipping either when up to date."""
+
+    help = "Apply migrations and collect static files, skipping either when up to date."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            action="append",
+            dest="databases",
+            help="Database to migrate, repeatable. Defaults to every database but the "
+            "read replicas.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Run migrate and collectstatic even when up to date.",
+        )
+
+    def handle(self, *args, **options):
+        force, verbosity = options["force"], options["verbosity"]
+        databases = options["databases"] or [
+            alias
+            for alias in settings.DATABASES
+            if alias not in settings.DATABASE_REPLICAS
+        ]
+
+        for database in databases:
+            plan = unapplied_migrations(database)
+            if plan or force:
+                self.stdout.write(f"Migrations on {database}: {len(plan)} to apply.")
+                call_command("migrate", database=database, verbosity=verbosity)
+            else:
+                self.stdout.write(f"Migrations on {database}: up to date, skipped.")
+
+        fingerprint = static_fingerprint()
+        path = os.path.join(settings.STATIC_ROOT, FINGERPRINT_FILE)
+        try:
+            with open(path, encoding="utf-8") as file:
+                collected = file.read().strip()
+        except FileNotFoundError:
+            collected = None
+        if fingerprint != collected or force:
+            self.stdout.write("Static files: changed, collecting.")
+            call_command("collectstatic", interactive=False, verbosity=verbosity)
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(fingerprint + "\n")
+        else:
+            self.stdout.write("Static files: unchanged, skipped.")
@@ -0,0 +1,135 @@
+"""Management command moving users to the shard of their email.
+
+Usage:
+    python manage.py reshard_users
+    python manage.py reshard_users --dry-run --batch-size 5000
+
+Run it when enabling sharding, and after appending a database to USER_SHARD_DATABASES,
+once the new database is migrated (python manage.py migrate --database shardN). See
+users.sharding.
+
+Reads the ids, emails and phones of the users of every shard in batches, and moves every
+user whose email belongs to another shard with users.sharding.move_users, one transaction
+per batch and target shard: moved users get a new id and token key, and must log in
+again. The phones of the users staying on their shard are claimed, those of the users
+loaded before sharding was enabled have no claim yet. The application keeps serving
+while it runs, and running it again resumes an interrupted run. Users whose email is
+already used on their target shard, or whose phone is used by another user, are reported
+and left in place.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connections
+
+from users import sharding
+
+
+class Command(BaseCommand):
+    """Move users to the shard of their email."""
+
+    help = "Move users to the shard of their email."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Users read from a shard per query.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the users to move.",
+        )
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError("Users are not sharded, set USER_SHARD_DATABASES.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        if not options["dry_run"]:
+            for alias in settings.USER_SHARDS:
+                sharding.reserve_id_range(connections[alias])
+
+        moved = conflicts = 0
+        for alias in settings.USER_SHARDS:
+            shard_moved, shard_conflicts = self.reshard(alias, options)
+            moved += shard_moved
+            conflicts += shard_conflicts
+
+        action = "To move" if options["dry_run"] else "Moved"
+        self.stdout.write(f"{action}: {moved} users, {conflicts} conflicts.")
+
+    def reshard(self, alias, options):
+        """Move the users of a shard which belong to other shards, claim the phones of
+        the others.
+
+        Returns:
+            tuple: The number of users moved, and of users left in place or unclaimed on
+                   conflicts.
+        """
+        users = get_user_model()._default_manager.using(alias).order_by("pk")
+        moved = conflicts = checked = 0
+        last_id = 0
+        while True:
+            batch = list(
+                users.filter(pk__gt=last_id).values_list("pk", "email", "phone")[
+                    : options["batch_size"]
+                ]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            checked += len(batch)
+
+            targets = defaultdict(list)
+            staying = []
+            for user_id, email, phone in batch:
+                target = sharding.shard_for_email(email)
+                if target != alias:
+                    targets[target].append(user_id)
+                else:
+                    staying.append((user_id, phone))
+            if not options["dry_run"]:
+                for user_id, phone in sharding.claim_phones(staying):
+                    conflicts += 1
+                    self.stderr.write(
+                        f"User {user_id} on {alias}: phone {phone} is used by another user."
+                    )
+            for target, ids in targets.items():
+                if options["dry_run"]:
+                    moved += len(ids)
+                    continue
+                batch_moved, batch_conflicts = self.move(alias, target, ids)
+                moved += batch_moved
+                conflicts += batch_conflicts
+
+        self.stdout.write(
+            f"{alias}: {checked} users checked, {moved} belonging to other shards."
+        )
+        return moved, conflicts
+
+    def move(self, source, target, ids):
+        """Move users to the target shard, one by one if a user of the batch conflicts.
+
+        Returns:
+            tuple: The number of users moved, and of users left in place on conflicts.
+        """
+        try:
+            return len(sharding.move_users(source, target, ids)), 0
+        except (IntegrityError, ValueError):
+            pass
+
+        moved = conflicts = 0
+        for user_id in ids:
+            try:
+                moved += len(sharding.move_users(source, target, [user_id]))
+            except (IntegrityError, ValueError) as exc:
+                conflicts += 1
+                self.stderr.write(f"User {user_id} left on {source}: {exc}")
+        return moved, conflicts
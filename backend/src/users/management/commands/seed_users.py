@@ -0,0 +1,162 @@
+"""Management command seeding synthetic users for scale testing.
+
+Usage:
+    python manage.py seed_users --count 1000000
+    python manage.py seed_users --count 5000000 --seed 7 --offset 1000000 --batch-size 50000
+
+Creates users with realistic Faker names, each with an authentication token, in batches
+written through PostgreSQL COPY. Names are drawn from pools generated once by Faker,
+every user shares one password hash computed up front, and ids are reserved from the
+table sequence per batch, so that tokens can be copied along with their users.
+
+The same --seed, --offset and --count always produce the same users and tokens, so that
+benchmark runs on different databases can be compared. Emails and phones embed the index
+of the user, use --offset to add users to an already seeded database. Token keys are
+derived from the seed: never run this against a database holding real users.
+
+Users are written to the primary database, so the command is refused when users are
+sharded: seed them before enabling sharding, reshard_users then moves them to their
+shards. See users.sharding.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from faker import Faker
+from rest_framework.authtoken.models import Token
+
+from users import hashing, sharding
+from users.models import User
+from users.pgcopy import copy_rows, default_values
+
+DEFAULT_PASSWORD = "my_super_secret"
+NAME_POOL_SIZE = 2000
+# Users join 30 seconds apart on average, from a fixed date so that runs are repeatable.
+JOINED_FROM = datetime(2020, 1, 1, tzinfo=timezone.utc)
+JOIN_INTERVAL = 30
+
+
+class Command(BaseCommand):
+    """Seed synthetic users and tokens."""
+
+    help = "Seed synthetic users and tokens through PostgreSQL COPY, deterministically."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, required=True, help="Users to create.")
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the generated data."
+        )
+        parser.add_argument(
+            "--offset",
+            type=int,
+            default=0,
+            help="Index of the first user, to add users after an earlier seeding.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=20000,
+            help="Users written per COPY and transaction.",
+        )
+        parser.add_argument(
+            "--password",
+            default=DEFAULT_PASSWORD,
+            help="Password of every user, the password of UserFactory by default.",
+        )
+        parser.add_argument(
+            "--no-tokens", action="store_true", help="Do not create tokens."
+        )
+
+    def handle(self, *args, **options):
+        if sharding.is_enabled():
+            raise CommandError(
+                "Users are sharded, seed_users only writes to the primary database."
+            )
+        count, offset = options["count"], options["offset"]
+        if count < 1 or offset < 0 or options["batch_size"] < 1:
+            raise CommandError("--count and --batch-size must be positive.")
+
+        self.password = hashing.make_password(options["password"])
+        self.with_tokens = not options["no_tokens"]
+        fake = Faker()
+        fake.seed_instance(options["seed"])
+        self.first_names = [fake.first_name() for _ in range(NAME_POOL_SIZE)]
+        self.last_names = [fake.last_name() for _ in range(NAME_POOL_SIZE)]
+        self.columns = ["id", "email", "phone", "first_name", "last_name", "password"]
+        self.columns += ["date_joined", "updated_at"]
+        self.defaults = default_values(User, connection, exclude=self.columns)
+
+        started = time.perf_counter()
+        created = 0
+        for start in range(offset, offset + count, options["batch_size"]):
+            stop = min(start + options["batch_size"], offset + count)
+            # Each batch has its own generator, so that a batch does not depend on the
+            # batch size or on the batches before it.
+            rng = random.Random(f"{options['seed']}-{start}-{stop}")
+            try:
+                self.write_batch(rng, range(start, stop))
+            except IntegrityError as exc:
+                raise CommandError(
+                    f"Users {start} to {stop - 1} already exist, seed with a higher --offset."
+                ) from exc
+            created += stop - start
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{created} users created, {created / elapsed:.0f} users/s"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded {created} users."))
+
+    def write_batch(self, rng, indexes):
+        """Generate and copy the users, and their tokens, of a batch of indexes."""
+        size = len(indexes)
+        first_names = rng.choices(self.first_names, k=size)
+        last_names = rng.choices(self.last_names, k=size)
+        offsets = [rng.randrange(JOIN_INTERVAL) for _ in indexes]
+        keys = [f"{rng.getrandbits(160):040x}" for _ in indexes]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            ids = self.reserve_ids(cursor, size)
+            users = []
+            for user_id, index, first_name, last_name, second in zip(
+                ids, indexes, first_names, last_names, offsets
+            ):
+                joined = JOINED_FROM + timedelta(seconds=index * JOIN_INTERVAL + second)
+                users.append(
+                    (
+                        user_id,
+                        f"{first_name}.{last_name}.{index}@example.com".lower(),
+                        f"+1{index:010d}",
+                        first_name,
+                        last_name,
+                        self.password,
+                        joined,
+                        joined,
+                        *self.defaults.values(),
+                    )
+                )
+            copy_rows(
+                cursor,
+                User._meta.db_table,
+                [*self.columns, *self.defaults],
+                users,
+            )
+
+            if self.with_tokens:
+                copy_rows(
+                    cursor,
+                    Token._meta.db_table,
+                    ["key", "user_id", "created"],
+                    ((key, user[0], user[6]) for key, user in zip(keys, users)),
+                )
+
+    def reserve_ids(self, cursor, size):
+        """Return size new ids from the sequence of the users table."""
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [User._meta.db_table, size],
+        )
+        return [row[0] for row in cursor.fetchall()]
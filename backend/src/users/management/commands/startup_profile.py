@@ -0,0 +1,115 @@
+"""Management command reporting the import time and memory of the application.
+
+Usage:
+    python manage.py startup_profile
+    python manage.py startup_profile --module core.asgi --limit 30 --json > startup.json
+
+Loads the application in a fresh process the way a gunicorn worker does, or the master
+with PRELOAD_APP: imports core.wsgi, or core.asgi with SERVER_MODE=asgi, which set up
+Django and import the URLconf. Reports the total time and the resident memory of the
+process, what every worker holds without preloading, then the packages and the modules
+taking the most import time, with the memory their imports allocated. See
+core.importprofile: times are measured in one process, memory in another, as tracing
+memory slows imports down.
+
+The time of a module includes running its code: that of core.wsgi is the setup of
+Django, its apps and middleware. With --json, the full report is printed to track the
+cold start over time.
+"""
+
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """Report the import time and memory of the application."""
+
+    help = "Report the import time and memory of the application."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--module",
+            help="Module to load, core.wsgi or core.asgi after SERVER_MODE by default.",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Packages and modules listed."
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the full report as JSON."
+        )
+
+    def handle(self, *args, **options):
+        if options["limit"] < 1:
+            raise CommandError("--limit must be positive.")
+        module = options["module"] or (
+            "core.asgi" if settings.SERVER_MODE == "asgi" else "core.wsgi"
+        )
+
+        report = self.profile(module)
+        memory = self.profile(module, "--memory")
+        report["python_bytes"] = memory["python_bytes"]
+        for name, stats in memory["modules"].items():
+            if name in report["modules"]:
+                report["modules"][name]["self_bytes"] = stats["self_bytes"]
+        report["packages"] = self.packages(report["modules"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+            return
+        self.write_report(report, options["limit"])
+
+    def profile(self, module, *args):
+        """Return the report of core.importprofile, run in a fresh process."""
+        result = subprocess.run(
+            [sys.executable, "-m", "core.importprofile", module, *args],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Loading {module} failed:\n{result.stderr}")
+        return json.loads(result.stdout)
+
+    @staticmethod
+    def packages(modules):
+        """Return the self time, bytes and module count of every top-level package."""
+        packages = defaultdict(lambda: {"seconds": 0.0, "bytes": 0, "modules": 0})
+        for name, stats in modules.items():
+            package = packages[name.partition(".")[0]]
+            package["seconds"] += stats["self"]
+            package["bytes"] += stats.get("self_bytes", 0)
+            package["modules"] += 1
+        return dict(packages)
+
+    def write_report(self, report, limit):
+        """Write the totals and the slowest packages and modules as tables."""
+        self.stdout.write(
+            f"{report['module']}: {report['seconds'] * 1000:.1f} ms,"
+            f" {len(report['modules'])} modules, resident memory"
+            f" {report['rss_bytes'] / 2**20:.1f} MiB, Python objects"
+            f" {report['python_bytes'] / 2**20:.1f} MiB."
+        )
+
+        self.stdout.write(f"\n{'Package':<40} {'Modules':>8} {'ms':>8} {'KiB':>8}")
+        packages = sorted(
+            report["packages"].items(), key=lambda item: -item[1]["seconds"]
+        )
+        for name, stats in packages[:limit]:
+            self.stdout.write(
+                f"{name:<40} {stats['modules']:>8} {stats['seconds'] * 1000:>8.1f}"
+                f" {stats['bytes'] / 1024:>8.0f}"
+            )
+
+        self.stdout.write(f"\n{'Module':<40} {'ms':>8} {'cum. ms':>8} {'KiB':>8}")
+        modules = sorted(report["modules"].items(), key=lambda item: -item[1]["self"])
+        for name, stats in modules[:limit]:
+            self.stdout.write(
+                f"{name:<40} {stats['self'] * 1000:>8.1f}"
+                f" {stats['cumulative'] * 1000:>8.1f}"
+                f" {stats.get('self_bytes', 0) / 1024:>8.0f}"
+            )
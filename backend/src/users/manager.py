@@ -1,7 +1,8 @@
 """Object Manager for users.
 
 This module defines the UserManager class, a custom manager for the User model.
-It extends Django's BaseUserManager and provides methods for creating regular users and superusers.
+It extends Django's BaseUserManager and provides methods for creating regular users and superusers,
+and for querying the shard of a user when users are sharded, see users.sharding.
 
 Attributes:
     UserManager (class): Subclass of Django's BaseUserManager, representing the object manager for the User model.
@@ -9,6 +10,8 @@ Attributes:
 
 from django.contrib.auth.models import BaseUserManager
 
+from . import hashing, sharding
+
 
 class UserManager(BaseUserManager):
     """Object Manager for users.
@@ -16,6 +19,14 @@ class UserManager(BaseUserManager):
     Extends Django's BaseUserManager to provide custom methods for user creation.
 
     Methods:
+        normalize_email(email): Normalizes an email address to its stored, lowercase form.
+
+        for_email(email): Returns the users of the shard of an email.
+
+        for_id(user_id): Returns the users of the shard of a user id.
+
+        get_by_natural_key(username): Retrieves a user by email, regardless of its case.
+
         create_user(email, password=None, **extra_fields): Creates a new user.
 
         create_superuser(email, password=None, **extra_fields): Creates a new superuser.
@@ -26,6 +37,62 @@ class UserManager(BaseUserManager):
         superuser = manager.create_superuser(email='admin@example.com', password='adminpassword')
     """
 
+    @classmethod
+    def normalize_email(cls, email):
+        """Normalize an email address.
+
+        Emails are compared case-insensitively, so they are stored lowercased. Values
+        which are not strings, such as a number sent as the email of a JSON login,
+        normalize to an empty string, which matches no user.
+
+        Args:
+            email (str): The email address to normalize.
+
+        Returns:
+            str: The stripped and lowercased email address.
+        """
+        if not isinstance(email, str):
+            return ""
+        return super().normalize_email(email).strip().lower()
+
+    def for_email(self, email):
+        """Return the users of the shard of an email.
+
+        Args:
+            email (str): Email address of the user.
+
+        Returns:
+            QuerySet: The users of the shard, or of the database chosen by the routers
+            when users are not sharded.
+        """
+        shard = sharding.shard_for_email(self.normalize_email(email))
+        return self.db_manager(shard).get_queryset()
+
+    def for_id(self, user_id):
+        """Return the users of the shard of a user id.
+
+        Args:
+            user_id (int): The id of the user.
+
+        Returns:
+            QuerySet: The users of the shard, or of the database chosen by the routers
+            when users are not sharded.
+        """
+        return self.db_manager(sharding.shard_for_id(user_id)).get_queryset()
+
+    def get_by_natural_key(self, username):
+        """Get a user by email, regardless of its case.
+
+        Args:
+            username (str): Email address of the user.
+
+        Returns:
+            User: The user with this email.
+        """
+        return self.for_email(username).get(
+            **{self.model.USERNAME_FIELD: self.normalize_email(username)}
+        )
+
     def create_user(self, email, password=None, **extra_fields):
         """Create a new user.
 
@@ -40,13 +107,13 @@ class UserManager(BaseUserManager):
         Raises:
             ValueError: If the email field is not provided.
         """
+        email = self.normalize_email(email)
         if not email:
             raise ValueError("The Email field must be set")
 
-        email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
-        user.set_password(password)
-        user.save(using=self._db)
+        hashing.set_password(user, password)
+        user.save(using=sharding.shard_for_email(email) or self._db)
         return user
 
     def create_superuser(self, email, password=None, **extra_fields):
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.2
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def lowercase_emails(apps, schema_editor):
+    """Lowercase stored emails, refusing to merge accounts which only differ in case."""
+    User = apps.get_model("users", "User")
+    users = User.objects.using(schema_editor.connection.alias)
+
+    duplicates = list(
+        users.annotate(normalized=Lower("email"))
+        .values("normalized")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .values_list("normalized", flat=True)
+    )
+    if duplicates:
+        raise RuntimeError(
+            "These emails are used by several users which only differ in case, "
+            f"resolve them before migrating: {', '.join(duplicates)}"
+        )
+
+    users.exclude(email=Lower("email")).update(email=Lower("email"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_alter_user_phone"),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="user",
+            constraint=models.CheckConstraint(
+                check=models.Q(("email", Lower("email"))),
+                name="users_user_email_lowercase",
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("users", "0007_user_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["date_joined", "id"], name="users_user_date_joined_id"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["is_active", "date_joined", "id"],
+                name="users_user_active_date_joined",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["email"],
+                name="users_user_email_prefix",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
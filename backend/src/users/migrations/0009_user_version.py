@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0008_user_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
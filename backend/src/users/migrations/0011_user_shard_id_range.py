@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2
+
+from django.db import migrations
+
+from users import sharding
+
+
+def reserve_id_range(apps, schema_editor):
+    """Make a user shard allocate the ids of its range, see users.sharding."""
+    sharding.reserve_id_range(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0010_user_token_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(reserve_id_range, migrations.RunPython.noop),
+    ]
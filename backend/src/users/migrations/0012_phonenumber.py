@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0011_user_shard_id_range"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PhoneNumber",
+            fields=[
+                (
+                    "phone",
+                    models.CharField(max_length=30, primary_key=True, serialize=False),
+                ),
+                ("user_id", models.BigIntegerField(db_index=True)),
+            ],
+        ),
+    ]
@@ -5,12 +5,15 @@ It includes custom fields for email and phone, as well as a custom manager for u
 
 Attributes:
     User (class): Subclass of Django's AbstractUser, representing the User model.
+    PhoneNumber (class): Subclass of Django's Model, a phone number claimed by a user of any shard.
 """
 
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.functions import Lower
 
+from . import sharding
 from .manager import UserManager
 
 
@@ -20,9 +23,18 @@ class User(AbstractUser):
     Extends Django's AbstractUser to include custom fields for email and phone.
     Uses a custom manager, UserManager, for user-related operations.
 
+    Emails are stored lowercased, which a check constraint enforces. The unique index on
+    email therefore makes emails unique regardless of case, and serves case-insensitive
+    lookups of a normalized email.
+
+    Indexes on (date_joined, id) serve the keyset pagination of the user list.
+
     Attributes:
         email (EmailField): A unique email address associated with the user.
         phone (CharField): A unique phone number associated with the user.
+        updated_at (DateTimeField): When the user was last saved.
+        version (PositiveIntegerField): Incremented on every save, identifies a state of the user.
+        token_version (PositiveIntegerField): Version of the signed tokens of the user, incremented to revoke them.
 
     Class Attributes:
         USERNAME_FIELD (str): Specifies the field used for authentication (email in this case).
@@ -32,17 +44,50 @@ class User(AbstractUser):
         __str__(): Returns a string representation of the user, using the email address.
 
         clean(): Performs additional validation during model cleaning, checking for unique email and phone.
+
+        from_db(db, field_names, values): Builds a user read from the database, remembering its phone.
+
+        save(*args, **kwargs): Saves the user, incrementing its version in the database.
     """
 
     username = None
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=30, unique=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    version = models.PositiveIntegerField(default=1)
+    token_version = models.PositiveIntegerField(default=1)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["phone", "first_name", "last_name"]
 
     objects = UserManager()
 
+    class Meta(AbstractUser.Meta):
+        """Meta object for users."""
+
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(email=Lower("email")),
+                name="users_user_email_lowercase",
+            ),
+        ]
+        indexes = [
+            # Keyset pagination of the user list, unfiltered and filtered on is_active.
+            models.Index(
+                fields=["date_joined", "id"], name="users_user_date_joined_id"
+            ),
+            models.Index(
+                fields=["is_active", "date_joined", "id"],
+                name="users_user_active_date_joined",
+            ),
+            # Email prefix filters (LIKE 'prefix%'), whatever the database collation.
+            models.Index(
+                fields=["email"],
+                name="users_user_email_prefix",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
+
     def __str__(self):
         """Return a string representation of the user."""
         return self.email
@@ -50,13 +95,89 @@ class User(AbstractUser):
     def clean(self):
         """Perform additional validation during model cleaning.
 
-        Checks for unique email and phone to avoid duplication.
+        Normalizes the email and checks for unique email and phone to avoid duplication.
 
         Raises:
             ValidationError: If the email or phone is already in use.
         """
-        if User.objects.filter(email=self.email).exclude(pk=self.pk).exists():
+        super().clean()
+
+        if (
+            User.objects.for_email(self.email)
+            .filter(email=self.email)
+            .exclude(pk=self.pk)
+            .exists()
+        ):
             raise ValidationError({"email": "This email address is already in use."})
 
-        if User.objects.filter(phone=self.phone).exclude(pk=self.pk).exists():
+        phone_taken = User.objects.filter(phone=self.phone).exclude(pk=self.pk).exists()
+        if phone_taken or sharding.phone_in_use(self.phone, self.pk):
             raise ValidationError({"phone": "This phone number is already in use."})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Build a user read from the database, remembering its phone, see save."""
+        user = super().from_db(db, field_names, values)
+        user._loaded_phone = dict(zip(field_names, values)).get("phone")
+        return user
+
+    def save(self, *args, **kwargs):
+        """Save the user, incrementing its version.
+
+        The version is incremented by the database, not from the value of this instance,
+        which may be stale: two saves of the same user never yield the same version.
+        Fields saved as expressions, such as the version, are read back after the save.
+
+        Saves limited to some fields also write the version and updated_at, so that
+        every change yields a new version.
+
+        When users are sharded, a new or changed phone is claimed on the primary
+        database in the same transaction, see users.sharding.claim_phone: the save fails
+        with IntegrityError if a user of another shard has the phone.
+        """
+        if not self._state.adding:
+            self.version = models.F("version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields:
+            kwargs["update_fields"] = {*update_fields, "version", "updated_at"}
+        if (
+            sharding.is_enabled()
+            and "phone" in (kwargs.get("update_fields") or {"phone"})
+            and getattr(self, "_loaded_phone", None) != self.phone
+        ):
+            using = kwargs.get("using") or router.db_for_write(User, instance=self)
+            with transaction.atomic(using=using):
+                super().save(*args, **kwargs)
+                sharding.claim_phone(self)
+        else:
+            super().save(*args, **kwargs)
+        self._loaded_phone = self.phone
+
+        expressions = [
+            field.attname
+            for field in self._meta.concrete_fields
+            if hasattr(getattr(self, field.attname), "resolve_expression")
+        ]
+        if expressions:
+            self.refresh_from_db(fields=expressions)
+
+
+class PhoneNumber(models.Model):
+    """Phone number claimed by a user of any shard.
+
+    Phone numbers are unique across shards: when users are sharded, the phone of every
+    user is claimed on the primary database, whose primary key rejects a phone claimed
+    twice. See users.sharding.claim_phone. Without sharding, the unique index on the
+    phone of User is enough and no phone is claimed.
+
+    Attributes:
+        phone (CharField): The phone number.
+        user_id (BigIntegerField): The id of the user, which tells its shard.
+    """
+
+    phone = models.CharField(max_length=30, primary_key=True)
+    user_id = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        """Return a string representation of the claim."""
+        return self.phone
@@ -0,0 +1,148 @@
+"""Password validators with a warm start and a fast similarity check.
+
+Django's CommonPasswordValidator decompresses and parses its list of 20,000 common
+passwords when it is created, which happens on the first password validation of every
+process. The validator of this module parses the list once per process into a
+frozenset, shared by every instance, and preload() builds it when the application is
+loaded (see UsersConfig.ready), so that no request pays for it. Under gunicorn --preload
+the list is built once, before the workers are forked.
+
+Django's UserAttributeSimilarityValidator builds a SequenceMatcher for every part of
+every user attribute. The validator of this module takes the same decisions, but counts
+the characters of the password once, and rejects most parts by their length alone
+before counting theirs.
+
+Attributes:
+    CommonPasswordValidator (class): Subclass of Django's CommonPasswordValidator sharing a frozenset.
+    UserAttributeSimilarityValidator (class): Subclass of Django's UserAttributeSimilarityValidator.
+    preload (function): Builds the password validators of the settings and their data.
+"""
+
+import gzip
+import re
+import threading
+from collections import Counter
+
+from django.contrib.auth import password_validation
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.utils.translation import gettext as _
+
+_WORD_SEPARATOR = re.compile(r"\W+")
+
+# Parsed password lists by path, built once per process.
+_password_lists = {}
+_password_lists_lock = threading.Lock()
+
+
+def _load_password_list(path):
+    """Return the passwords of a list, gzipped or not, as a frozenset."""
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return frozenset(map(str.strip, data.decode().splitlines()))
+
+
+class CommonPasswordValidator(password_validation.CommonPasswordValidator):
+    """Validate that the password is not a common password.
+
+    Extends Django's CommonPasswordValidator, whose list it uses by default. The list
+    is parsed once per process and path, and shared by every instance.
+
+    Attributes:
+        passwords (frozenset): The common passwords, lowercased.
+    """
+
+    def __init__(self, password_list_path=None):
+        path = str(password_list_path or self.DEFAULT_PASSWORD_LIST_PATH)
+        passwords = _password_lists.get(path)
+        if passwords is None:
+            with _password_lists_lock:
+                passwords = _password_lists.get(path)
+                if passwords is None:
+                    passwords = _password_lists[path] = _load_password_list(path)
+        self.passwords = passwords
+
+
+class UserAttributeSimilarityValidator(
+    password_validation.UserAttributeSimilarityValidator
+):
+    """Validate that the password is not too similar to the attributes of the user.
+
+    Extends Django's UserAttributeSimilarityValidator with the same results. Django
+    compares the password with every part of an attribute by SequenceMatcher.quick_ratio,
+    the share of characters they have in common. This validator computes that ratio
+    from character counts, and skips parts too short or too long to reach
+    max_similarity whatever their characters.
+
+    Methods:
+        validate(password, user=None): Raises ValidationError if the password is too similar.
+        is_similar(password, counts, part): Returns whether the password is too similar to a part.
+    """
+
+    def validate(self, password, user=None):
+        """Validate that the password is not too similar to the attributes of the user.
+
+        Args:
+            password (str): The password.
+            user (User): The user, whose attributes are compared with the password.
+
+        Raises:
+            ValidationError: If the password is too similar to an attribute.
+        """
+        if not user:
+            return
+
+        password = password.lower()
+        counts = Counter(password)
+        for attribute_name in self.user_attributes:
+            value = getattr(user, attribute_name, None)
+            if not value or not isinstance(value, str):
+                continue
+            value = value.lower()
+            for part in (*_WORD_SEPARATOR.split(value), value):
+                if not self.is_similar(password, counts, part):
+                    continue
+                try:
+                    verbose_name = str(
+                        user._meta.get_field(attribute_name).verbose_name
+                    )
+                except FieldDoesNotExist:
+                    verbose_name = attribute_name
+                raise ValidationError(
+                    _("The password is too similar to the %(verbose_name)s."),
+                    code="password_too_similar",
+                    params={"verbose_name": verbose_name},
+                )
+
+    def is_similar(self, password, counts, part):
+        """Return whether the password is too similar to a part of an attribute.
+
+        Args:
+            password (str): The lowercased password.
+            counts (Counter): The characters of the password.
+            part (str): The lowercased part of the attribute.
+
+        Returns:
+            bool: Whether the share of common characters reaches max_similarity.
+        """
+        if password_validation.exceeds_maximum_length_ratio(
+            password, self.max_similarity, part
+        ):
+            return False
+        length = len(password) + len(part)
+        if not length:
+            return True
+        # Upper bound of the ratio: every character of the shorter string is common.
+        if 2.0 * min(len(password), len(part)) / length < self.max_similarity:
+            return False
+        common = sum(min(count, counts[char]) for char, count in Counter(part).items())
+        return 2.0 * common / length >= self.max_similarity
+
+
+def preload():
+    """Build the password validators of the settings, with their password lists.
+
+    Django caches them, so the first validation of a request finds them ready.
+    """
+    password_validation.get_default_password_validators()
@@ -0,0 +1,104 @@
+"""Conditional and cached user payloads.
+
+Clients poll the details of their user, which almost never change. This module lets the
+details views answer such polls cheaply:
+
+- Every response carries an ETag derived from the id, version and updated_at of the user,
+  and a Last-Modified date. A request whose If-None-Match or If-Modified-Since still
+  matches gets an empty 304 reply, without serializing the user.
+- The serialized data and rendered JSON of a user are cached per ETag, so unconditional
+  reads of an unchanged user skip serialization and rendering too. A new version of the user has a new ETag,
+  which makes the entries of older versions unreachable until they are evicted.
+
+Attributes:
+    payload_cache (LRUCache): Cache of ETag to serialized and rendered payload.
+    user_etag (function): Returns the ETag of a user.
+    conditional_response (function): Returns a 304 response if the client's copy is current.
+    cached_payload (function): Returns the payload of a user, from the cache if possible.
+    set_validators (function): Sets the ETag, Last-Modified and caching headers of a response.
+"""
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from .cache import LRUCache
+
+payload_cache = LRUCache(
+    max_entries=settings.USER_PAYLOAD_CACHE_MAX_ENTRIES,
+    ttl=settings.USER_PAYLOAD_CACHE_TTL,
+)
+
+
+def user_etag(user):
+    """Return the ETag of a user.
+
+    The version identifies a state of the user. updated_at tells apart two saves racing
+    from the same version.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    return f'"{user.pk}-{user.version}-{user.updated_at.timestamp():.6f}"'
+
+
+def _last_modified(user):
+    return int(user.updated_at.timestamp())
+
+
+def conditional_response(request, user):
+    """Return a 304 response if the client's copy of the user is current.
+
+    Args:
+        request: The incoming request, with If-None-Match or If-Modified-Since headers.
+        user (User): The requested user.
+
+    Returns:
+        HttpResponse: A 304 response with the validators set, or None.
+    """
+    response = get_conditional_response(
+        request, etag=user_etag(user), last_modified=_last_modified(user)
+    )
+    if response is not None:
+        set_validators(response, user)
+    return response
+
+
+def cached_payload(user, media_type, serialize, render):
+    """Return the serialized and rendered payload of a user, from the cache if possible.
+
+    Args:
+        user (User): The user.
+        media_type (str): The accepted media type, including parameters such as indent,
+                          which change the rendered bytes.
+        serialize (callable): Returns the serialized data of the user, on a cache miss.
+        render (callable): Returns the rendered bytes of serialized data, on a cache miss.
+
+    Returns:
+        tuple: The serialized data and the rendered bytes.
+    """
+    key = (user_etag(user), media_type)
+    payload = payload_cache.get(key)
+    if payload is None:
+        data = serialize()
+        payload = (data, render(data))
+        payload_cache.set(key, payload, group=user.pk)
+    return payload
+
+
+def set_validators(response, user):
+    """Set the ETag, Last-Modified and caching headers of a user response.
+
+    Responses are private to the user and must be revalidated, which the ETag makes cheap.
+
+    Args:
+        response (HttpResponse): The response.
+        user (User): The user the response describes.
+    """
+    response["ETag"] = user_etag(user)
+    response["Last-Modified"] = http_date(_last_modified(user))
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ("Authorization",))
@@ -4,10 +4,14 @@ This module defines custom permissions for use with Django Rest Framework.
 
 Attributes:
     IsOwner (class): Subclass of rest_framework.permissions.BasePermission.
+    HasServiceCredential (class): Subclass of rest_framework.permissions.BasePermission for internal services.
 """
 
+from django.contrib.auth import get_user_model
 from rest_framework.permissions import BasePermission
 
+from core.credentials import is_service_credential
+
 
 class IsOwner(BasePermission):
     """Check if a user is the owner of an object.
@@ -33,4 +37,31 @@ class IsOwner(BasePermission):
         Returns:
             bool: True if the user is the owner, False otherwise.
         """
-        return obj.user == request.user
+        # A user owns itself, other objects are owned through their user field.
+        owner = obj if isinstance(obj, get_user_model()) else getattr(obj, "user", None)
+        return owner == request.user
+
+
+class HasServiceCredential(BasePermission):
+    """Check that the request comes from an internal service.
+
+    The service sends one of the SERVICE_CREDENTIALS in the X-Service-Credential header.
+    Credentials are compared in constant time.
+
+    Methods:
+        has_permission(request, view): Check the credential of the request.
+    """
+
+    message = "A valid service credential is required."
+
+    def has_permission(self, request, view):
+        """Check the credential of the request.
+
+        Args:
+            request: The incoming request.
+            view: The DRF view handling the request.
+
+        Returns:
+            bool: True if the request carries a known service credential.
+        """
+        return is_service_credential(request.headers.get("X-Service-Credential", ""))
@@ -0,0 +1,74 @@
+"""PostgreSQL COPY helpers for users.
+
+This module loads rows into PostgreSQL tables with COPY FROM STDIN, which is an order of
+magnitude faster than INSERT statements for large volumes.
+
+Attributes:
+    copy_rows (function): Loads rows into a table with COPY.
+    default_values (function): Returns the database values of the model defaults of a table.
+"""
+
+import csv
+import io
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Load rows into a table with COPY.
+
+    Args:
+        cursor: A database cursor on a PostgreSQL connection.
+        table (str): Name of the table to load.
+        columns (list): Names of the loaded columns.
+        rows (Iterable): Tuples of values, one per column. None is loaded as NULL.
+
+    Returns:
+        int: Number of loaded rows.
+
+    Raises:
+        DatabaseError: If COPY fails, for example IntegrityError on a duplicate key.
+    """
+    buffer = io.StringIO()
+    # COPY reads an unquoted empty field as NULL and a quoted one as an empty string.
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NOTNULL)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    buffer.seek(0)
+
+    quote = cursor.db.ops.quote_name
+    # copy_expert is not wrapped by Django, raise its errors as django.db exceptions.
+    with cursor.db.wrap_database_errors:
+        cursor.copy_expert(
+            f"COPY {quote(table)} ({', '.join(quote(column) for column in columns)}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    return count
+
+
+def default_values(model, connection, exclude=()):
+    """Return the database values of the model defaults of a table.
+
+    Rows written with COPY or INSERT ... SELECT bypass the model, so every column they
+    do not provide has to be filled with the default the model would have used.
+
+    Args:
+        model (Model): The model of the table.
+        connection: The connection the values are prepared for.
+        exclude (Iterable): Names of columns the caller provides itself.
+
+    Returns:
+        dict: Column name to database value, for every concrete column except the primary
+              key and the excluded ones.
+    """
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.column in exclude:
+            continue
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+            value = field.pre_save(model(), add=True)
+        else:
+            value = field.get_default()
+        values[field.column] = field.get_db_prep_save(value, connection)
+    return values
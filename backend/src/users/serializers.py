@@ -4,15 +4,41 @@ This module defines the UserSerializer class, a Django Rest Framework serializer
 for the User model. It includes custom handling for password management.
 
 Attributes:
+    NormalizedEmailField (class): Subclass of rest_framework.serializers.EmailField normalizing emails.
     UserSerializer (class): Subclass of rest_framework.serializers.ModelSerializer.
+    BulkUserRowSerializer (class): Subclass of UserSerializer for validating one row of a bulk registration.
+    BulkUserUpdateRowSerializer (class): Subclass of BulkUserRowSerializer for validating one row of a bulk update.
+    UserListSerializer (class): Subclass of rest_framework.serializers.ModelSerializer for the user list.
+    CompiledReadSerializer (class): Precompiled read-only version of a model serializer.
+    user_read_serializer (CompiledReadSerializer): Compiled UserSerializer.
+    user_list_read_serializer (CompiledReadSerializer): Compiled UserListSerializer.
 """
 
-from django.contrib.auth import update_session_auth_hash
+from functools import cached_property
+from operator import attrgetter
+
+from django.contrib.auth import password_validation, update_session_auth_hash
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
+from . import hashing, sharding
 from .models import User
 
 
+class NormalizedEmailField(serializers.EmailField):
+    """Email field which normalizes its value like UserManager.normalize_email.
+
+    The value is normalized before the validators run, so that uniqueness is checked
+    against the stored form of the email.
+    """
+
+    def to_internal_value(self, data):
+        """Return the normalized email."""
+        return User.objects.normalize_email(super().to_internal_value(data))
+
+
 class UserSerializer(serializers.ModelSerializer):
     """User Serializer.
 
@@ -27,12 +53,27 @@ class UserSerializer(serializers.ModelSerializer):
         fields (tuple): Fields to be included in the serialized representation.
 
     Methods:
+        validate_email(value): Checks that the email is unused on its shard.
+
+        validate_phone(value): Checks that the phone is unused on every shard.
+
+        validate(attrs): Checks the password against AUTH_PASSWORD_VALIDATORS.
+
         create(validated_data): Creates a new user using the provided validated data.
 
         update(instance, validated_data): Updates an existing user instance with validated data,
         handling password updates and session authentication hash.
     """
 
+    default_error_messages = {
+        "conflict": "A user with this email or phone already exists.",
+    }
+
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.EmailField: NormalizedEmailField,
+    }
+
     password = serializers.CharField(write_only=True)
 
     class Meta:
@@ -41,6 +82,83 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ("first_name", "last_name", "email", "password", "phone")
 
+    def validate_email(self, value):
+        """Check that the email is unused on its shard.
+
+        The uniqueness validator of the email only queries the primary database. When
+        users are sharded, the email must also be unused on its own shard.
+
+        Args:
+            value (str): The normalized email.
+
+        Returns:
+            str: The email.
+
+        Raises:
+            ValidationError: If another user of the shard has the email.
+        """
+        if sharding.shard_for_email(value) in (None, "default"):
+            return value
+        users = User.objects.for_email(value).filter(email=value)
+        if self.instance is not None:
+            users = users.exclude(pk=self.instance.pk)
+        if users.exists():
+            raise serializers.ValidationError("user with this email already exists.")
+        return value
+
+    def validate_phone(self, value):
+        """Check that the phone is unused on every shard.
+
+        The uniqueness validator of the phone only queries the primary database. When
+        users are sharded, no user of another shard may have the phone either, see
+        users.sharding.phone_in_use.
+
+        Args:
+            value (str): The phone number.
+
+        Returns:
+            str: The phone number.
+
+        Raises:
+            ValidationError: If another user has the phone.
+        """
+        if self.instance is not None and value == self.instance.phone:
+            return value
+        if sharding.phone_in_use(value, getattr(self.instance, "pk", None)):
+            raise serializers.ValidationError("user with this phone already exists.")
+        return value
+
+    def validate(self, attrs):
+        """Check the password against the validators of AUTH_PASSWORD_VALIDATORS.
+
+        The password is compared with the attributes the user will have, those of the
+        instance updated by the other fields.
+
+        Args:
+            attrs (dict): The validated fields.
+
+        Returns:
+            dict: The fields.
+
+        Raises:
+            ValidationError: If the password is rejected by a validator.
+        """
+        password = attrs.get("password")
+        if not password:
+            return attrs
+        user = User(
+            **{
+                name: attrs.get(name, getattr(self.instance, name, ""))
+                for name in self.Meta.fields
+                if name != "password"
+            }
+        )
+        try:
+            password_validation.validate_password(password, user)
+        except ValidationError as exc:
+            raise serializers.ValidationError({"password": list(exc.messages)})
+        return attrs
+
     def create(self, validated_data):
         """Create a new user.
 
@@ -62,18 +180,178 @@ class UserSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         """Update an existing user instance.
 
+        The changes are saved and the user moved to the shard of a new email in one
+        transaction, so that a failed move keeps the previous email.
+
         Args:
             instance (User): The existing user instance.
             validated_data (dict): Validated data containing updated user information.
 
         Returns:
             User: The updated user object.
+
+        Raises:
+            ValidationError: If a user with the email or phone was saved concurrently, or
+                             the shard of the new email has a user with the phone.
         """
         password = validated_data.get("password")
 
         if password:
-            instance.set_password(password)
-            update_session_auth_hash(self.context.get("request"), instance)
+            hashing.set_password(instance, password)
+            # Revokes the signed tokens of the user, see users.tokens.
+            instance.token_version = models.F("token_version") + 1
+            request = self.context.get("request")
+            # Token-authenticated API requests have no session to keep valid.
+            if hasattr(request, "session"):
+                update_session_auth_hash(request, instance)
             validated_data.pop("password")
 
-        return super().update(instance, validated_data)
+        try:
+            with transaction.atomic(using=sharding.db_for_user(instance)):
+                instance = super().update(instance, validated_data)
+                # A new email may belong to another shard.
+                return sharding.relocate_user(instance)
+        except IntegrityError as exc:
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [self.error_messages["conflict"]]}
+            ) from exc
+
+
+class BulkUserRowSerializer(UserSerializer):
+    """Serializer for one row of a bulk registration.
+
+    Validates a row like UserSerializer, but without the per-row uniqueness checks on
+    email and phone. Those are done for the whole batch at once by BulkUserRegistration.
+    """
+
+    class Meta(UserSerializer.Meta):
+        """Meta object for bulk registration rows."""
+
+        extra_kwargs = {
+            "email": {"validators": []},
+            "phone": {"validators": []},
+        }
+
+
+class BulkUserUpdateRowSerializer(BulkUserRowSerializer):
+    """Serializer for one row of a bulk update.
+
+    Validates the id of the user and the fields to change, without the per-row uniqueness
+    checks on email and phone. Those are done for the whole batch at once by
+    BulkUserUpdate. Passwords cannot be changed in bulk.
+    """
+
+    id = serializers.IntegerField()
+
+    class Meta(BulkUserRowSerializer.Meta):
+        """Meta object for bulk update rows."""
+
+        fields = ("id", "first_name", "last_name", "email", "phone")
+
+
+class UserListSerializer(serializers.ModelSerializer):
+    """Serializer for the user list.
+
+    Read only, with the fields support tooling needs to identify a user and its state.
+    """
+
+    class Meta:
+        """Meta object for the user list."""
+
+        model = User
+        fields = (
+            "id",
+            "email",
+            "phone",
+            "first_name",
+            "last_name",
+            "is_active",
+            "date_joined",
+        )
+        read_only_fields = fields
+
+
+class CompiledReadSerializer:
+    """Precompiled read-only version of a model serializer.
+
+    Serializer.to_representation builds and walks the bound fields of a serializer for
+    every object, and calls get_attribute and to_representation on each field. This class
+    does that walk once: every readable field becomes an attribute getter and a converter.
+    The converters of plain character, integer and boolean fields are the builtins str,
+    int and bool, which is what those fields return. Other fields keep their own
+    to_representation.
+
+    The result is equal to the data of the serializer, so it renders to the same bytes.
+
+    Attributes:
+        serializer_class (class): The compiled serializer class.
+
+    Methods:
+        to_representation(instance): Returns the data of one object.
+
+        many(instances): Returns the data of several objects.
+    """
+
+    BUILTIN_CONVERTERS = (
+        (serializers.CharField, str),
+        (serializers.IntegerField, int),
+        (serializers.BooleanField, bool),
+    )
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def plan(self):
+        """The field name, getter and converter of every readable field.
+
+        Compiled on first use, once the app registry is ready.
+        """
+        plan = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if len(field.source_attrs) == 1:
+                getter = attrgetter(field.source_attrs[0])
+            else:
+                getter = field.get_attribute
+            converter = next(
+                (
+                    builtin
+                    for field_class, builtin in self.BUILTIN_CONVERTERS
+                    if type(field).to_representation is field_class.to_representation
+                ),
+                field.to_representation,
+            )
+            plan.append((name, getter, converter))
+        return tuple(plan)
+
+    def to_representation(self, instance):
+        """Return the data of one object.
+
+        Args:
+            instance (Model): The object.
+
+        Returns:
+            dict: The serialized fields, like the data of the serializer.
+        """
+        data = {}
+        for name, getter, converter in self.plan:
+            value = getter(instance)
+            data[name] = None if value is None else converter(value)
+        return data
+
+    def many(self, instances):
+        """Return the data of several objects.
+
+        Args:
+            instances (Iterable): The objects.
+
+        Returns:
+            list: The serialized fields of every object.
+        """
+        return [self.to_representation(instance) for instance in instances]
+
+
+user_read_serializer = CompiledReadSerializer(UserSerializer)
+user_list_read_serializer = CompiledReadSerializer(UserListSerializer)
@@ -0,0 +1,495 @@
+"""Hash sharding of users across several databases.
+
+Sharding is enabled by listing more than one database alias in USER_SHARDS, the
+primary database "default" first. Every user lives on one shard, chosen by a jump
+consistent hash of its normalized email: appending a shard moves about 1/N of the users,
+which reshard_users moves, and removing or reordering shards is not supported.
+
+Lookups are routed to the right shard without asking every shard:
+
+- by email, through UserManager.for_email, as EmailBackend.authenticate does;
+- by id, through UserManager.for_id: shard N allocates the ids from N << SHARD_ID_BITS
+  on, so the id of a user tells its shard;
+- by token key: keys of shard N > 0 start with "N_", keys without a prefix are on
+  "default", where every user lived before sharding was enabled.
+
+Users, their tokens, groups and permissions are stored on their shard, and read from it
+through UserShardRouter. Other models, and queries not routed to a shard, use the
+primary database. The user list and export query every shard, see
+users.pagination.KeysetPagination and users.export.export_rows. Bulk registration and
+updates, import_users and seed_users, which would write users to the primary database
+only, are refused.
+
+Phone numbers are unique across shards: the phone of every user is claimed in the
+PhoneNumber table of the primary database, whose primary key is the phone. A claim is
+committed before the user it is made for, so a failure may leave a phone claimed by a
+user which does not have it, never a phone held by two users: such a claim is taken over
+by the next user of the phone. reshard_users claims the phones of the users loaded before
+sharding was enabled.
+
+Attributes:
+    SHARD_ID_BITS (int): Bits of the ids of one shard, its index takes the bits above.
+    is_enabled (function): Returns whether users are sharded.
+    jump_hash (function): Returns the bucket of a key, by jump consistent hashing.
+    shard_index (function): Returns the index of the shard of an email among some shards.
+    shard_for_email (function): Returns the shard of an email.
+    shard_for_id (function): Returns the shard of a user id.
+    shard_for_token_key (function): Returns the shard of a token key.
+    db_for_user (function): Returns the shard holding a user.
+    phone_in_use (function): Returns whether another user of any shard has a phone.
+    claim_phone (function): Claims the phone of a saved user.
+    claim_phones (function): Claims the phones of users in bulk.
+    new_token_key (function): Returns a new token key of a user, encoding its shard.
+    reserve_id_range (function): Makes a shard allocate the ids of its range.
+    move_users (function): Moves users to the shard of their email.
+    move_user (function): Moves a user to the shard of its email.
+    relocate_user (function): Moves a user to the shard of its email, if it is elsewhere.
+    UserShardRouter (class): Database router keeping users and their tokens on their shard.
+"""
+
+import hashlib
+import secrets
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+SHARD_ID_BITS = 40
+
+# Apps whose models are stored on the shard of their user: users, with the tables of its
+# groups and permissions, and the tokens of rest_framework.authtoken.
+SHARDED_APPS = {"users", "authtoken"}
+
+
+def is_enabled():
+    """Return whether users are sharded across several databases."""
+    return len(settings.USER_SHARDS) > 1
+
+
+def jump_hash(key, buckets):
+    """Return the bucket of a key, by jump consistent hashing.
+
+    Lamping and Veach, "A Fast, Minimal Memory, Consistent Hash Algorithm": going from N
+    to N + 1 buckets only moves keys to the new bucket.
+
+    Args:
+        key (int): A 64 bits unsigned integer.
+        buckets (int): The number of buckets.
+
+    Returns:
+        int: The bucket, between 0 and buckets - 1.
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_index(email, shards=None):
+    """Return the index of the shard of a normalized email.
+
+    Args:
+        email (str): The normalized email, see UserManager.normalize_email.
+        shards (list): The shard aliases, USER_SHARDS by default.
+
+    Returns:
+        int: The index of the shard in shards.
+    """
+    shards = settings.USER_SHARDS if shards is None else shards
+    digest = hashlib.blake2b(email.encode(), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, "big"), len(shards))
+
+
+def shard_for_email(email):
+    """Return the shard of a normalized email.
+
+    Args:
+        email (str): The normalized email.
+
+    Returns:
+        str: The database alias of the shard, or None when users are not sharded, which
+        leaves the choice to the routers.
+    """
+    if not is_enabled():
+        return None
+    return settings.USER_SHARDS[shard_index(email)]
+
+
+def _shard(index):
+    shards = settings.USER_SHARDS
+    return shards[index] if 0 <= index < len(shards) else None
+
+
+def shard_for_id(user_id):
+    """Return the shard of a user id.
+
+    Args:
+        user_id (int): The id of the user.
+
+    Returns:
+        str: The database alias of the shard, or None when users are not sharded or the
+        id belongs to no shard.
+    """
+    if not is_enabled():
+        return None
+    return _shard(int(user_id) >> SHARD_ID_BITS)
+
+
+def shard_for_token_key(key):
+    """Return the shard of a token key.
+
+    Args:
+        key (str): The token key.
+
+    Returns:
+        str: The database alias of the shard, or None when users are not sharded or the
+        key belongs to no shard.
+    """
+    if not is_enabled():
+        return None
+    prefix, separator, _ = key.partition("_")
+    if not separator:
+        return settings.USER_SHARDS[0]
+    try:
+        return _shard(int(prefix))
+    except ValueError:
+        return None
+
+
+def db_for_user(user):
+    """Return the shard holding a user.
+
+    Args:
+        user (User): A user read from the database.
+
+    Returns:
+        str: The database alias of the shard, or None when users are not sharded.
+    """
+    return user._state.db if is_enabled() else None
+
+
+def _phones():
+    return apps.get_model("users", "PhoneNumber")._default_manager.using(
+        settings.USER_SHARDS[0]
+    )
+
+
+def _has_phone(user_id, phone):
+    shard = shard_for_id(user_id)
+    if shard is None:
+        return False
+    users = get_user_model()._default_manager.using(shard)
+    return users.filter(pk=user_id, phone=phone).exists()
+
+
+def _claim(phone, user_id):
+    phones = _phones()
+    with transaction.atomic(using=phones.db):
+        claim, created = phones.select_for_update().get_or_create(
+            phone=phone, defaults={"user_id": user_id}
+        )
+        if created or claim.user_id == user_id:
+            return
+        if _has_phone(claim.user_id, phone):
+            raise IntegrityError(f"Phone {phone} is used by user {claim.user_id}.")
+        claim.user_id = user_id
+        claim.save(update_fields=["user_id"])
+
+
+def phone_in_use(phone, user_id=None):
+    """Return whether another user, of any shard, has a phone number.
+
+    Args:
+        phone (str): The phone number.
+        user_id (int): The id of the user taking the phone, None for a new user.
+
+    Returns:
+        bool: Whether another user claimed the phone and has it. Always False when users
+        are not sharded, the unique index on the phone is enough then.
+    """
+    if not is_enabled():
+        return False
+    holder = _phones().filter(phone=phone).values_list("user_id", flat=True).first()
+    return holder not in (None, user_id) and _has_phone(holder, phone)
+
+
+def claim_phone(user):
+    """Claim the phone number of a saved user, on the primary database.
+
+    A phone claimed by another user is only taken over if that user no longer has it.
+    The claims of the previous phones of the user are released once its shard commits,
+    so that they are kept if the change rolls back.
+
+    Args:
+        user (User): The user, just saved on its shard.
+
+    Raises:
+        IntegrityError: If another user has the phone.
+    """
+    user_id = user.pk
+    phones = _phones()
+    claimed = set(phones.filter(user_id=user_id).values_list("phone", flat=True))
+    if user.phone not in claimed:
+        _claim(user.phone, user_id)
+    released = claimed - {user.phone}
+    if released:
+        transaction.on_commit(
+            lambda: phones.filter(user_id=user_id, phone__in=released).delete(),
+            using=user._state.db,
+        )
+
+
+def claim_phones(claims):
+    """Claim the phone numbers of users in bulk, see claim_phone.
+
+    Args:
+        claims (list): (user id, phone) pairs.
+
+    Returns:
+        list: The pairs whose phone another user has, which are not claimed.
+    """
+    phones = _phones()
+    phones.bulk_create(
+        (phones.model(phone=phone, user_id=user_id) for user_id, phone in claims),
+        ignore_conflicts=True,
+    )
+    holders = dict(
+        phones.filter(phone__in=[phone for _, phone in claims]).values_list(
+            "phone", "user_id"
+        )
+    )
+    conflicts = []
+    for user_id, phone in claims:
+        if holders.get(phone) == user_id:
+            continue
+        try:
+            _claim(phone, user_id)
+        except IntegrityError:
+            conflicts.append((user_id, phone))
+    return conflicts
+
+
+def new_token_key(user):
+    """Return a new token key of a user, encoding the shard holding it.
+
+    Args:
+        user (User): A user read from the database.
+
+    Returns:
+        str: 40 characters, the index of the shard and "_" first unless it is 0.
+    """
+    index = settings.USER_SHARDS.index(user._state.db) if is_enabled() else 0
+    prefix = f"{index}_" if index else ""
+    return prefix + secrets.token_hex(20)[: 40 - len(prefix)]
+
+
+def reserve_id_range(connection):
+    """Make a shard allocate the user ids of its range.
+
+    Shard N allocates the ids from N << SHARD_ID_BITS on. Does nothing on the first
+    shard and on databases which are no shards. Run by the migrations, and again by
+    reshard_users.
+
+    Args:
+        connection: The connection of the database.
+    """
+    if connection.alias not in settings.USER_SHARDS:
+        return
+    index = settings.USER_SHARDS.index(connection.alias)
+    if not index:
+        return
+    table = get_user_model()._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence(%s, 'id'),"
+            " GREATEST(%s, nextval(pg_get_serial_sequence(%s, 'id'))), false)",
+            [table, index << SHARD_ID_BITS, table],
+        )
+
+
+def move_users(source, target, ids):
+    """Move users to the shard of their email, in one transaction per shard.
+
+    The users are copied to the target shard, with their group and permission
+    memberships and their tokens, then deleted from their shard. They get ids of the
+    target shard, and their tokens new keys: their previous token and signed tokens stop
+    working, they have to log in again. Their phones are claimed for their new ids. The
+    target transaction commits first, so that a failure leaves a copy of a user on both
+    shards rather than on none.
+
+    Users are locked while they are copied. Those which were deleted, or whose email no
+    longer belongs to the target shard, are left alone.
+
+    Args:
+        source (str): The database alias of the shard holding the users.
+        target (str): The database alias of the shard of their email.
+        ids (list): The ids of the users.
+
+    Returns:
+        list: The users on the target shard.
+
+    Raises:
+        IntegrityError: If the email of a user is used on the target shard, or its phone
+            by another user.
+        ValueError: If a group of a user does not exist on the target shard.
+    """
+    user_model = get_user_model()
+    groups_model = user_model.groups.through
+    permissions_model = user_model.user_permissions.through
+    group_model = groups_model._meta.get_field("group").related_model
+    permission_model = permissions_model._meta.get_field("permission").related_model
+    token_model = user_model._meta.get_field("auth_token").related_model
+    permission_key = ("content_type__app_label", "content_type__model", "codename")
+
+    with (
+        transaction.atomic(using=source),
+        transaction.atomic(using=target),
+        transaction.atomic(using=settings.USER_SHARDS[0]),
+    ):
+        users = [
+            user
+            for user in user_model._default_manager.using(source)
+            .select_for_update()
+            .filter(pk__in=ids)
+            .order_by("pk")
+            if shard_for_email(user.email) == target
+        ]
+        if not users:
+            return []
+        ids = [user.pk for user in users]
+        groups = list(
+            groups_model.objects.using(source)
+            .filter(user_id__in=ids)
+            .values_list("user_id", "group__name")
+        )
+        permissions = list(
+            permissions_model.objects.using(source)
+            .filter(user_id__in=ids)
+            .values_list("user_id", *(f"permission__{key}" for key in permission_key))
+        )
+        with_token = set(
+            token_model.objects.using(source)
+            .filter(user_id__in=ids)
+            .values_list("user_id", flat=True)
+        )
+
+        for user in users:
+            user.pk = None
+            user._state.adding = True
+        moved = user_model._default_manager.using(target).bulk_create(users)
+        new_ids = dict(zip(ids, (user.pk for user in moved)))
+
+        if groups:
+            target_groups = dict(
+                group_model.objects.using(target)
+                .filter(name__in={name for _, name in groups})
+                .values_list("name", "pk")
+            )
+            missing = {name for _, name in groups} - set(target_groups)
+            if missing:
+                raise ValueError(f"Groups missing on {target}: {', '.join(missing)}.")
+            groups_model.objects.using(target).bulk_create(
+                groups_model(user_id=new_ids[user_id], group_id=target_groups[name])
+                for user_id, name in groups
+            )
+        if permissions:
+            target_permissions = {
+                tuple(values[:-1]): values[-1]
+                for values in permission_model.objects.using(target).values_list(
+                    *permission_key, "pk"
+                )
+            }
+            permissions_model.objects.using(target).bulk_create(
+                permissions_model(
+                    user_id=new_ids[user_id],
+                    permission_id=target_permissions[tuple(key)],
+                )
+                for user_id, *key in permissions
+            )
+        token_model.objects.using(target).bulk_create(
+            token_model(user=user, key=new_token_key(user))
+            for user_id, user in zip(ids, moved)
+            if user_id in with_token
+        )
+
+        _phones().filter(user_id__in=ids).delete()
+        conflicts = claim_phones([(user.pk, user.phone) for user in moved])
+        if conflicts:
+            phones = ", ".join(phone for _, phone in conflicts)
+            raise IntegrityError(f"Phones used by other users: {phones}.")
+
+        user_model._default_manager.using(source).filter(pk__in=ids).delete()
+    return moved
+
+
+def move_user(user, target):
+    """Move a user to the shard of its email, see move_users.
+
+    Args:
+        user (User): The user, read from its shard.
+        target (str): The database alias of the shard of its email.
+
+    Returns:
+        User: The user on the target shard, or the given user if it was not moved.
+    """
+    moved = move_users(user._state.db, target, [user.pk])
+    return moved[0] if moved else user
+
+
+def relocate_user(user):
+    """Move a user to the shard of its email, if it is on another shard.
+
+    Changing the email of a user may change its shard.
+
+    Args:
+        user (User): The user, read from its shard.
+
+    Returns:
+        User: The user on the shard of its email.
+    """
+    target = shard_for_email(user.email)
+    if target is None or target == user._state.db:
+        return user
+    return move_user(user, target)
+
+
+class UserShardRouter:
+    """Database router keeping users and their tokens on their shard.
+
+    Queries on users or tokens which come from an instance, such as saving a user or
+    reading the token of a user, go to the shard of the instance. Other queries are
+    left to the next routers, see core.routers: route them to a shard with the
+    for_email and for_id methods of UserManager, or with the shard_for_* functions.
+
+    Every shard holds the tables of every app, so that the tables of users can refer to
+    groups, permissions and content types.
+
+    Methods:
+        db_for_read(model, **hints): Returns the shard of the instance, if any.
+        db_for_write(model, **hints): Returns the shard of the instance, if any.
+        allow_migrate(db, app_label, model_name=None, **hints): Allows migrations on every shard.
+    """
+
+    def _db_for_instance(self, instance):
+        if instance is None or not is_enabled():
+            return None
+        # The groups of a user are read with the user as instance.
+        if instance._meta.app_label not in SHARDED_APPS:
+            return None
+        db = instance._state.db
+        return db if db in settings.USER_SHARDS else None
+
+    def db_for_read(self, model, **hints):
+        """Return the shard of the instance the query comes from, if any."""
+        return self._db_for_instance(hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        """Return the shard of the instance the query comes from, if any."""
+        return self._db_for_instance(hints.get("instance"))
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Allow migrations on every shard."""
+        return True if db in settings.USER_SHARDS else None
@@ -0,0 +1,42 @@
+"""Signal receivers for users.
+
+This module keeps the token authentication cache consistent with the database. Saving or
+deleting a user or a token drops the cached entries of that user, right away and again
+once the surrounding transaction commits.
+
+Attributes:
+    invalidate_user_tokens (function): Receiver for User saves and deletes.
+    invalidate_token (function): Receiver for Token saves and deletes.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication
+from .models import User
+
+
+def _invalidate(user_id, key=None):
+    if key is not None:
+        authentication.invalidate_token(key)
+    authentication.invalidate_user(user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """Drop the cached tokens of a saved or deleted user."""
+    _invalidate(instance.pk)
+    transaction.on_commit(lambda: _invalidate(instance.pk), using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """Drop a saved or deleted token and the other cached tokens of its user."""
+    _invalidate(instance.user_id, instance.key)
+    transaction.on_commit(
+        lambda: _invalidate(instance.user_id, instance.key), using=kwargs.get("using")
+    )
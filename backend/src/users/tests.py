@@ -1,11 +1,50 @@
 """Test cases for users app"""
 
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.password_validation import (
+    UserAttributeSimilarityValidator as DjangoUserAttributeSimilarityValidator,
+)
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 from faker import Faker
+from prometheus_client.registry import REGISTRY
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from core.middleware import ReplicaStickinessMiddleware
+from core.routers import PrimaryReplicaRouter
+from users import async_views, authentication, hashing, payloads, serializers
+from users.backends import EmailBackend
+from users.cache import LRUCache
+from users.hashers import TunedPBKDF2PasswordHasher
+from users.models import PhoneNumber
+from users.throttling import CacheBucketStore, LocalBucketStore, get_store
 
+from . import password_validation, sharding
 from .factory import TokenFactory, UserFactory, build_dict
 
 fake = Faker()
@@ -99,6 +138,19 @@ class UserLoginViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("token", response.data)
 
+    def test_user_login_queries(self):
+        """Test that login with an existing token takes a single query"""
+
+        url = reverse("login")
+        data = {"email": self.user.email, "password": "my_super_secret"}
+        # Selecting the user, then creating the token inside a savepoint.
+        with self.assertNumQueries(4):
+            first = self.client.post(url, data, format="json")
+        with self.assertNumQueries(1):
+            second = self.client.post(url, data, format="json")
+
+        self.assertEqual(first.data["token"], second.data["token"])
+
     def test_invalid_credentials(self):
         """Test with invalid credentials"""
 
@@ -152,3 +204,2356 @@ class EditUserViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["first_name"], "John")
         self.assertEqual(response.data["last_name"], "Doe")
+
+    def test_edit_keeps_newer_values(self):
+        """Test edit does not write back the values of a stale cached user"""
+
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+        self.client.get(reverse("details"))
+        # Changed by another process, whose change this process's cache missed.
+        User.objects.filter(pk=self.user.pk).update(phone="+15550199", is_active=False)
+
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"first_name": "John"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, "John")
+        self.assertEqual(user.phone, "+15550199")
+        self.assertFalse(user.is_active)
+
+    def test_edit_deleted_user(self):
+        """Test edit of a user deleted since its token was cached does not recreate it"""
+
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+        self.client.get(reverse("details"))
+        snapshot = authentication.token_cache.get(self.token.key)
+        self.user.delete()
+        authentication.token_cache.set(self.token.key, snapshot, group=self.user.pk)
+
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"first_name": "John"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(User.objects.exists())
+
+
+class BulkUserRegistrationViewTest(TestCase):
+    """Test bulk user registration"""
+
+    def setUp(self):
+        self.admin = UserFactory.create(is_staff=True)
+        self.admin.save()
+        self.token = TokenFactory(user=self.admin)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+
+    def test_bulk_user_registration(self):
+        """Test registering a batch of users"""
+
+        url = reverse("register-bulk")
+        data = [build_dict(UserFactory.build()) for _ in range(3)]
+        response = self.client.post(url, data, content_type="application/json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 3)
+        for row in data:
+            user = User.objects.get(email=row["email"])
+            self.assertTrue(user.check_password(row["password"]))
+
+    def test_bulk_user_registration_conflicts(self):
+        """Test rows conflicting with existing users and with each other"""
+
+        url = reverse("register-bulk")
+        valid = build_dict(UserFactory.build())
+        existing = build_dict(UserFactory.build(email=self.admin.email))
+        repeated = build_dict(UserFactory.build(phone=valid["phone"]))
+        invalid = build_dict(UserFactory.build(email="invalid-email"))
+        response = self.client.post(
+            url, [valid, existing, repeated, invalid], content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 1)
+        results = response.data["results"]
+        self.assertEqual(results[0]["status"], "created")
+        self.assertEqual(
+            results[1]["errors"], {"email": ["user with this email already exists."]}
+        )
+        self.assertEqual(
+            results[2]["errors"],
+            {"phone": ["This phone number is repeated in the batch."]},
+        )
+        self.assertEqual(
+            results[3]["errors"], {"email": ["Enter a valid email address."]}
+        )
+        self.assertFalse(User.objects.filter(email=repeated["email"]).exists())
+
+    def test_bulk_user_registration_query_count(self):
+        """Test that the number of queries does not grow with the batch size"""
+
+        url = reverse("register-bulk")
+        counts = []
+        self.client.get(reverse("details"))
+        for size in (2, 6):
+            data = [build_dict(UserFactory.build()) for _ in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data, content_type="application/json")
+            self.assertEqual(response.data["created"], size)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_user_registration_requires_admin(self):
+        """Test that regular users cannot register users in bulk"""
+
+        user = UserFactory.create()
+        user.save()
+        token = TokenFactory(user=user, key="b" * 40)
+        token.save()
+
+        url = reverse("register-bulk")
+        data = [build_dict(UserFactory.build())]
+        response = self.client.post(
+            url,
+            data,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PasswordHashingExecutorTest(TestCase):
+    """Test the password hashing executor"""
+
+    def test_verify_password(self):
+        """Test verifying passwords in the pool records wait and compute time"""
+
+        executor = hashing.get_executor()
+        before = executor.stats()
+        encoded = make_password("my_super_secret")
+
+        self.assertEqual(
+            hashing.verify_password("my_super_secret", encoded), (True, False)
+        )
+        self.assertEqual(hashing.verify_password("wrong", encoded), (False, False))
+
+        after = executor.stats()
+        self.assertEqual(after["completed"] - before["completed"], 2)
+        self.assertGreater(after["compute_seconds"], before["compute_seconds"])
+        self.assertGreaterEqual(after["wait_seconds"], before["wait_seconds"])
+        self.assertEqual(after["in_flight"], 0)
+
+    def test_saturated_executor_rejects(self):
+        """Test that jobs are shed once every slot is taken"""
+
+        executor = hashing.PasswordHashingExecutor(
+            workers=1, max_pending=0, queue_timeout=0
+        )
+        executor._slots.acquire()  # pylint: disable=protected-access
+
+        with self.assertRaises(hashing.HashingUnavailable):
+            executor.run(make_password, "my_super_secret")
+        self.assertEqual(executor.stats()["rejected"], 1)
+
+    def test_shutdown_with_pending_job(self):
+        """Test shutdown waits for a running job without deadlocking its callback"""
+
+        executor = hashing.PasswordHashingExecutor(
+            workers=1, max_pending=0, queue_timeout=1
+        )
+        future = executor.submit(time.sleep, 0.5)
+        shutdown = threading.Thread(target=executor.shutdown, daemon=True)
+        shutdown.start()
+        shutdown.join(timeout=30)
+
+        self.assertFalse(shutdown.is_alive())
+        self.assertIsNone(future.result(timeout=1))
+        self.assertEqual(executor.stats()["completed"], 1)
+
+    def test_prometheus_metrics(self):
+        """Test that jobs are exported as Prometheus metrics"""
+
+        def sample(name, labels=None):
+            return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+        completed = sample("password_hashing_jobs_total", {"outcome": "completed"})
+        compute = sample("password_hashing_compute_seconds_count")
+        wait = sample("password_hashing_wait_seconds_count")
+
+        hashing.make_password("my_super_secret")
+
+        self.assertEqual(
+            sample("password_hashing_jobs_total", {"outcome": "completed"}),
+            completed + 1,
+        )
+        self.assertEqual(sample("password_hashing_compute_seconds_count"), compute + 1)
+        self.assertEqual(sample("password_hashing_wait_seconds_count"), wait + 1)
+        self.assertEqual(sample("password_hashing_in_flight"), 0)
+
+    def test_saturated_login(self):
+        """Test that login answers 503 while the hashing pool is saturated"""
+
+        user = UserFactory.create()
+        user.save()
+        executor = hashing.PasswordHashingExecutor(
+            workers=1, max_pending=0, queue_timeout=0
+        )
+        executor._slots.acquire()  # pylint: disable=protected-access
+
+        url = reverse("login")
+        data = {"email": user.email, "password": "my_super_secret"}
+        with mock.patch.object(hashing, "get_executor", return_value=executor):
+            response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "1")
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """Test the token authentication cache"""
+
+    def setUp(self):
+        authentication.token_cache.clear()
+        self.user = UserFactory.create()
+        self.user.save()
+        self.token = TokenFactory(user=self.user)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+
+    def test_cache_hit_skips_database(self):
+        """Test that a cached token authenticates without queries"""
+
+        url = reverse("details")
+        self.client.get(url)
+        before = authentication.token_cache.stats()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["email"], self.user.email)
+        self.assertEqual(authentication.token_cache.stats()["hits"], before["hits"] + 1)
+
+    def test_user_save_invalidates(self):
+        """Test that editing the user drops the cached snapshot"""
+
+        self.client.get(reverse("details"))
+        self.client.patch(
+            reverse("edit-profile"),
+            {"first_name": "John"},
+            content_type="application/json",
+        )
+        response = self.client.get(reverse("details"))
+
+        self.assertEqual(response.data["first_name"], "John")
+
+    def test_token_delete_invalidates(self):
+        """Test that a deleted token stops authenticating"""
+
+        url = reverse("details")
+        self.client.get(url)
+        self.token.delete()
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_lru_cache_bounds(self):
+        """Test eviction of the least recently used and of expired entries"""
+
+        cache = LRUCache(max_entries=2, ttl=60)
+        cache.set("a", 1, group=1)
+        cache.set("b", 2, group=1)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        cache.delete_group(1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), 3)
+
+        expired = LRUCache(max_entries=2, ttl=0)
+        expired.set("a", 1)
+        self.assertIsNone(expired.get("a"))
+
+
+class CaseInsensitiveEmailTest(TestCase):
+    """Test case-insensitive handling of emails"""
+
+    def test_registration_lowercases_email(self):
+        """Test that registered emails are stored lowercased"""
+
+        url = reverse("register")
+        data = build_dict(UserFactory.build(email="John.Doe@Example.COM"))
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(User.objects.filter(email="john.doe@example.com").exists())
+
+    def test_duplicate_email_other_case(self):
+        """Test that an email differing only in case is a duplicate"""
+
+        existing_user = UserFactory.create(email="john.doe@example.com")
+        existing_user.save()
+
+        url = reverse("register")
+        data = build_dict(UserFactory.build(email="JOHN.DOE@example.com"))
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        expected_error = {"email": ["user with this email already exists."]}
+        self.assertDictEqual(response.data, expected_error)
+
+    def test_login_any_case(self):
+        """Test login with an email in another case, without an UPPER() lookup"""
+
+        user = UserFactory.create(email="john.doe@example.com")
+        user.save()
+
+        url = reverse("login")
+        data = {"email": "John.Doe@EXAMPLE.com", "password": "my_super_secret"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("UPPER(", queries[0]["sql"])
+
+    def test_login_email_not_a_string(self):
+        """Test that an email which is not a string fails like an unknown one"""
+
+        url = reverse("login")
+        for email in (42, ["john.doe@example.com"], {"email": "x"}):
+            response = self.client.post(
+                url,
+                {"email": email, "password": "my_super_secret"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key(42)
+        with self.assertRaises(ValueError):
+            User.objects.create_user(email=42, password="my_super_secret")
+
+    def test_database_rejects_uppercase_email(self):
+        """Test that the database refuses emails which are not lowercased"""
+
+        user = UserFactory.build(email="John.Doe@example.com")
+        with self.assertRaises(IntegrityError):
+            user.save()
+
+
+class UserExportViewTest(TestCase):
+    """Test the user export"""
+
+    def setUp(self):
+        self.admin = UserFactory.create(is_staff=True)
+        self.admin.save()
+        self.token = TokenFactory(user=self.admin)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+        self.users = [UserFactory.create() for _ in range(3)]
+        for user in self.users:
+            user.save()
+
+    def test_export_ndjson(self):
+        """Test exporting users as NDJSON"""
+
+        response = self.client.get(reverse("export"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            rows[1],
+            {
+                "first_name": self.users[0].first_name,
+                "last_name": self.users[0].last_name,
+                "email": self.users[0].email,
+                "phone": self.users[0].phone,
+            },
+        )
+
+    def test_export_csv(self):
+        """Test exporting users as CSV"""
+
+        response = self.client.get(reverse("export"), {"output": "csv"})
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ["first_name", "last_name", "email", "phone"])
+        self.assertEqual(len(rows), 5)
+
+    def test_export_updated_since(self):
+        """Test exporting only recently changed users"""
+
+        User.objects.exclude(pk=self.users[2].pk).update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        response = self.client.get(reverse("export"), {"updated_since": since})
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["email"], self.users[2].email)
+
+    def test_export_invalid_parameters(self):
+        """Test exporting with an unknown format or an invalid date"""
+
+        response = self.client.get(reverse("export"), {"output": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse("export"), {"updated_since": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_out_of_range_date(self):
+        """Test exporting with a well formatted date out of range"""
+
+        for since in ("2024-13-01T00:00:00", "2024-02-30T00:00:00", "2024-01-01T25:00"):
+            response = self.client.get(reverse("export"), {"updated_since": since})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(
+                response.data,
+                {"error": "updated_since must be an ISO 8601 date and time."},
+            )
+
+    async def test_export_asgi(self):
+        """Test exporting through an async iterator under ASGI"""
+
+        def export():
+            response = self.client.get(reverse("export"), {"output": "csv"})
+            return b"".join(response.streaming_content)
+
+        expected = await sync_to_async(export)()
+        headers = {"authorization": f"Token {self.token.key}"}
+
+        with override_settings(SERVER_MODE="asgi", USER_EXPORT_CHUNK_SIZE=2):
+            response = await self.async_client.get(
+                reverse("export"), {"output": "csv"}, headers=headers
+            )
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(b"".join(chunks), expected)
+
+    def test_export_requires_admin(self):
+        """Test that regular users cannot export users"""
+
+        token = TokenFactory(user=self.users[0], key="e" * 40)
+        token.save()
+        response = self.client.get(
+            reverse("export"), HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ImportUsersCommandTest(TestCase):
+    """Test the import_users management command"""
+
+    def write_input(self, suffix, content):
+        """Write content to a temporary input file"""
+
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, "w") as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_csv(self):
+        """Test importing users from CSV with conflict reporting"""
+
+        existing_user = UserFactory.create()
+        existing_user.save()
+        path = self.write_input(
+            ".csv",
+            "email,phone,first_name,last_name,password\n"
+            "Jane.Doe@Example.com,+15550001,Jane,Doe,secret-pass-1\n"
+            f"{existing_user.email},+15550002,John,Doe,secret-pass-2\n"
+            "joe@example.com,+15550001,Joe,Doe,secret-pass-3\n"
+            "not-an-email,+15550004,Jim,Doe,secret-pass-4\n",
+        )
+        conflicts = path + ".conflicts"
+        self.addCleanup(os.remove, conflicts)
+
+        out = io.StringIO()
+        call_command("import_users", path, conflicts=conflicts, stdout=out)
+
+        self.assertIn("Imported 1 of 4 users, rejected 3.", out.getvalue())
+        user = User.objects.get(email="jane.doe@example.com")
+        self.assertTrue(user.check_password("secret-pass-1"))
+        self.assertTrue(user.is_active)
+        with open(conflicts, newline="") as stream:
+            reasons = {
+                int(row["line"]): row["reason"] for row in csv.DictReader(stream)
+            }
+        self.assertEqual(reasons[3], "email taken")
+        self.assertEqual(reasons[4], "phone taken")
+        self.assertTrue(reasons[5].startswith("invalid"))
+
+    def test_import_prehashed_ndjson(self):
+        """Test importing users with encoded passwords from NDJSON"""
+
+        encoded = make_password("secret-pass")
+        rows = [
+            {
+                "email": f"user{index}@example.com",
+                "phone": f"+1555000{index}",
+                "first_name": "User",
+                "last_name": str(index),
+                "password": encoded,
+            }
+            for index in range(5)
+        ]
+        path = self.write_input(
+            ".ndjson", "".join(json.dumps(row) + "\n" for row in rows)
+        )
+
+        out = io.StringIO()
+        call_command("import_users", path, prehashed=True, chunk_size=2, stdout=out)
+
+        self.assertIn("Imported 5 of 5 users, rejected 0.", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        user = User.objects.get(email="user3@example.com")
+        self.assertEqual(user.password, encoded)
+
+
+class AsyncUserViewsTest(TestCase):
+    """Test the async user views"""
+
+    def setUp(self):
+        authentication.token_cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.user = UserFactory.create()
+        self.user.save()
+        self.token = TokenFactory(user=self.user)
+        self.token.save()
+        self.auth = f"Token {self.token.key}"
+
+    async def test_login(self):
+        """Test login returns the existing token"""
+
+        view = async_views.AsyncUserLoginView.as_view()
+        data = {"email": self.user.email.upper(), "password": "my_super_secret"}
+        request = self.factory.post("/", data, content_type="application/json")
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {"token": self.token.key})
+
+        data["password"] = fake.password()
+        request = self.factory.post("/", data, content_type="application/json")
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("error", json.loads(response.content))
+
+    async def test_login_creates_token(self):
+        """Test login creates a token for a user without one"""
+
+        await self.token.adelete()
+        view = async_views.AsyncUserLoginView.as_view()
+        data = {"email": self.user.email, "password": "my_super_secret"}
+        request = self.factory.post("/", data, content_type="application/json")
+        response = await view(request)
+
+        token = json.loads(response.content)["token"]
+        self.assertTrue(await Token.objects.filter(key=token, user=self.user).aexists())
+
+    async def test_details(self):
+        """Test details match the sync view and need a token"""
+
+        view = async_views.AsyncUserDetailsView.as_view()
+        response = await view(
+            self.factory.get("/", headers={"authorization": self.auth})
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["email"], self.user.email)
+
+        response = await view(self.factory.get("/"))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+        response = await view(
+            self.factory.get("/", headers={"authorization": "Token x"})
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_edit(self):
+        """Test edit saves the changes and rejects invalid data"""
+
+        view = async_views.AsyncEditUserView.as_view()
+        request = self.factory.patch(
+            "/",
+            {"first_name": "John", "password": "new_secret_123"},
+            content_type="application/json",
+            headers={"authorization": self.auth},
+        )
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["first_name"], "John")
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertEqual(user.first_name, "John")
+        self.assertTrue(user.check_password("new_secret_123"))
+
+        request = self.factory.patch(
+            "/",
+            {"email": "not an email"},
+            content_type="application/json",
+            headers={"authorization": self.auth},
+        )
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", json.loads(response.content))
+
+    async def test_edit_keeps_newer_values(self):
+        """Test edit does not write back the values of a stale cached user"""
+
+        details = async_views.AsyncUserDetailsView.as_view()
+        await details(self.factory.get("/", headers={"authorization": self.auth}))
+        await User.objects.filter(pk=self.user.pk).aupdate(phone="+15550199")
+
+        view = async_views.AsyncEditUserView.as_view()
+
+        request = self.factory.patch(
+            "/",
+            {"first_name": "John"},
+            content_type="application/json",
+            headers={"authorization": self.auth},
+        )
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["phone"], "+15550199")
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertEqual((user.first_name, user.phone), ("John", "+15550199"))
+
+
+class UserListViewTest(TestCase):
+    """Test the keyset-paginated user list"""
+
+    def setUp(self):
+        self.admin = UserFactory.create(is_staff=True, email="admin@example.com")
+        self.admin.save()
+        self.token = TokenFactory(user=self.admin)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+        # Users imported together share date_joined, the pagination must not skip ties.
+        joined = timezone.now() - timedelta(days=1)
+        self.users = [
+            UserFactory.create(
+                email=f"user{index}@example.com",
+                date_joined=joined,
+                is_active=index % 2 == 0,
+            )
+            for index in range(7)
+        ]
+        for user in self.users:
+            user.save()
+
+    def test_pages_cover_every_user_once(self):
+        """Test that following next visits every user once, newest first"""
+
+        url = f"{reverse('list')}?page_size=3"
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 3)
+            seen.extend(row["id"] for row in response.data["results"])
+            url = response.data["next"]
+
+        expected = [self.admin.pk] + [user.pk for user in reversed(self.users)]
+        self.assertEqual(seen, expected)
+
+    def test_page_queries(self):
+        """Test that a later page takes as many queries as the first"""
+
+        url = f"{reverse('list')}?page_size=2"
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(url)
+        third = self.client.get(response.data["next"]).data["next"]
+        with CaptureQueriesContext(connection) as later:
+            self.client.get(third)
+
+        self.assertEqual(len(later.captured_queries), len(first.captured_queries))
+        self.assertNotIn("OFFSET", later.captured_queries[-1]["sql"])
+
+    def test_filters(self):
+        """Test the is_active and email prefix filters"""
+
+        response = self.client.get(reverse("list"), {"is_active": "false"})
+        self.assertEqual(
+            [row["id"] for row in response.data["results"]],
+            [user.pk for user in reversed(self.users) if not user.is_active],
+        )
+
+        response = self.client.get(reverse("list"), {"email": "USER1"})
+        self.assertEqual(
+            [row["email"] for row in response.data["results"]], ["user1@example.com"]
+        )
+
+        response = self.client.get(reverse("list"), {"is_active": "maybe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+
+        response = self.client.get(reverse("list"), {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_admin_only(self):
+        """Test that regular users cannot list users"""
+
+        token = Token.objects.create(user=self.users[0])
+        response = self.client.get(
+            reverse("list"), HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MetricsMiddlewareTest(TestCase):
+    """Test the request metrics"""
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.user.save()
+        self.token = TokenFactory(user=self.user)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+
+    def sample(self, name, view="details", method="GET"):
+        return REGISTRY.get_sample_value(name, {"view": view, "method": method}) or 0
+
+    def test_request_metrics(self):
+        """Test that a request records its latency, queries, SQL time and size"""
+
+        requests = self.sample("http_request_db_queries_count")
+        queries = self.sample("http_request_db_queries_sum")
+        sql_time = self.sample("http_request_db_duration_seconds_sum")
+        size = self.sample("http_response_size_bytes_sum")
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse("details"))
+
+        self.assertEqual(self.sample("http_request_db_queries_count"), requests + 1)
+        self.assertEqual(
+            self.sample("http_request_db_queries_sum"),
+            queries + len(captured.captured_queries),
+        )
+        self.assertGreater(
+            self.sample("http_request_db_duration_seconds_sum"), sql_time
+        )
+        self.assertEqual(
+            self.sample("http_response_size_bytes_sum"), size + len(response.content)
+        )
+        latency = REGISTRY.get_sample_value(
+            "http_request_duration_seconds_count",
+            {"view": "details", "method": "GET", "status": "200"},
+        )
+        self.assertGreaterEqual(latency, 1)
+
+    @override_settings(SERVICE_CREDENTIALS=["scraper-secret"])
+    def test_metrics_endpoint(self):
+        """Test that the metrics are exposed in the Prometheus text format"""
+
+        self.client.get(reverse("details"))
+        response = self.client.get(
+            reverse("metrics"), headers={"x-service-credential": "scraper-secret"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            b'http_request_db_queries_count{method="GET",view="details"}',
+            response.content,
+        )
+
+    @override_settings(SERVICE_CREDENTIALS=["scraper-secret"])
+    def test_metrics_require_service_credential(self):
+        """Test that only services with a credential may scrape the metrics"""
+
+        url = reverse("metrics")
+        for headers in (
+            {},
+            {"authorization": f"Token {self.token.key}"},
+            {"x-service-credential": "wrong"},
+            {"authorization": "Bearer wrong"},
+        ):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            self.assertNotIn(b"http_request", response.content)
+
+        response = self.client.get(
+            url, headers={"authorization": "Bearer scraper-secret"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ConditionalUserDetailsTest(TestCase):
+    """Test ETag, Last-Modified and cached payloads of user details"""
+
+    def setUp(self):
+        authentication.token_cache.clear()
+        payloads.payload_cache.clear()
+        self.user = UserFactory.create()
+        self.user.save()
+        self.token = TokenFactory(user=self.user)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+
+    def test_version_bumped_on_save(self):
+        """Test that every save, even of some fields, increments the version"""
+
+        version = self.user.version
+        self.user.first_name = "John"
+        self.user.save(update_fields=["first_name"])
+        self.user.refresh_from_db()
+
+        self.assertEqual(self.user.version, version + 1)
+
+    def test_stale_saves_get_distinct_versions(self):
+        """Test that saves of stale copies of a user never reuse a version"""
+
+        first = User.objects.get(pk=self.user.pk)
+        second = User.objects.get(pk=self.user.pk)
+        first.first_name = "John"
+        first.save()
+        second.last_name = "Doe"
+        second.save(update_fields=["last_name"])
+
+        self.assertEqual(second.version, first.version + 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).version, second.version)
+        self.assertNotEqual(payloads.user_etag(first), payloads.user_etag(second))
+
+    def test_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 without serializing"""
+
+        response = self.client.get(reverse("details"))
+        etag = response["ETag"]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with mock.patch.object(
+            serializers.CompiledReadSerializer, "to_representation"
+        ) as to_representation, self.assertNumQueries(0):
+            response = self.client.get(reverse("details"), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        to_representation.assert_not_called()
+
+    def test_cached_payload(self):
+        """Test that unconditional reads of an unchanged user are not serialized again"""
+
+        first = self.client.get(reverse("details"))
+        with mock.patch.object(
+            serializers.CompiledReadSerializer, "to_representation"
+        ) as to_representation:
+            second = self.client.get(reverse("details"))
+
+        to_representation.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Content-Type"], "application/json")
+        self.assertEqual(json.loads(second.content)["email"], self.user.email)
+
+    def test_update_changes_etag(self):
+        """Test that editing the user invalidates the client's copy"""
+
+        etag = self.client.get(reverse("details"))["ETag"]
+        self.client.patch(
+            reverse("edit-profile"),
+            {"first_name": "John"},
+            content_type="application/json",
+        )
+        response = self.client.get(reverse("details"), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(json.loads(response.content)["first_name"], "John")
+
+
+class CompiledReadSerializerTest(TestCase):
+    """Test the compiled read serializers"""
+
+    def setUp(self):
+        self.users = [
+            UserFactory.create(first_name="Zoë", last_name='O\'Brien "Jr"'),
+            UserFactory.create(is_active=False),
+        ]
+        for user in self.users:
+            user.save()
+
+    def test_same_bytes(self):
+        """Test that compiled and DRF serializers render to the same bytes"""
+
+        renderer = JSONRenderer()
+        for serializer_class, compiled in (
+            (serializers.UserSerializer, serializers.user_read_serializer),
+            (serializers.UserListSerializer, serializers.user_list_read_serializer),
+        ):
+            with self.subTest(serializer=serializer_class.__name__):
+                for user in self.users:
+                    self.assertEqual(
+                        renderer.render(compiled.to_representation(user)),
+                        renderer.render(serializer_class(user).data),
+                    )
+                self.assertEqual(
+                    renderer.render(compiled.many(self.users)),
+                    renderer.render(serializer_class(self.users, many=True).data),
+                )
+
+    def test_list_view(self):
+        """Test that the user list renders like UserListSerializer"""
+
+        admin = UserFactory.create(is_staff=True)
+        admin.save()
+        token = Token.objects.create(user=admin)
+        response = self.client.get(
+            reverse("list"), HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+
+        users = User.objects.order_by("-date_joined", "-id")
+        expected = serializers.UserListSerializer(users, many=True).data
+        self.assertEqual(
+            json.loads(response.content)["results"],
+            json.loads(JSONRenderer().render(expected)),
+        )
+
+
+class BulkUserUpdateViewTest(TestCase):
+    """Test bulk user updates"""
+
+    def setUp(self):
+        self.admin = UserFactory.create(is_staff=True)
+        self.admin.save()
+        self.token = TokenFactory(user=self.admin)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+        self.users = [UserFactory.create() for _ in range(3)]
+        for user in self.users:
+            user.save()
+
+    def patch(self, rows):
+        return self.client.patch(
+            reverse("bulk-update"), rows, content_type="application/json"
+        )
+
+    def test_bulk_update(self):
+        """Test updating a batch of users with a few queries"""
+
+        rows = [
+            {"id": user.pk, "phone": f"+1555010{index}", "last_name": "Renamed"}
+            for index, user in enumerate(self.users)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(rows)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 3)
+        # Lock and read, conflict check, one UPDATE, plus the savepoint.
+        self.assertLessEqual(len(queries.captured_queries), 6)
+        for index, user in enumerate(self.users):
+            version = user.version
+            user.refresh_from_db()
+            self.assertEqual(user.phone, f"+1555010{index}")
+            self.assertEqual(user.last_name, "Renamed")
+            self.assertEqual(user.version, version + 1)
+
+    def test_bulk_update_conflicts(self):
+        """Test rows conflicting with the table, with each other, or invalid"""
+
+        first, second, third = self.users
+        response = self.patch(
+            [
+                {"id": first.pk, "email": second.email.upper()},
+                {"id": second.pk, "phone": "+15550199"},
+                {"id": third.pk, "phone": "+15550199"},
+                {"id": first.pk, "first_name": "Twice"},
+                {"id": 0, "first_name": "Missing"},
+                {"id": third.pk, "password": "not-in-bulk"},
+                {"id": self.admin.pk, "email": self.admin.email, "first_name": "Same"},
+            ]
+        )
+
+        results = response.data["results"]
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(
+            results[0]["errors"], {"email": ["user with this email already exists."]}
+        )
+        self.assertEqual(results[1]["status"], "updated")
+        self.assertEqual(
+            results[2]["errors"],
+            {"phone": ["This phone number is repeated in the batch."]},
+        )
+        self.assertEqual(
+            results[3]["errors"], {"id": ["This user is repeated in the batch."]}
+        )
+        self.assertEqual(results[4]["errors"], {"id": ["User not found."]})
+        self.assertIn("password", results[5]["errors"])
+        self.assertEqual(results[6]["status"], "updated")
+        self.admin.refresh_from_db()
+        self.assertEqual(self.admin.first_name, "Same")
+
+    def test_bulk_update_invalidates_tokens(self):
+        """Test that updated users are not served from the token cache"""
+
+        token = Token.objects.create(user=self.users[0])
+        auth = f"Token {token.key}"
+        self.client.get(reverse("details"), HTTP_AUTHORIZATION=auth)
+        self.patch([{"id": self.users[0].pk, "first_name": "Fresh"}])
+        response = self.client.get(reverse("details"), HTTP_AUTHORIZATION=auth)
+
+        self.assertEqual(response.data["first_name"], "Fresh")
+
+    def test_admin_only(self):
+        """Test that regular users cannot update users in bulk"""
+
+        token = Token.objects.create(user=self.users[0])
+        response = self.client.patch(
+            reverse("bulk-update"),
+            [{"id": self.users[1].pk, "first_name": "Hacked"}],
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SeedUsersCommandTest(TestCase):
+    """Test the seed_users command"""
+
+    def seed(self, **options):
+        call_command("seed_users", stdout=io.StringIO(), **options)
+        return list(
+            User.objects.order_by("phone").values_list(
+                "email", "phone", "first_name", "date_joined", "auth_token__key"
+            )
+        )
+
+    def test_seed_users(self):
+        """Test that users and tokens are created in batches"""
+
+        rows = self.seed(count=25, batch_size=10)
+
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(Token.objects.count(), 25)
+        user = User.objects.get(email=rows[0][0])
+        self.assertTrue(user.check_password("my_super_secret"))
+        self.assertTrue(user.is_active)
+        self.assertEqual(user.version, 1)
+        self.assertEqual(len({row[0] for row in rows}), 25)
+
+    def test_deterministic(self):
+        """Test that a seed always produces the same users, whatever the batch size"""
+
+        first = self.seed(count=12, batch_size=12, seed=3)
+        User.objects.all().delete()
+        second = self.seed(count=12, batch_size=12, seed=3)
+        User.objects.all().delete()
+        other = self.seed(count=12, batch_size=12, seed=4)
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+
+    def test_offset(self):
+        """Test adding users after an earlier seeding"""
+
+        self.seed(count=5)
+        with self.assertRaises(CommandError):
+            self.seed(count=5)
+        rows = self.seed(count=5, offset=5, no_tokens=True)
+
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(Token.objects.count(), 5)
+
+
+class PasswordUpgradeTest(TestCase):
+    """Test tuned hashers and the upgrade of outdated hashes on login"""
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.user.save()
+        hasher = TunedPBKDF2PasswordHasher(iterations=1000)
+        self.outdated = hasher.encode("my_super_secret", hasher.salt())
+        User.objects.filter(pk=self.user.pk).update(password=self.outdated)
+        self.user.refresh_from_db()
+        self.data = {"email": self.user.email, "password": "my_super_secret"}
+
+    def assert_upgraded(self):
+        user = User.objects.get(pk=self.user.pk)
+        algorithm, iterations, _ = user.password.split("$", 2)
+        self.assertEqual(algorithm, "pbkdf2_sha256")
+        self.assertEqual(int(iterations), settings.PBKDF2_ITERATIONS)
+        self.assertTrue(user.check_password("my_super_secret"))
+        # Only the password is written.
+        self.assertEqual(user.version, self.user.version)
+        self.assertEqual(user.updated_at, self.user.updated_at)
+
+    def test_hasher_settings(self):
+        """Test that the tuned hashers take their costs from the settings"""
+
+        with self.settings(PBKDF2_ITERATIONS=1234):
+            self.assertEqual(TunedPBKDF2PasswordHasher().iterations, 1234)
+        self.assertEqual(TunedPBKDF2PasswordHasher(iterations=10).iterations, 10)
+
+    def test_login_upgrades_hash(self):
+        """Test that login hashes an outdated password again, writing only the password"""
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("login"), self.data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertRegex(updates[0], r'^UPDATE "users_user" SET "password" = \S+ WHERE')
+        self.assert_upgraded()
+
+        # The upgraded hash is current, logging in again writes nothing.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse("login"), self.data, format="json")
+        self.assertFalse(any(q["sql"].startswith("UPDATE") for q in queries))
+
+    def test_upgrade_drops_cached_tokens(self):
+        """Test that the upgrade drops cached snapshots holding the outdated hash"""
+
+        authentication.token_cache.clear()
+        token = TokenFactory(user=self.user, key=get_random_string(40))
+        token.save()
+        auth = f"Token {token.key}"
+        self.client.get(reverse("details"), HTTP_AUTHORIZATION=auth)
+        self.assertIsNotNone(authentication.token_cache.get(token.key))
+
+        self.client.post(reverse("login"), self.data, format="json")
+
+        self.assertIsNone(authentication.token_cache.get(token.key))
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"first_name": "John"},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=auth,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(User.objects.get(pk=self.user.pk).password, self.outdated)
+
+    def test_async_upgrade_drops_cached_tokens_on_commit(self):
+        """Test that the async upgrade drops the tokens cached before it commits too"""
+
+        authentication.token_cache.clear()
+        token = TokenFactory(user=self.user, key=get_random_string(40))
+        token.save()
+        auth = f"Token {token.key}"
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            async_to_sync(hashing.aupgrade_password)(self.user, "my_super_secret")
+            # Cached from the outdated hash by a request reading before the commit.
+            self.client.get(reverse("details"), HTTP_AUTHORIZATION=auth)
+            self.assertIsNotNone(authentication.token_cache.get(token.key))
+
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertIsNone(authentication.token_cache.get(token.key))
+
+    def test_failed_login_keeps_hash(self):
+        """Test that a wrong password does not upgrade the hash"""
+
+        self.data["password"] = fake.password()
+        response = self.client.post(reverse("login"), self.data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(User.objects.get(pk=self.user.pk).password, self.outdated)
+
+    async def test_async_login_upgrades_hash(self):
+        """Test that the async login upgrades the hash too"""
+
+        view = async_views.AsyncUserLoginView.as_view()
+        request = AsyncRequestFactory().post(
+            "/", self.data, content_type="application/json"
+        )
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        await sync_to_async(self.assert_upgraded)()
+
+    def test_calibrate_hashers(self):
+        """Test that the calibration suggests iterations for the target duration"""
+
+        stdout = io.StringIO()
+        call_command(
+            "calibrate_hashers", hasher="pbkdf2", target_ms=5, rounds=1, stdout=stdout
+        )
+
+        self.assertRegex(stdout.getvalue(), r"PBKDF2_ITERATIONS=\d+0000")
+
+
+class LoginThrottleTest(TestCase):
+    """Test the login throttles"""
+
+    def setUp(self):
+        get_store().clear()
+        self.addCleanup(get_store().clear)
+        self.user = UserFactory.create()
+        self.user.save()
+        self.url = reverse("login")
+
+    def login(self, email, password="wrong-password"):
+        data = {"email": email, "password": password}
+        return self.client.post(self.url, data, format="json")
+
+    def test_email_throttle(self):
+        """Test that excess attempts for an email are rejected before any work"""
+
+        with self.settings(
+            LOGIN_THROTTLE_EMAIL_BURST=2, LOGIN_THROTTLE_EMAIL_RATE=0.01
+        ):
+            for _ in range(2):
+                response = self.login(self.user.email)
+                self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+            with mock.patch.object(hashing, "verify_password") as verify:
+                with self.assertNumQueries(0):
+                    response = self.login(self.user.email.upper(), "my_super_secret")
+            other = self.login(fake.email())
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "100")
+        verify.assert_not_called()
+        self.assertEqual(other.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ip_throttle(self):
+        """Test that excess attempts from an IP are rejected, whatever the email"""
+
+        with self.settings(LOGIN_THROTTLE_IP_BURST=1, LOGIN_THROTTLE_IP_RATE=0.5):
+            first = self.login(self.user.email, "my_super_secret")
+            second = self.login(fake.email())
+            other_ip = self.client.post(
+                self.url,
+                {"email": fake.email(), "password": "x"},
+                REMOTE_ADDR="10.0.0.2",
+            )
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(second["Retry-After"], "2")
+        self.assertEqual(other_ip.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ip_throttle_ignores_forwarded_for(self):
+        """Test that addresses sent in X-Forwarded-For do not give new buckets"""
+
+        with self.settings(LOGIN_THROTTLE_IP_BURST=2, LOGIN_THROTTLE_IP_RATE=0.01):
+            responses = [
+                self.client.post(
+                    self.url,
+                    {"email": fake.email(), "password": "x"},
+                    REMOTE_ADDR="10.0.0.3",
+                    HTTP_X_FORWARDED_FOR=f"203.0.113.{number}",
+                )
+                for number in range(3)
+            ]
+
+        self.assertEqual(
+            [response.status_code for response in responses],
+            [status.HTTP_401_UNAUTHORIZED] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS],
+        )
+
+    def test_unknown_email_checks_password(self):
+        """Test that an unknown email costs a password check like a wrong password"""
+
+        with mock.patch.object(
+            hashing, "verify_password", wraps=hashing.verify_password
+        ) as verify:
+            response = self.login(fake.email())
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        verify.assert_called_once()
+
+    def test_stores(self):
+        """Test that both stores refill buckets at their rate"""
+
+        for store in (
+            LocalBucketStore(max_entries=2),
+            CacheBucketStore("default"),
+        ):
+            with self.subTest(store=type(store).__name__):
+                self.assertEqual(store.consume("a", 2, 1), 0)
+                self.assertEqual(store.consume("a", 2, 1), 0)
+                self.assertGreater(store.consume("a", 2, 1), 0.9)
+                self.assertEqual(store.consume("b", 2, 1), 0)
+                store.clear()
+                self.assertEqual(store.consume("a", 2, 1), 0)
+
+    def test_local_store_eviction(self):
+        """Test that the least recently used buckets are dropped"""
+
+        store = LocalBucketStore(max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            store.consume(key, 1, 0.001)
+
+        # "a" was used again after "b", so "b" was dropped for "c".
+        self.assertGreater(store.consume("a", 1, 0.001), 0)
+        self.assertEqual(store.consume("b", 1, 0.001), 0)
+
+    async def test_async_login_throttle(self):
+        """Test that the async login is throttled too"""
+
+        view = async_views.AsyncUserLoginView.as_view()
+        data = {"email": self.user.email, "password": "my_super_secret"}
+        with self.settings(LOGIN_THROTTLE_EMAIL_BURST=1, LOGIN_THROTTLE_EMAIL_RATE=0.1):
+            responses = [
+                await view(
+                    AsyncRequestFactory().post(
+                        "/", data, content_type="application/json"
+                    )
+                )
+                for _ in range(2)
+            ]
+
+        self.assertEqual(responses[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(responses[1].status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(responses[1]["Retry-After"], "10")
+
+
+class DatabaseConnectionMetricsTest(TestCase):
+    """Test the metrics of the database backend"""
+
+    def setUp(self):
+        # A connection of its own, outside of the transaction of the test.
+        self.wrapper = connections.create_connection("default")
+        self.addCleanup(self.wrapper.close)
+
+    def sample(self, name):
+        return REGISTRY.get_sample_value(name, {"alias": "default"}) or 0
+
+    def test_connection_metrics(self):
+        """Test that opening and closing connections is recorded"""
+
+        opened = self.sample("db_connection_setup_seconds_count")
+        open_connections = self.sample("db_connections_open")
+
+        self.wrapper.ensure_connection()
+        self.assertEqual(self.sample("db_connection_setup_seconds_count"), opened + 1)
+        self.assertEqual(self.sample("db_connections_open"), open_connections + 1)
+        self.assertEqual(
+            self.wrapper.settings_dict["CONN_MAX_AGE"], settings.DB_CONN_MAX_AGE
+        )
+
+        self.wrapper.close()
+        self.assertEqual(self.sample("db_connections_open"), open_connections)
+        self.assertEqual(
+            self.sample("db_connections_max"), settings.DB_CONNECTIONS_PER_WORKER
+        )
+
+    def test_connection_wait_time(self):
+        """Test that the first query of a request records its wait for a connection"""
+
+        waits = self.sample("db_connection_wait_seconds_count")
+
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertEqual(self.sample("db_connection_wait_seconds_count"), waits + 1)
+
+        # Later queries of the request use the checked connection.
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertEqual(self.sample("db_connection_wait_seconds_count"), waits + 1)
+
+        # The next request checks the persistent connection again.
+        self.wrapper.health_check_done = False
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertEqual(self.sample("db_connection_wait_seconds_count"), waits + 2)
+
+    def test_health_check_failure(self):
+        """Test that an unusable persistent connection is closed and counted"""
+
+        failures = self.sample("db_health_check_failures_total")
+        self.wrapper.ensure_connection()
+        self.wrapper.health_check_done = False
+
+        with mock.patch.object(self.wrapper, "is_usable", return_value=False):
+            self.wrapper.close_if_health_check_failed()
+
+        self.assertIsNone(self.wrapper.connection)
+        self.assertEqual(self.sample("db_health_check_failures_total"), failures + 1)
+
+        # A healthy connection is kept.
+        self.wrapper.ensure_connection()
+        self.wrapper.health_check_done = False
+        self.wrapper.close_if_health_check_failed()
+        self.assertIsNotNone(self.wrapper.connection)
+        self.assertEqual(self.sample("db_health_check_failures_total"), failures + 1)
+
+
+class SessionlessMiddlewareTest(TestCase):
+    """Test that API requests skip the session, CSRF, auth and message middleware"""
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.user.save()
+        self.token = TokenFactory(user=self.user)
+        self.token.save()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+
+    def test_api_request(self):
+        """Test that an API request gets no session, session user or messages"""
+
+        response = self.client.get(reverse("details"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for attribute in ("session", "_messages", "csrf_processing_done"):
+            self.assertFalse(hasattr(response.wsgi_request, attribute))
+        self.assertNotIn("Cookie", response.get("Vary", ""))
+
+    def test_password_change_creates_no_session(self):
+        """Test that changing the password over the API stores no session"""
+
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"password": "a new Password 1"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Session.objects.exists())
+
+    def test_admin_request(self):
+        """Test that the admin site keeps its sessions and CSRF protection"""
+
+        response = self.client.get("/admin/login/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(hasattr(response.wsgi_request, "session"))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+        self.assertIn("csrftoken", response.cookies)
+
+        client = self.client_class(enforce_csrf_checks=True)
+        response = client.post("/admin/login/", {"username": "x", "password": "y"})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SignedTokenTest(TestCase):
+    """Test signed access and refresh tokens"""
+
+    def setUp(self):
+        authentication.token_cache.clear()
+        self.user = UserFactory.create()
+        self.user.save()
+        with self.settings(SIGNED_TOKENS=True):
+            response = self.client.post(
+                reverse("login"),
+                {"email": self.user.email, "password": "my_super_secret"},
+            )
+        self.tokens = response.data
+
+    def details(self, token):
+        return self.client.get(reverse("details"), HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def refresh(self, token):
+        return self.client.post(reverse("token-refresh"), {"refresh": token})
+
+    def test_login(self):
+        """Test that login returns signed tokens along with the token"""
+
+        self.assertEqual(set(self.tokens), {"token", "access", "refresh", "expires_in"})
+        self.assertEqual(self.tokens["expires_in"], settings.ACCESS_TOKEN_LIFETIME)
+
+    def test_access_token(self):
+        """Test that an access token authenticates, without a query once cached"""
+
+        with self.assertNumQueries(1):
+            first = self.details(self.tokens["access"])
+        with self.assertNumQueries(0):
+            second = self.details(self.tokens["access"])
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data["email"], self.user.email)
+
+    def test_invalid_access_tokens(self):
+        """Test that altered, expired and refresh tokens are refused"""
+
+        access = self.tokens["access"]
+        with self.settings(ACCESS_TOKEN_LIFETIME=-1):
+            expired = self.details(access)
+        for response in (
+            self.details(access[:-1] + ("A" if access[-1] != "A" else "B")),
+            self.details(self.tokens["refresh"]),
+            self.details("garbage"),
+            expired,
+        ):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh(self):
+        """Test that a refresh token gets a new access token"""
+
+        response = self.refresh(self.tokens["refresh"])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.details(response.data["access"]).status_code, status.HTTP_200_OK
+        )
+        self.assertEqual(
+            self.refresh(self.tokens["access"]).status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+    def test_revoke(self):
+        """Test that revoking refuses the access and refresh tokens"""
+
+        self.assertEqual(self.details(self.tokens["access"]).status_code, 200)
+        response = self.client.post(
+            reverse("token-revoke"),
+            HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(User.objects.get(pk=self.user.pk).token_version, 2)
+        self.assertEqual(
+            self.details(self.tokens["access"]).status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+        self.assertEqual(
+            self.refresh(self.tokens["refresh"]).status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+    def test_revoke_stale_user(self):
+        """Test that revoking writes only the token version of a cached user"""
+
+        auth = f"Bearer {self.tokens['access']}"
+        self.details(self.tokens["access"])
+        # Changed by another process, whose change this process's cache missed.
+        User.objects.filter(pk=self.user.pk).update(phone="+15550199")
+        version = User.objects.get(pk=self.user.pk).version
+
+        response = self.client.post(reverse("token-revoke"), HTTP_AUTHORIZATION=auth)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.token_version, user.version), (2, version))
+        self.assertEqual(user.phone, "+15550199")
+        self.assertIsNone(authentication.token_cache.get(("user", self.user.pk)))
+
+    def test_revoke_deleted_user(self):
+        """Test that revoking for a user deleted since it was cached succeeds"""
+
+        self.details(self.tokens["access"])
+        key = ("user", self.user.pk)
+        snapshot = authentication.token_cache.get(key)
+        self.user.delete()
+        authentication.token_cache.set(key, snapshot, group=self.user.pk)
+
+        response = self.client.post(
+            reverse("token-revoke"),
+            HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(User.objects.exists())
+
+    def test_password_change_revokes(self):
+        """Test that changing the password revokes the signed tokens"""
+
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"password": "a new Password 1"},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.details(self.tokens["access"]).status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+    async def test_async_views(self):
+        """Test that the async views accept access tokens"""
+
+        view = async_views.AsyncUserDetailsView.as_view()
+        request = AsyncRequestFactory().get(
+            "/", headers={"authorization": f"Bearer {self.tokens['access']}"}
+        )
+        response = await view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["email"], self.user.email)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class PrimaryReplicaRouterTest(TestCase):
+    """Test the routing of reads to replicas and of recent writers to the primary"""
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        # Test cases run inside a transaction, which pins reads to the primary.
+        patcher = mock.patch.object(connections["default"], "in_atomic_block", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def route(self, request, write=False):
+        """Run the middleware, returning the response and the database of a read."""
+        routed = {}
+
+        def view(request):
+            if write:
+                self.router.db_for_write(User)
+            routed["read"] = self.router.db_for_read(User)
+            return HttpResponse()
+
+        response = ReplicaStickinessMiddleware(view)(request)
+        return response, routed["read"]
+
+    def test_router(self):
+        """Test that reads go to the replica unless pinned, writes to the primary"""
+
+        self.assertEqual(self.router.db_for_read(User), "replica")
+        self.assertEqual(self.router.db_for_write(User), "default")
+        self.assertTrue(self.router.allow_migrate("default", "users"))
+        self.assertFalse(self.router.allow_migrate("replica", "users"))
+
+        with mock.patch.object(connections["default"], "in_atomic_block", True):
+            self.assertEqual(self.router.db_for_read(User), "default")
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(User), "default")
+
+    def test_reads_after_write(self):
+        """Test that a client reads from the primary for a while after writing"""
+
+        response, read = self.route(self.factory.patch("/api/v1/user/update/"))
+        self.assertEqual(read, "default")
+        cookie = response.cookies["primary_until"]
+        self.assertEqual(cookie.value, response["X-Primary-Until"])
+        self.assertEqual(cookie["max-age"], settings.REPLICA_STICKY_SECONDS)
+
+        request = self.factory.get("/api/v1/user/details/")
+        request.COOKIES["primary_until"] = cookie.value
+        self.assertEqual(self.route(request)[1], "default")
+
+        request = self.factory.get(
+            "/api/v1/user/details/", headers={"x-primary-until": cookie.value}
+        )
+        self.assertEqual(self.route(request)[1], "default")
+
+        request = self.factory.get("/api/v1/user/details/")
+        request.COOKIES["primary_until"] = str(int(time.time()) - 1)
+        response, read = self.route(request)
+        self.assertEqual(read, "replica")
+        self.assertNotIn("primary_until", response.cookies)
+
+    def test_write_in_safe_request(self):
+        """Test that a GET request writing reads from the primary afterwards"""
+
+        response, read = self.route(self.factory.get("/"), write=True)
+
+        self.assertEqual(read, "default")
+        self.assertIn("primary_until", response.cookies)
+
+
+USER_SHARDS = ["default", "shard_a", "shard_b"]
+
+
+class UserShardingTest(TestCase):
+    """Test hash sharding of users across several databases"""
+
+    # The shards only exist once setUpClass created them, as part of every database.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        # The other shards are test databases next to the default one, created, and
+        # migrated as shards, for this test case only.
+        cls.enterClassContext(override_settings(USER_SHARDS=USER_SHARDS))
+        default = connections["default"].settings_dict
+        for alias in USER_SHARDS[1:]:
+            settings.DATABASES[alias] = {
+                **default,
+                "TEST": {**default["TEST"], "NAME": f"{default['NAME']}_{alias}"},
+            }
+            cls.addClassCleanup(cls.remove_database, alias, default["NAME"])
+            connections[alias].creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+        super().setUpClass()
+
+    @classmethod
+    def remove_database(cls, alias, name):
+        connections[alias].creation.destroy_test_db(name, verbosity=0)
+        del connections[alias]
+        del settings.DATABASES[alias]
+
+    def setUp(self):
+        authentication.token_cache.clear()
+        emails = (f"user{number}@example.com" for number in range(1000))
+        self.emails = {}
+        for email in emails:
+            self.emails.setdefault(sharding.shard_for_email(email), email)
+        self.assertEqual(set(self.emails), set(USER_SHARDS))
+
+    def register(self, email):
+        """Register and log in a user, returning its token key."""
+        data = build_dict(UserFactory.build(email=email), password="my_super_secret")
+        response = self.client.post(reverse("register"), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(
+            reverse("login"), {"email": email.upper(), "password": "my_super_secret"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["token"]
+
+    def log_in_admin(self):
+        """Register an admin user on the primary database and authenticate as it."""
+        key = self.register(self.emails["default"])
+        User.objects.using("default").filter(email=self.emails["default"]).update(
+            is_staff=True
+        )
+        authentication.token_cache.clear()
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {key}"
+
+    def queried_databases(self, function):
+        """Call function, returning the databases it queried."""
+        with ExitStack() as stack:
+            queries = {
+                alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in USER_SHARDS
+            }
+            function()
+        return {alias for alias, captured in queries.items() if len(captured)}
+
+    def test_shard_index(self):
+        """Test that emails spread over the shards and appending one moves few"""
+
+        emails = [f"user{number}@example.com" for number in range(3000)]
+        two = [sharding.shard_index(email, USER_SHARDS[:2]) for email in emails]
+        three = [sharding.shard_index(email, USER_SHARDS) for email in emails]
+
+        for index in range(3):
+            self.assertAlmostEqual(three.count(index) / len(emails), 1 / 3, delta=0.05)
+        moved = [after for before, after in zip(two, three) if before != after]
+        self.assertEqual(set(moved), {2})
+        self.assertEqual(sharding.shard_for_token_key("0" * 40), "default")
+        self.assertEqual(sharding.shard_for_token_key("2_" + "0" * 38), "shard_b")
+        self.assertIsNone(sharding.shard_for_token_key("7_" + "0" * 38))
+
+    def test_users_on_their_shard(self):
+        """Test that users, ids and token keys are placed on the shard of the email"""
+
+        for index, alias in enumerate(USER_SHARDS):
+            with self.subTest(shard=alias):
+                key = self.register(self.emails[alias])
+                user = User.objects.for_email(self.emails[alias]).get(
+                    email=self.emails[alias]
+                )
+
+                self.assertEqual(user._state.db, alias)
+                self.assertEqual(user.pk >> sharding.SHARD_ID_BITS, index)
+                self.assertEqual(sharding.shard_for_token_key(key), alias)
+                self.assertEqual(sharding.shard_for_id(user.pk), alias)
+                self.assertEqual(EmailBackend().get_user(user.pk), user)
+                for other in set(USER_SHARDS) - {alias}:
+                    self.assertFalse(
+                        User.objects.using(other).filter(email=user.email).exists()
+                    )
+
+    def test_authentication_without_fan_out(self):
+        """Test that a token authenticates and updates on its shard only"""
+
+        key = self.register(self.emails["shard_b"])
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {key}"
+
+        def update():
+            response = self.client.patch(
+                reverse("edit-profile"),
+                {"first_name": "Sharded"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.queried_databases(update), {"shard_b"})
+        self.assertEqual(
+            User.objects.for_email(self.emails["shard_b"])
+            .get(email=self.emails["shard_b"])
+            .first_name,
+            "Sharded",
+        )
+
+        with self.settings(SIGNED_TOKENS=True):
+            response = self.client.post(
+                reverse("login"),
+                {"email": self.emails["shard_b"], "password": "my_super_secret"},
+            )
+        authentication.token_cache.clear()
+        access = response.data["access"]
+
+        def details():
+            response = self.client.get(
+                reverse("details"), HTTP_AUTHORIZATION=f"Bearer {access}"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.queried_databases(details), {"shard_b"})
+
+    def test_introspect_tokens(self):
+        """Test that introspecting tokens queries the shards of the keys only"""
+
+        keys = [self.register(self.emails[alias]) for alias in ("default", "shard_b")]
+        # A shard that does not exist.
+        keys.append("9_" + "0" * 38)
+        responses = []
+
+        def introspect():
+            responses.append(
+                self.client.post(
+                    reverse("tokens-introspect"),
+                    keys,
+                    content_type="application/json",
+                    HTTP_X_SERVICE_CREDENTIAL="gateway-secret",
+                )
+            )
+
+        with self.settings(SERVICE_CREDENTIALS=["gateway-secret"]):
+            queried = self.queried_databases(introspect)
+
+        self.assertEqual(queried, {"default", "shard_b"})
+        results = responses[0].data["results"]
+        self.assertEqual([result["active"] for result in results], [True, True, False])
+        self.assertEqual(sharding.shard_for_id(results[1]["user_id"]), "shard_b")
+        self.assertIsNone(results[2]["user_id"])
+
+    def test_duplicate_email(self):
+        """Test that an email used on its shard cannot be registered again"""
+
+        self.register(self.emails["shard_a"])
+        data = build_dict(UserFactory.build(email=self.emails["shard_a"]))
+        response = self.client.post(reverse("register"), data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", response.data)
+
+    def test_email_change_moves_user(self):
+        """Test that changing the email moves the user to the shard of the new email"""
+
+        key = self.register(self.emails["default"])
+        user = User.objects.for_email(self.emails["default"]).get(
+            email=self.emails["default"]
+        )
+        for alias in ("default", "shard_a"):
+            Group.objects.using(alias).create(name="support")
+        user.groups.add(Group.objects.using("default").get(name="support"))
+        user.user_permissions.add(
+            Permission.objects.using("default").get(codename="view_user")
+        )
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {key}"
+
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"email": self.emails["shard_a"]},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(User.objects.using("default").filter(pk=user.pk).exists())
+        moved = User.objects.for_email(self.emails["shard_a"]).get(
+            email=self.emails["shard_a"]
+        )
+        self.assertEqual(moved._state.db, "shard_a")
+        self.assertEqual(moved.phone, user.phone)
+        self.assertEqual([group.name for group in moved.groups.all()], ["support"])
+        self.assertTrue(moved.has_perm("users.view_user"))
+        self.assertEqual(sharding.shard_for_token_key(moved.auth_token.key), "shard_a")
+        self.assertEqual(
+            self.client.get(reverse("details")).status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+        response = self.client.post(
+            reverse("login"),
+            {"email": self.emails["shard_a"], "password": "my_super_secret"},
+        )
+        self.assertEqual(response.data["token"], moved.auth_token.key)
+
+    def test_email_change_conflict(self):
+        """Test that a move to a shard where the phone is used keeps the user in place"""
+
+        key = self.register(self.emails["default"])
+        user = User.objects.for_email(self.emails["default"]).get(
+            email=self.emails["default"]
+        )
+        # A user loaded into shard_a without claiming its phone.
+        User.objects.using("shard_a").bulk_create(
+            [User(email=self.emails["shard_a"], phone=user.phone)]
+        )
+        new_email = next(
+            f"moved{number}@example.com"
+            for number in range(1000)
+            if sharding.shard_for_email(f"moved{number}@example.com") == "shard_a"
+        )
+        async_request = AsyncRequestFactory().patch(
+            "/",
+            {"email": new_email},
+            content_type="application/json",
+            headers={"authorization": f"Token {key}"},
+        )
+
+        responses = {
+            "sync": self.client.patch(
+                reverse("edit-profile"),
+                {"email": new_email},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Token {key}",
+            ),
+            "async": async_to_sync(async_views.AsyncEditUserView.as_view())(
+                async_request
+            ),
+        }
+
+        for name, response in responses.items():
+            with self.subTest(view=name):
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(
+                    json.loads(response.content)["non_field_errors"],
+                    ["A user with this email or phone already exists."],
+                )
+        user.refresh_from_db()
+        self.assertEqual(user._state.db, "default")
+        self.assertEqual(user.email, self.emails["default"])
+        self.assertFalse(User.objects.using("shard_a").filter(email=new_email).exists())
+        response = self.client.get(
+            reverse("details"), HTTP_AUTHORIZATION=f"Token {key}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_phone_unique_across_shards(self):
+        """Test that a phone used on one shard cannot be taken on another"""
+
+        self.register(self.emails["shard_a"])
+        phone = (
+            User.objects.for_email(self.emails["shard_a"])
+            .get(email=self.emails["shard_a"])
+            .phone
+        )
+        data = build_dict(
+            UserFactory.build(email=self.emails["shard_b"], phone=phone),
+            password="my_super_secret",
+        )
+
+        response = self.client.post(reverse("register"), data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["phone"], ["user with this phone already exists."]
+        )
+
+        key = self.register(self.emails["shard_b"])
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"phone": phone},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {key}",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("phone", response.data)
+        user = User.objects.for_email(self.emails["shard_b"]).get(
+            email=self.emails["shard_b"]
+        )
+        user.phone = phone
+        with self.assertRaises(IntegrityError):
+            user.save()
+        with self.assertRaises(DjangoValidationError):
+            user.clean()
+
+    def test_phone_claims(self):
+        """Test that phones are claimed and released as users change them"""
+
+        key = self.register(self.emails["shard_b"])
+        user = User.objects.for_email(self.emails["shard_b"]).get(
+            email=self.emails["shard_b"]
+        )
+        claims = PhoneNumber.objects.using("default")
+        self.assertEqual(claims.get(phone=user.phone).user_id, user.pk)
+
+        with self.captureOnCommitCallbacks(using="shard_b", execute=True):
+            response = self.client.patch(
+                reverse("edit-profile"),
+                {"phone": "+15550123"},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Token {key}",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(claims.filter(user_id=user.pk).values_list("phone", flat=True)),
+            ["+15550123"],
+        )
+
+        # Left behind by a user which no longer exists.
+        claims.create(phone="+15550124", user_id=(1 << sharding.SHARD_ID_BITS) + 999)
+        data = build_dict(
+            UserFactory.build(email=self.emails["shard_a"], phone="+15550124"),
+            password="my_super_secret",
+        )
+        response = self.client.post(reverse("register"), data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        other = User.objects.for_email(self.emails["shard_a"]).get(
+            email=self.emails["shard_a"]
+        )
+        self.assertEqual(claims.get(phone="+15550124").user_id, other.pk)
+
+    def test_bulk_writes_refused(self):
+        """Test that bulk writes to the primary database only are refused"""
+
+        self.log_in_admin()
+        rows = [build_dict(UserFactory.build(email=self.emails["shard_a"]))]
+
+        response = self.client.post(
+            reverse("register-bulk"), rows, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("sharded", response.data["error"])
+        response = self.client.patch(
+            reverse("bulk-update"),
+            [{"id": 1, "first_name": "Bulk"}],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("sharded", response.data["error"])
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            with self.assertRaisesMessage(CommandError, "sharded"):
+                call_command("import_users", file.name, stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, "sharded"):
+            call_command("seed_users", "--count", "1", stdout=io.StringIO())
+        self.assertFalse(
+            User.objects.using("default").filter(email=self.emails["shard_a"]).exists()
+        )
+
+    def test_list_every_shard(self):
+        """Test that the user list pages through the users of every shard"""
+
+        self.log_in_admin()
+        for alias in ("shard_a", "shard_b"):
+            self.register(self.emails[alias])
+
+        emails, url = [], reverse("list") + "?page_size=1"
+        for _ in range(4):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            emails.extend(user["email"] for user in response.data["results"])
+            url = response.data["next"]
+            if not url:
+                break
+
+        self.assertEqual(
+            emails, [self.emails[alias] for alias in reversed(USER_SHARDS)]
+        )
+
+    def test_export_every_shard(self):
+        """Test that the export streams the users of every shard, in id order"""
+
+        self.log_in_admin()
+        for alias in ("shard_b", "shard_a"):
+            self.register(self.emails[alias])
+
+        response = self.client.get(reverse("export"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["email"] for line in lines],
+            [self.emails[alias] for alias in USER_SHARDS],
+        )
+
+    def test_reshard_users(self):
+        """Test that reshard_users moves users loaded into the primary database"""
+
+        with self.settings(USER_SHARDS=["default"]):
+            for email in self.emails.values():
+                user = User.objects.create_user(
+                    email=email, password="my_super_secret", phone=email
+                )
+                Token.objects.create(user=user)
+        # Takes the phone of a user loaded before sharding, which is not claimed yet.
+        User.objects.create_user(
+            email="other@example.com", phone=self.emails["shard_b"]
+        )
+
+        out, err = io.StringIO(), io.StringIO()
+        call_command("reshard_users", "--dry-run", stdout=out)
+        self.assertIn("To move: 2 users, 0 conflicts.", out.getvalue())
+        self.assertEqual(User.objects.using("default").count(), 3)
+
+        call_command("reshard_users", stdout=out, stderr=err)
+        self.assertIn("Moved: 1 users, 1 conflicts.", out.getvalue())
+        self.assertIn("left on default", err.getvalue())
+        for alias in ("default", "shard_a"):
+            user = User.objects.for_email(self.emails[alias])
+            user = user.select_related("auth_token").get(email=self.emails[alias])
+            self.assertEqual(user._state.db, alias)
+            self.assertEqual(sharding.shard_for_token_key(user.auth_token.key), alias)
+            self.assertEqual(sharding.shard_for_id(user.pk), alias)
+        self.assertEqual(User.objects.using("default").count(), 2)
+        claims = PhoneNumber.objects.using("default")
+        self.assertEqual(
+            claims.get(phone=self.emails["shard_b"]).user_id,
+            User.objects.for_email("other@example.com").get().pk,
+        )
+        for alias in ("default", "shard_a"):
+            user = User.objects.for_email(self.emails[alias]).get(
+                email=self.emails[alias]
+            )
+            self.assertEqual(claims.get(phone=user.phone).user_id, user.pk)
+
+    def test_prepare_startup_every_shard(self):
+        """Test that prepare_startup migrates every shard"""
+
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as static_root:
+            with self.settings(STATIC_ROOT=static_root):
+                call_command("prepare_startup", stdout=out, verbosity=0)
+                with mock.patch(
+                    "users.management.commands.prepare_startup.call_command"
+                ) as run:
+                    call_command("prepare_startup", "--force", stdout=io.StringIO())
+
+        for alias in USER_SHARDS:
+            self.assertIn(
+                f"Migrations on {alias}: up to date, skipped.", out.getvalue()
+            )
+        self.assertEqual(
+            [
+                call.kwargs["database"]
+                for call in run.call_args_list
+                if call.args[0] == "migrate"
+            ],
+            USER_SHARDS,
+        )
+
+    def test_reshard_users_dry_run(self):
+        """Test that reshard_users --dry-run leaves the id sequences of the shards alone"""
+
+        def sequences():
+            states = {}
+            for alias in USER_SHARDS:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(
+                        "SELECT pg_get_serial_sequence(%s, 'id')",
+                        [User._meta.db_table],
+                    )
+                    sequence = cursor.fetchone()[0]
+                    cursor.execute(f"SELECT last_value, is_called FROM {sequence}")
+                    states[alias] = cursor.fetchone()
+            return states
+
+        # Reserving the range of a shard advances its sequence once it allocated ids.
+        for email in self.emails.values():
+            self.register(email)
+        before = sequences()
+        call_command("reshard_users", "--dry-run", stdout=io.StringIO())
+        self.assertEqual(sequences(), before)
+
+
+class PasswordValidationTest(TestCase):
+    """Test the password validators and their use by UserSerializer"""
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.user.save()
+        self.token = TokenFactory(user=self.user)
+        self.token.save()
+
+    def test_common_password_rejected(self):
+        """Test that registering with a common password is rejected"""
+
+        data = build_dict(UserFactory.build(), password="password123")
+        response = self.client.post(reverse("register"), data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["password"], ["This password is too common."])
+        self.assertFalse(User.objects.filter(email=data["email"]).exists())
+
+    def test_similar_password_rejected(self):
+        """Test that a password too similar to the new name of the user is rejected"""
+
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {self.token.key}"
+        response = self.client.patch(
+            reverse("edit-profile"),
+            {"first_name": "Bartholomew", "password": "bartholomew!"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["password"],
+            ["The password is too similar to the first name."],
+        )
+
+    def test_password_list_shared(self):
+        """Test that the common passwords are parsed once and shared by validators"""
+
+        first = password_validation.CommonPasswordValidator()
+        second = password_validation.CommonPasswordValidator()
+
+        self.assertIs(first.passwords, second.passwords)
+        self.assertIsInstance(first.passwords, frozenset)
+        self.assertIn("password123", first.passwords)
+
+    def test_similarity_matches_django(self):
+        """Test that the similarity validator takes the decisions of Django's"""
+
+        validator = password_validation.UserAttributeSimilarityValidator()
+        reference = DjangoUserAttributeSimilarityValidator()
+        passwords = ["johndoe", "j0hnd03!", "doe", "example.com", "xyzzy-plugh"]
+        passwords += [fake.password() for _ in range(20)]
+        user = User(first_name="John", last_name="Doe", email="john.doe@example.com")
+        for password in passwords:
+            with self.subTest(password=password):
+                self.assertEqual(
+                    self.rejects(validator, password, user),
+                    self.rejects(reference, password, user),
+                )
+
+    @staticmethod
+    def rejects(validator, password, user):
+        try:
+            validator.validate(password, user)
+        except DjangoValidationError:
+            return True
+        return False
+
+
+class StartupCommandsTest(TestCase):
+    """Test the prepare_startup and startup_profile commands"""
+
+    def test_prepare_startup(self):
+        """Test that migrations and static files are skipped when up to date"""
+
+        with tempfile.TemporaryDirectory() as static_root:
+            with self.settings(STATIC_ROOT=static_root):
+                first, second, forced = io.StringIO(), io.StringIO(), io.StringIO()
+                call_command("prepare_startup", stdout=first, verbosity=0)
+                collected = os.listdir(static_root)
+                call_command("prepare_startup", stdout=second, verbosity=0)
+                with mock.patch(
+                    "users.management.commands.prepare_startup.call_command"
+                ) as run:
+                    call_command("prepare_startup", "--force", stdout=forced)
+
+        self.assertIn("Migrations on default: up to date, skipped.", first.getvalue())
+        self.assertIn("Static files: changed, collecting.", first.getvalue())
+        self.assertIn("admin", collected)
+        self.assertIn(".static-fingerprint", collected)
+        self.assertIn("Static files: unchanged, skipped.", second.getvalue())
+        self.assertEqual(
+            [call.args[0] for call in run.call_args_list], ["migrate", "collectstatic"]
+        )
+
+    def test_startup_profile(self):
+        """Test that the import time and memory of every module are reported"""
+
+        out = io.StringIO()
+        call_command("startup_profile", "--json", stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report["module"], "core.wsgi")
+        self.assertGreater(report["rss_bytes"], 0)
+        self.assertGreater(report["python_bytes"], 0)
+        self.assertIn("users.urls", report["modules"])
+        self.assertIn("self_bytes", report["modules"]["rest_framework"])
+        self.assertGreaterEqual(report["packages"]["users"]["modules"], 10)
+
+
+@override_settings(SERVICE_CREDENTIALS=["gateway-secret", "other-secret"])
+class TokenIntrospectionViewTest(TestCase):
+    """Test the batch token introspection for internal services"""
+
+    def setUp(self):
+        self.url = reverse("tokens-introspect")
+        self.tokens = []
+        for is_active in (True, False):
+            user = UserFactory.create(is_active=is_active)
+            user.save()
+            token = TokenFactory(user=user, key=get_random_string(40))
+            token.save()
+            self.tokens.append(token)
+
+    def introspect(self, keys, credential="other-secret"):
+        headers = {"HTTP_X_SERVICE_CREDENTIAL": credential} if credential else {}
+        return self.client.post(
+            self.url, keys, content_type="application/json", **headers
+        )
+
+    def test_introspect_tokens(self):
+        """Test that tokens are resolved with one query, in the order of the keys"""
+
+        active, inactive = self.tokens
+        keys = [inactive.key, "unknown", active.key, active.key]
+        with self.assertNumQueries(1):
+            response = self.introspect(keys)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"token": inactive.key, "active": False, "user_id": inactive.user_id},
+                {"token": "unknown", "active": False, "user_id": None},
+                {"token": active.key, "active": True, "user_id": active.user_id},
+                {"token": active.key, "active": True, "user_id": active.user_id},
+            ],
+        )
+
+    def test_service_credential_required(self):
+        """Test that introspection is refused without a known service credential"""
+
+        key = self.tokens[0].key
+        for credential in (None, "", "wrong-secret", "gateway-secret "):
+            with self.subTest(credential=credential):
+                response = self.introspect([key], credential)
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # User tokens are no service credentials.
+        response = self.client.post(
+            self.url,
+            [key],
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {key}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        with self.settings(SERVICE_CREDENTIALS=[]):
+            response = self.introspect([key], "")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_invalid_batches(self):
+        """Test that empty, malformed and oversized batches are rejected"""
+
+        for keys in ([], {"tokens": ["a"]}, ["a", 1]):
+            with self.subTest(keys=keys):
+                response = self.introspect(keys)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.settings(TOKEN_INTROSPECTION_MAX_KEYS=2):
+            response = self.introspect(["a", "b", "c"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("at most 2 tokens", response.data["error"])
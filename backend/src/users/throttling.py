@@ -0,0 +1,244 @@
+"""Login throttling for users.
+
+Every login attempt costs a full password hash verification, so a burst of guessed
+passwords exhausts the hashing pool of every worker. The throttles of this module limit
+attempts per client IP and per email with token buckets: a bucket holds up to a burst of
+attempts and refills at a steady rate. They are checked before the user is looked up or
+any password is hashed, and a rejected attempt costs a dictionary lookup.
+
+Buckets live in a store. LocalBucketStore keeps them in the memory of the process, which
+limits each worker separately. CacheBucketStore keeps them in a Django cache, which limits
+all workers together when the cache is shared, such as Redis or Memcached. The
+LOGIN_THROTTLE_STORE setting selects the store.
+
+Attributes:
+    LocalBucketStore (class): Token buckets kept in the memory of the process.
+    CacheBucketStore (class): Token buckets kept in a Django cache.
+    get_store (function): Returns the bucket store of the current process.
+    TokenBucketThrottle (class): Subclass of rest_framework.throttling.BaseThrottle, limiting attempts per key.
+    LoginIPThrottle (class): Subclass of TokenBucketThrottle, limiting login attempts per client IP.
+    LoginEmailThrottle (class): Subclass of TokenBucketThrottle, limiting login attempts per email.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+
+def _refill(bucket, capacity, rate, now):
+    """Take one token from a bucket, returning its new state and the seconds to wait."""
+    tokens, updated = bucket or (capacity, now)
+    tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalBucketStore:
+    """Token buckets kept in the memory of the process.
+
+    The least recently used buckets are dropped beyond max_entries, which only forgets
+    clients that have not tried to log in for a while.
+
+    Attributes:
+        max_entries (int): Maximum number of buckets kept, LOGIN_THROTTLE_MAX_ENTRIES by default.
+
+    Methods:
+        consume(key, capacity, rate): Takes one token from the bucket of key.
+        clear(): Drops every bucket.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or settings.LOGIN_THROTTLE_MAX_ENTRIES
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        """Take one token from the bucket of key.
+
+        Args:
+            key (str): The key of the bucket.
+            capacity (int): The maximum number of tokens of the bucket.
+            rate (float): The tokens added to the bucket per second.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket, wait = _refill(self._buckets.pop(key, None), capacity, rate, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        """Drop every bucket."""
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Token buckets kept in a Django cache.
+
+    A bucket is read and written back with two cache calls, so concurrent attempts on the
+    same key may both take its last token: the limit may be exceeded by the number of
+    attempts racing, which does not matter against floods. Buckets expire once they
+    would be full again.
+
+    Attributes:
+        cache (BaseCache): The cache, LOGIN_THROTTLE_CACHE by default.
+
+    Methods:
+        consume(key, capacity, rate): Takes one token from the bucket of key.
+        clear(): Drops every bucket, along with every other entry of the cache.
+    """
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or settings.LOGIN_THROTTLE_CACHE]
+
+    def consume(self, key, capacity, rate):
+        """Take one token from the bucket of key.
+
+        Args:
+            key (str): The key of the bucket.
+            capacity (int): The maximum number of tokens of the bucket.
+            rate (float): The tokens added to the bucket per second.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        # Emails may hold characters cache servers reject in keys.
+        key = f"throttle:{hashlib.sha256(key.encode()).hexdigest()}"
+        # Wall clock time, since the buckets are shared between machines.
+        bucket, wait = _refill(self.cache.get(key), capacity, rate, time.time())
+        self.cache.set(key, bucket, timeout=int(capacity / rate) + 1)
+        return wait
+
+    def clear(self):
+        """Drop every entry of the cache."""
+        self.cache.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the bucket store of the current process, creating it on first use.
+
+    Returns:
+        LocalBucketStore | CacheBucketStore: An instance of LOGIN_THROTTLE_STORE.
+    """
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = import_string(settings.LOGIN_THROTTLE_STORE)()
+        return _store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle limiting requests per key with token buckets.
+
+    The burst and rate of the buckets are read from the LOGIN_THROTTLE_<SCOPE>_BURST and
+    LOGIN_THROTTLE_<SCOPE>_RATE settings.
+
+    Attributes:
+        scope (str): Name of the throttle, used in setting names and bucket keys.
+
+    Methods:
+        get_key(request, data): Returns the key of the request, or None to not throttle it.
+        allow(request, data): Takes a token for the request, usable outside of DRF views.
+        allow_request(request, view): Takes a token for the request of a DRF view.
+        wait(): Returns the seconds to wait after a rejected request.
+    """
+
+    scope = None
+
+    def __init__(self):
+        self._wait = 0.0
+
+    def get_key(self, request, data):
+        """Return the key of the request, or None to not throttle it.
+
+        Args:
+            request: The incoming request.
+            data (dict): The parsed body of the request.
+
+        Returns:
+            str: The key of the bucket of the request.
+        """
+        raise NotImplementedError(".get_key() must be overridden")
+
+    def allow(self, request, data):
+        """Take a token for the request.
+
+        Args:
+            request: The incoming request, a Django or DRF request.
+            data (dict): The parsed body of the request.
+
+        Returns:
+            bool: Whether the request may proceed.
+        """
+        scope = self.scope.upper()
+        capacity = getattr(settings, f"LOGIN_THROTTLE_{scope}_BURST")
+        if capacity < 1:
+            return True
+
+        key = self.get_key(request, data)
+        if key is None:
+            return True
+
+        rate = getattr(settings, f"LOGIN_THROTTLE_{scope}_RATE")
+        self._wait = get_store().consume(f"login:{self.scope}:{key}", capacity, rate)
+        return not self._wait
+
+    def allow_request(self, request, view):
+        """Take a token for the request of a DRF view."""
+        return self.allow(request, request.data)
+
+    def wait(self):
+        """Return the seconds to wait after a rejected request."""
+        return self._wait
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    """Throttle limiting login attempts per client IP.
+
+    The IP is the one DRF identifies clients with: the remote address when the
+    NUM_PROXIES setting is 0, its default, otherwise the address the last of those
+    proxies added to X-Forwarded-For. Addresses clients put in that header themselves
+    are never used, they would get a new bucket per request.
+    """
+
+    scope = "ip"
+
+    def get_key(self, request, data):
+        """Return the IP of the client."""
+        return self.get_ident(request)
+
+
+class LoginEmailThrottle(TokenBucketThrottle):
+    """Throttle limiting login attempts per email.
+
+    Emails are normalized like EmailBackend does, so that changing their case does not
+    give another bucket. Attempts for unknown emails are throttled alike, which keeps them
+    indistinguishable from attempts for existing users.
+    """
+
+    scope = "email"
+
+    def get_key(self, request, data):
+        """Return the normalized email of the attempt, or None without one."""
+        email = data.get("email") if hasattr(data, "get") else None
+        if not email or not isinstance(email, str):
+            return None
+        return get_user_model().objects.normalize_email(email)[:254]
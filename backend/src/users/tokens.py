@@ -0,0 +1,130 @@
+"""Signed access and refresh tokens for users.
+
+Tokens of rest_framework.authtoken are random keys, which every request must look up.
+The tokens of this module instead carry the id and the token version of their user,
+signed with SECRET_KEY by django.core.signing, and expire: checking one takes an HMAC
+and, with users.authentication.SignedTokenAuthentication, a cache lookup.
+
+Access tokens authenticate requests and live ACCESS_TOKEN_LIFETIME seconds. Refresh
+tokens get new access tokens and live REFRESH_TOKEN_LIFETIME seconds. Both are revoked
+by incrementing the token version of their user, as revoke_tokens does, and as changing
+the password does. Refreshing checks the version in the database; authenticating checks
+the cached user, so other processes accept a revoked access token until their cache
+entry expires, after TOKEN_CACHE_TTL seconds at most.
+
+Attributes:
+    issue_access_token (function): Returns a new access token of a user.
+    issue_tokens (function): Returns new access and refresh tokens of a user.
+    read_access_token (function): Returns the user id and token version of an access token.
+    read_refresh_token (function): Returns the user id and token version of a refresh token.
+    revoke_tokens (function): Revokes every signed token of a user.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
+
+from . import sharding
+
+# Different salts keep a refresh token from being used as an access token.
+ACCESS_SALT = "users.tokens.access"
+REFRESH_SALT = "users.tokens.refresh"
+
+
+def _sign(user, salt):
+    return signing.dumps([user.pk, user.token_version], salt=salt)
+
+
+def _read(token, salt, max_age):
+    """Return the user id and token version of a token.
+
+    Raises:
+        BadSignature: If the token is malformed, altered or expired.
+    """
+    try:
+        user_id, token_version = signing.loads(token, salt=salt, max_age=max_age)
+    except (TypeError, ValueError) as exc:
+        raise signing.BadSignature("Malformed token.") from exc
+    return user_id, token_version
+
+
+def issue_access_token(user):
+    """Return a new access token of a user.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        str: The signed access token.
+    """
+    return _sign(user, ACCESS_SALT)
+
+
+def issue_tokens(user):
+    """Return new access and refresh tokens of a user.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        dict: The access token, the refresh token and the seconds the access token lives.
+    """
+    return {
+        "access": issue_access_token(user),
+        "refresh": _sign(user, REFRESH_SALT),
+        "expires_in": settings.ACCESS_TOKEN_LIFETIME,
+    }
+
+
+def read_access_token(token):
+    """Return the user id and token version of an access token.
+
+    Args:
+        token (str): The access token.
+
+    Returns:
+        tuple: The user id and the token version.
+
+    Raises:
+        BadSignature: If the token is malformed, altered or expired.
+    """
+    return _read(token, ACCESS_SALT, settings.ACCESS_TOKEN_LIFETIME)
+
+
+def read_refresh_token(token):
+    """Return the user id and token version of a refresh token.
+
+    Args:
+        token (str): The refresh token.
+
+    Returns:
+        tuple: The user id and the token version.
+
+    Raises:
+        BadSignature: If the token is malformed, altered or expired.
+    """
+    return _read(token, REFRESH_SALT, settings.REFRESH_TOKEN_LIFETIME)
+
+
+def revoke_tokens(user):
+    """Revoke every signed token of a user by incrementing its token version.
+
+    The version is incremented by an update query of its row alone: the user may be a
+    snapshot from the token cache, older than the database, which must not be saved.
+    The update sends no save signal, so the cached entries of the user are dropped here,
+    like users.signals does. A user deleted meanwhile has no tokens left to revoke.
+
+    Args:
+        user (User): The user.
+    """
+    # Imported here: users.authentication imports this module.
+    from . import authentication  # pylint: disable=import-outside-toplevel
+
+    using = sharding.shard_for_id(user.pk)
+    get_user_model().objects.db_manager(using).filter(pk=user.pk).update(
+        token_version=F("token_version") + 1
+    )
+    authentication.invalidate_user(user.pk)
+    transaction.on_commit(lambda: authentication.invalidate_user(user.pk), using=using)
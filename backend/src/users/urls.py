@@ -1,20 +1,40 @@
 """URL patterns for the user app.
 
 This module defines URL patterns for user-related views in the application.
-It includes paths for user registration, login, profile update, and user details.
+It includes paths for the user list, user registration, bulk registration, login, signed token refresh and
+revocation, token introspection, profile update, bulk update, user details, and export.
+With the ASYNC_USER_VIEWS setting, login, profile update and user details are served by async views.
 
 Attributes:
     urlpatterns (list): List of URL patterns for the user app.
 """
 
+from django.conf import settings
 from django.urls import path
 
-from .views import (EditUserView, UserDetailsView, UserLoginView,
-                    UserRegistrationView)
+from . import async_views
+from .views import (BulkUserRegistrationView, BulkUserUpdateView, EditUserView,
+                    TokenIntrospectionView, TokenRefreshView, TokenRevokeView,
+                    UserDetailsView, UserExportView, UserListView,
+                    UserLoginView, UserRegistrationView)
+
+if settings.ASYNC_USER_VIEWS:
+    login_view = async_views.AsyncUserLoginView
+    edit_view = async_views.AsyncEditUserView
+    details_view = async_views.AsyncUserDetailsView
+else:
+    login_view, edit_view, details_view = UserLoginView, EditUserView, UserDetailsView
 
 urlpatterns = [
+    path("", UserListView.as_view(), name="list"),
     path("register/", UserRegistrationView.as_view(), name="register"),
-    path("login/", UserLoginView.as_view(), name="login"),
-    path("update/", EditUserView.as_view(), name="edit-profile"),
-    path("details/", UserDetailsView.as_view(), name="details"),
+    path("register/bulk/", BulkUserRegistrationView.as_view(), name="register-bulk"),
+    path("login/", login_view.as_view(), name="login"),
+    path("token/refresh/", TokenRefreshView.as_view(), name="token-refresh"),
+    path("token/revoke/", TokenRevokeView.as_view(), name="token-revoke"),
+    path("tokens/introspect/", TokenIntrospectionView.as_view(), name="tokens-introspect"),
+    path("update/", edit_view.as_view(), name="edit-profile"),
+    path("bulk-update/", BulkUserUpdateView.as_view(), name="bulk-update"),
+    path("details/", details_view.as_view(), name="details"),
+    path("export/", UserExportView.as_view(), name="export"),
 ]
@@ -4,19 +4,47 @@ This module defines views for user-related operations using Django Rest Framewor
 
 Attributes:
     UserRegistrationView (class): Subclass of rest_framework.generics.CreateAPIView.
+    BulkUserRegistrationView (class): Subclass of rest_framework.views.APIView for registering many users at once.
+    BulkUserUpdateView (class): Subclass of rest_framework.views.APIView for updating many users at once.
     UserLoginView (class): Subclass of rest_framework.views.APIView for user login.
+    TokenRefreshView (class): Subclass of rest_framework.views.APIView for new signed access tokens.
+    TokenRevokeView (class): Subclass of rest_framework.views.APIView for revoking signed tokens.
+    TokenIntrospectionView (class): Subclass of rest_framework.views.APIView for checking many tokens at once.
     UserDetailsView (class): Subclass of rest_framework.generics.RetrieveAPIView for user details.
     EditUserView (class): Subclass of rest_framework.generics.UpdateAPIView for editing user information.
+    UserExportView (class): Subclass of rest_framework.views.APIView for streaming all users.
+    UserListView (class): Subclass of rest_framework.generics.ListAPIView for paging through users.
 """
 
-from django.contrib.auth import authenticate
-from rest_framework import generics, permissions
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .permissions import IsOwner
-from .serializers import UserSerializer
+from . import authentication, payloads, serializers, sharding, tokens
+from .bulk import BulkUserRegistration, BulkUserUpdate
+from .export import (
+    EXPORT_FORMATS,
+    aencode_rows,
+    aexport_rows,
+    encode_rows,
+    export_fields,
+    export_rows,
+)
+from .models import User
+from .pagination import KeysetPagination
+from .permissions import HasServiceCredential, IsOwner
+from .serializers import UserListSerializer, UserSerializer
+from .throttling import LoginEmailThrottle, LoginIPThrottle
 
 
 class UserRegistrationView(generics.CreateAPIView):
@@ -34,20 +62,172 @@ class UserRegistrationView(generics.CreateAPIView):
     permission_classes = (permissions.AllowAny,)
 
 
+class BulkUserRegistrationView(APIView):
+    """View for bulk user registration.
+
+    Extends rest_framework.views.APIView to register a list of users in one request.
+    Only admin users can access this view. Users are written to the primary database,
+    so the view is refused when users are sharded, see users.sharding.
+
+    Attributes:
+        permission_classes (tuple): Tuple of permissions, allowing only admin users to access this view.
+
+    Methods:
+        post(request): Handles the POST request for bulk registration.
+
+    Example:
+        Send a POST request with a list of user objects. The response reports
+        for every row whether the user was created or why it was rejected.
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def post(self, request):
+        """Register a list of users.
+
+        Args:
+            request: The incoming request containing a list of users.
+
+        Returns:
+            Response: A per-row report of created and rejected users, or an error
+                      message if the batch itself is not acceptable.
+        """
+        if sharding.is_enabled():
+            return Response(
+                {"error": "Bulk registration is not available when users are sharded."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {"error": "Expected a non-empty list of users."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(rows) > settings.BULK_REGISTRATION_MAX_USERS:
+            return Response(
+                {
+                    "error": f"A batch may contain at most {settings.BULK_REGISTRATION_MAX_USERS} users."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            results = BulkUserRegistration(rows).run()
+        except IntegrityError:
+            return Response(
+                {
+                    "error": "A conflicting user was created concurrently, please retry the batch."
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        created = sum(1 for result in results if result["status"] == "created")
+        return Response(
+            {"created": created, "failed": len(results) - created, "results": results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class BulkUserUpdateView(APIView):
+    """View for bulk user updates.
+
+    Extends rest_framework.views.APIView to update a list of users in one request, for
+    example to renumber phones or correct names. Only admin users can access this view.
+    Users are read and updated on the primary database, so the view is refused when
+    users are sharded, see users.sharding.
+
+    Attributes:
+        permission_classes (tuple): Tuple of permissions, allowing only admin users to access this view.
+
+    Methods:
+        patch(request): Handles the PATCH request for bulk updates.
+
+    Example:
+        Send a PATCH request with a list of objects like {"id": 42, "phone": "+15550100"}.
+        The response reports for every row whether the user was updated or why the row
+        was rejected.
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def patch(self, request):
+        """Update a list of users.
+
+        Args:
+            request: The incoming request containing a list of user ids and changes.
+
+        Returns:
+            Response: A per-row report of updated and rejected rows, or an error
+                      message if the batch itself is not acceptable.
+        """
+        if sharding.is_enabled():
+            return Response(
+                {"error": "Bulk updates are not available when users are sharded."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {"error": "Expected a non-empty list of user changes."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(rows) > settings.BULK_UPDATE_MAX_USERS:
+            return Response(
+                {
+                    "error": f"A batch may contain at most {settings.BULK_UPDATE_MAX_USERS} users."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            results = BulkUserUpdate(rows).run()
+        except IntegrityError:
+            return Response(
+                {
+                    "error": "A conflicting change was made concurrently, please retry the batch."
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        updated = sum(1 for result in results if result["status"] == "updated")
+        return Response(
+            {"updated": updated, "failed": len(results) - updated, "results": results},
+            status=status.HTTP_200_OK if updated else status.HTTP_400_BAD_REQUEST,
+        )
+
+
 class UserLoginView(APIView):
     """View for user login.
 
     Extends rest_framework.views.APIView to handle user login.
     Authenticates the user and returns a token upon successful login.
+    The user and an existing token are fetched with a single query; the token is
+    only created when the user has none yet. With the SIGNED_TOKENS setting, the
+    response also holds a signed access token and a refresh token, see users.tokens.
+    Attempts are throttled per client IP and per email before the user is looked up,
+    excess attempts are answered with a 429 response and a Retry-After header.
+
+    Attributes:
+        authentication_classes (tuple): Empty, login needs no authentication.
+        throttle_classes (tuple): The throttles limiting login attempts.
 
     Methods:
         post(request): Handles the POST request for user login.
 
+        get_token(user): Returns the token of the user, creating it if missing.
+
     Example:
         To authenticate a user, send a POST request with email and password.
         If successful, a token will be returned.
     """
 
+    authentication_classes = ()
+    throttle_classes = (LoginIPThrottle, LoginEmailThrottle)
+
     def post(self, request):
         """Login user.
 
@@ -62,11 +242,178 @@ class UserLoginView(APIView):
         password = request.data.get("password")
         user = authenticate(request, email=email, password=password)
         if user:
-            token, _ = Token.objects.get_or_create(user=user)
-            return Response({"token": token.key})
+            token = self.get_token(user)
+            data = {"token": token.key}
+            if settings.SIGNED_TOKENS:
+                data.update(tokens.issue_tokens(user))
+            return Response(data)
 
         return Response({"error": "Invalid credentials"}, status=401)
 
+    def get_token(self, user):
+        """Get the token of the user, creating it if missing.
+
+        Args:
+            user (User): The authenticated user, with its token selected by EmailBackend.
+
+        Returns:
+            Token: The token of the user.
+        """
+        try:
+            return user.auth_token
+        except Token.DoesNotExist:
+            pass
+
+        # When users are sharded, the token is stored on the shard of the user.
+        using = sharding.db_for_user(user)
+        try:
+            with transaction.atomic(using=using):
+                return Token.objects.db_manager(using).create(
+                    user=user, key=sharding.new_token_key(user)
+                )
+        except IntegrityError:
+            # Another request of the same user created the token concurrently.
+            return Token.objects.db_manager(using).get(user=user)
+
+
+class TokenRefreshView(APIView):
+    """View for getting a new signed access token.
+
+    Extends rest_framework.views.APIView to exchange a refresh token for a new access
+    token. Unlike access tokens, refresh tokens are checked against the token version of
+    their user in the database, so a revoked refresh token is refused right away.
+
+    Attributes:
+        authentication_classes (tuple): Empty, the refresh token is the credential.
+
+    Methods:
+        post(request): Handles the POST request with the refresh token.
+    """
+
+    authentication_classes = ()
+
+    def post(self, request):
+        """Return a new access token.
+
+        Args:
+            request: The incoming request, with the refresh token as "refresh".
+
+        Returns:
+            Response: The access token and its lifetime, or an error message.
+        """
+        try:
+            user_id, token_version = tokens.read_refresh_token(
+                str(request.data.get("refresh", ""))
+            )
+        except signing.BadSignature:
+            return Response({"error": "Invalid refresh token"}, status=401)
+
+        user = (
+            get_user_model()
+            .objects.for_id(user_id)
+            .filter(pk=user_id, token_version=token_version, is_active=True)
+            .only("id", "token_version")
+            .first()
+        )
+        if user is None:
+            return Response({"error": "Invalid refresh token"}, status=401)
+
+        return Response(
+            {
+                "access": tokens.issue_access_token(user),
+                "expires_in": settings.ACCESS_TOKEN_LIFETIME,
+            }
+        )
+
+
+class TokenRevokeView(APIView):
+    """View for revoking signed tokens.
+
+    Extends rest_framework.views.APIView to revoke every signed access and refresh token
+    of the authenticated user. Tokens of rest_framework.authtoken are left untouched.
+
+    Attributes:
+        permission_classes (tuple): Tuple of permissions, requiring user authentication.
+
+    Methods:
+        post(request): Handles the POST request revoking the tokens.
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        """Revoke the signed tokens of the authenticated user.
+
+        Args:
+            request: The authenticated request.
+
+        Returns:
+            Response: An empty 204 response.
+        """
+        tokens.revoke_tokens(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TokenIntrospectionView(APIView):
+    """View for checking many tokens at once.
+
+    Extends rest_framework.views.APIView to let internal services, such as gateways,
+    check the tokens of a whole batch of requests in one call instead of calling
+    details/ once per token. Only services sending one of the SERVICE_CREDENTIALS can
+    access this view.
+
+    Attributes:
+        authentication_classes (tuple): Empty, the service credential is checked instead.
+        permission_classes (tuple): Tuple of permissions, allowing only internal services.
+
+    Methods:
+        post(request): Handles the POST request with the token keys.
+
+    Example:
+        Send a POST request with a list of token keys. The response lists, in the same
+        order, every key with the id of its user and whether it authenticates the user:
+        unknown tokens have no user id, tokens of inactive users are not active.
+    """
+
+    authentication_classes = ()
+    permission_classes = (HasServiceCredential,)
+
+    def post(self, request):
+        """Introspect a list of token keys.
+
+        Args:
+            request: The incoming request containing a list of token keys.
+
+        Returns:
+            Response: The user id and active status of every key, or an error message
+                      if the list is not acceptable.
+        """
+        keys = request.data
+        if (
+            not isinstance(keys, list)
+            or not keys
+            or not all(isinstance(key, str) for key in keys)
+        ):
+            return Response(
+                {"error": "Expected a non-empty list of token keys."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(keys) > settings.TOKEN_INTROSPECTION_MAX_KEYS:
+            return Response(
+                {
+                    "error": f"A batch may contain at most {settings.TOKEN_INTROSPECTION_MAX_KEYS} tokens."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        found = authentication.introspect_tokens(keys)
+        results = []
+        for key in keys:
+            user_id, active = found.get(key, (None, False))
+            results.append({"token": key, "active": active, "user_id": user_id})
+        return Response({"results": results})
+
 
 class UserDetailsView(generics.RetrieveAPIView):
     """View for user details.
@@ -79,12 +426,52 @@ class UserDetailsView(generics.RetrieveAPIView):
         permission_classes (tuple): Tuple of permissions, requiring user authentication to access this view.
 
     Methods:
+        get(request): Handles the GET request, replying 304 when the client's copy is current.
+
         get_object(): Retrieves the user object based on the current authenticated user.
     """
 
     serializer_class = UserSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    def get(self, request, *args, **kwargs):
+        """Get user details, conditionally.
+
+        Replies 304 without serializing when the If-None-Match or If-Modified-Since
+        headers match the current version of the user. JSON payloads are served from
+        users.payloads.payload_cache when the version was rendered before.
+
+        Args:
+            request: The authenticated request.
+
+        Returns:
+            HttpResponse: The user details with ETag and Last-Modified headers, or a 304
+                          response.
+        """
+        user = self.get_object()
+        not_modified = payloads.conditional_response(request, user)
+        if not_modified is not None:
+            return not_modified
+
+        renderer = request.accepted_renderer
+        if isinstance(renderer, JSONRenderer):
+            data, payload = payloads.cached_payload(
+                user,
+                request.accepted_media_type,
+                lambda: serializers.user_read_serializer.to_representation(user),
+                lambda data: renderer.render(
+                    data, request.accepted_media_type, self.get_renderer_context()
+                ),
+            )
+            response = Response(data)
+            # Setting the content marks the response as rendered.
+            response.content = payload
+            response["Content-Type"] = renderer.media_type
+        else:
+            response = self.retrieve(request, *args, **kwargs)
+        payloads.set_validators(response, user)
+        return response
+
     def get_object(self):
         """Get user details.
 
@@ -100,12 +487,18 @@ class EditUserView(generics.UpdateAPIView):
     Extends rest_framework.generics.UpdateAPIView to edit user information.
     Requires authentication and checks if the requesting user is the owner.
 
+    request.user may be a snapshot from the token cache, older than the database. The
+    user is therefore read again and locked before it is changed, so that saving it
+    writes no stale values back.
+
     Attributes:
         permission_classes (tuple): Tuple of permissions, requiring user
             authentication and ownership to access this view.
         serializer_class (class): The serializer class for editing user information.
 
     Methods:
+        update(request, *args, **kwargs): Updates the user within a transaction.
+
         get_object(): Retrieves the user object based on the current authenticated user.
     """
 
@@ -115,10 +508,171 @@ class EditUserView(generics.UpdateAPIView):
     )
     serializer_class = UserSerializer
 
+    def update(self, request, *args, **kwargs):
+        """Update the user within a transaction on its database.
+
+        Returns:
+            Response: The updated user details, or the validation errors.
+        """
+        with transaction.atomic(using=sharding.shard_for_id(request.user.pk)):
+            return super().update(request, *args, **kwargs)
+
     def get_object(self):
         """Get user object for editing.
 
         Returns:
-            User: The user object of the currently authenticated user.
+            User: The currently authenticated user, read from the database and locked
+                  until the end of the transaction.
+
+        Raises:
+            Http404: If the user was deleted.
         """
-        return self.request.user
+        pk = self.request.user.pk
+        user = generics.get_object_or_404(
+            User.objects.for_id(pk).select_for_update(), pk=pk
+        )
+        self.check_object_permissions(self.request, user)
+        return user
+
+
+class UserExportView(APIView):
+    """View for exporting users.
+
+    Extends rest_framework.views.APIView to stream every user as NDJSON or CSV.
+    Only admin users can access this view. Under ASGI, the users are read and encoded
+    through the async ORM, see users.export.
+
+    Attributes:
+        permission_classes (tuple): Tuple of permissions, allowing only admin users to access this view.
+
+    Methods:
+        get(request): Handles the GET request for the export.
+
+    Example:
+        GET /api/v1/user/export/?output=csv&updated_since=2024-03-01T00:00:00Z
+        streams the users changed since March 2024 as CSV. The output defaults to NDJSON.
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def perform_content_negotiation(self, request, force=False):
+        """Accept any Accept header, the export picks its own content type."""
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        """Stream the users.
+
+        Args:
+            request: The incoming request, optionally with output and updated_since parameters.
+
+        Returns:
+            StreamingHttpResponse: The users, one per line, or an error message for
+                                   invalid parameters.
+        """
+        export_format = request.query_params.get("output", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"output must be one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        queryset = User.objects.all()
+        updated_since = request.query_params.get("updated_since")
+        if updated_since:
+            try:
+                since = parse_datetime(updated_since)
+            except ValueError:
+                # Well formatted, but out of range, such as month 13.
+                since = None
+            if since is None:
+                return Response(
+                    {"error": "updated_since must be an ISO 8601 date and time."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        fields = export_fields()
+        if settings.SERVER_MODE == "asgi":
+            # An async iterator, which ASGI servers stream without reading it all first.
+            content = aencode_rows(
+                aexport_rows(queryset, fields), fields, export_format
+            )
+        else:
+            content = encode_rows(export_rows(queryset, fields), fields, export_format)
+        response = StreamingHttpResponse(
+            content, content_type=EXPORT_FORMATS[export_format]
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="users.{export_format}"'
+        )
+        return response
+
+
+class UserListView(generics.ListAPIView):
+    """View for listing users.
+
+    Extends rest_framework.generics.ListAPIView to page through users, newest first,
+    with keyset pagination. Only admin users can access this view.
+
+    Attributes:
+        serializer_class (class): The serializer class for the user list.
+        permission_classes (tuple): Tuple of permissions, allowing only admin users to access this view.
+        pagination_class (class): The keyset pagination on (date_joined, id).
+
+    Methods:
+        list(request): Handles the GET request, returning a page of users.
+
+        get_queryset(): Returns the users matching the is_active and email filters.
+
+    Example:
+        GET /api/v1/user/?is_active=true&email=john returns the first page of active users
+        whose email starts with "john". Follow the next link for the next page.
+    """
+
+    serializer_class = UserListSerializer
+    permission_classes = (permissions.IsAdminUser,)
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        """List a page of users.
+
+        The page is serialized by user_list_read_serializer, the compiled version of
+        serializer_class.
+
+        Args:
+            request: The authenticated request.
+
+        Returns:
+            Response: The users of the page and the link to the next one.
+        """
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(
+            serializers.user_list_read_serializer.many(page)
+        )
+
+    def get_queryset(self):
+        """Get the users matching the filters.
+
+        Returns:
+            QuerySet: The users, filtered on is_active and email prefix if requested.
+
+        Raises:
+            ValidationError: If is_active is not a boolean.
+        """
+        queryset = User.objects.all()
+        params = self.request.query_params
+
+        is_active = params.get("is_active")
+        if is_active is not None:
+            if is_active.lower() not in ("true", "false", "1", "0"):
+                raise ValidationError({"is_active": "Must be true or false."})
+            queryset = queryset.filter(is_active=is_active.lower() in ("true", "1"))
+
+        email = params.get("email")
+        if email:
+            queryset = queryset.filter(
+                email__startswith=User.objects.normalize_email(email)
+            )
+        return queryset
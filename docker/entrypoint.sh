@@ -1,4 +1,26 @@
 #!/bin/bash
-python manage.py migrate
-python manage.py collectstatic --noinput
-gunicorn --workers 5 --threads 8 --bind 0.0.0.0:8000 core.wsgi:application
+# Applies migrations to the primary database and every user shard, and collects static
+# files, only when a database misses migrations or the static files changed, see the
+# prepare_startup command. FULL_STARTUP=1 runs migrate and collectstatic on every boot.
+if [ "${FULL_STARTUP:-0}" = "1" ]; then
+    python manage.py prepare_startup --force
+else
+    python manage.py prepare_startup
+fi
+
+# Workers write their Prometheus samples to this directory, /metrics aggregates them.
+# Samples of a previous run are stale.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# gunicorn.conf.py loads the application in the master before forking the workers,
+# unless PRELOAD_APP=0.
+# SERVER_MODE=wsgi (default): sync gunicorn workers, each serving WORKERS x THREADS requests.
+# SERVER_MODE=asgi: gunicorn managing uvicorn workers, each serving many concurrent
+# requests on one event loop. Combine it with ASYNC_USER_VIEWS=1.
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    exec gunicorn --workers "${WORKERS:-5}" --worker-class uvicorn.workers.UvicornWorker \
+        --bind 0.0.0.0:8000 core.asgi:application
+fi
+exec gunicorn --workers "${WORKERS:-5}" --threads "${THREADS:-8}" --bind 0.0.0.0:8000 core.wsgi:application
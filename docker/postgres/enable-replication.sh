@@ -0,0 +1,5 @@
+#!/bin/bash
+# Runs once, when the primary initializes its data directory: lets the replica of
+# docker-compose.replica.yml stream the WAL with the credentials of POSTGRES_USER.
+# An existing postgres_data volume keeps its pg_hba.conf, remove the volume to apply it.
+echo "host replication all all md5" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,18 @@
+#!/bin/sh
+# Streaming replica of the postgres service, for testing read routing locally.
+# The first start copies the primary with pg_basebackup; -R writes the settings that
+# start this server as a hot standby following the primary.
+set -e
+
+export PGPASSWORD="$POSTGRES_PASSWORD"
+until pg_isready -h postgres -U "$POSTGRES_USER"; do
+    sleep 1
+done
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    pg_basebackup -h postgres -U "$POSTGRES_USER" -D "$PGDATA" -R -X stream
+fi
+chown -R postgres:postgres "$PGDATA"
+chmod 700 "$PGDATA"
+
+exec su-exec postgres postgres